@@ -30,17 +30,35 @@
 #  USA
 #
 
-from shutil import rmtree
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from shutil import rmtree, copyfile
 from sys import argv
-from tempfile import NamedTemporaryFile
+from array import array
+from tempfile import NamedTemporaryFile, mkdtemp
+import asyncio
+import copy
 import errno
+import fnmatch
+import hashlib
+import json
+import heapq
+import random
 import re
 import glob
+import math
 import string
+import struct
 import argparse
+import mmap
 import time
 import signal
+import socketserver
+import sqlite3
+import threading
 import sys, os
+import zlib
 
 try:
     import subprocess32 as subprocess
@@ -53,6 +71,9 @@ NO_OUTPUT   = 0
 WANT_OUTPUT = 1
 LOG_ERRORS  = 2
 
+### run_cmd() exit status for commands killed after --exec-timeout
+EXEC_TIMEOUT = -256
+
 def main():
 
     exit_success = 0
@@ -76,6 +97,9 @@ def main():
     if cargs.stop_afl:
         return not stop_afl(cargs)
 
+    if cargs.test_case_cov:
+        return not show_test_case_cov(cargs)
+
     if not validate_cargs(cargs):
         return exit_failure
 
@@ -91,6 +115,9 @@ def main():
     if cargs.live:
         is_afl_running(cargs)
 
+    if cargs.targets:
+        return not process_multi_target(cargs)
+
     return not process_afl_test_cases(cargs)
 
 def run_in_background():
@@ -110,7 +137,6 @@ def run_in_background():
 def process_afl_test_cases(cargs):
 
     rv        = True
-    run_once  = False
     tot_files = 0
     fuzz_dir  = ''
     curr_file = ''
@@ -119,9 +145,12 @@ def process_afl_test_cases(cargs):
     cov_paths = {}
 
     ### main coverage tracking dictionary
-    cov         = {}
-    cov['zero'] = {}
-    cov['pos']  = {}
+    cov = new_cov_state()
+    if per_test_coverage(cargs):
+        ### counters are reset before each test case
+        cov['non_cumulative'] = True
+    if cargs.state_db:
+        open_state_db(cov, cargs)
 
     while True:
 
@@ -129,6 +158,16 @@ def process_afl_test_cases(cargs):
             rv = False
             break
 
+        cov_paths['sample_deferred'] = 0
+
+        if cargs.cov_cache_dir and not cov['zero']:
+            ### test cases with cached results are never executed, so the
+            ### zero coverage starts from the initial lcov capture
+            seed_zero_cov(cov_paths, cov, cargs)
+
+        if cargs.metrics_listen and 'metrics_server' not in cov_paths:
+            start_metrics_server(cov_paths, cov, cargs)
+
         dir_ctr  = 0
         last_dir = False
 
@@ -142,22 +181,56 @@ def process_afl_test_cases(cargs):
             last_file = False
             num_files = 0
             new_files = []
-            tmp_files = import_test_cases(fuzz_dir + '/queue')
             dir_ctr  += 1
             f_ctr     = 0
 
             if dir_ctr == len(cov_paths['dirs']):
                 last_dir = True
 
-            for f in tmp_files:
-                if f not in afl_files:
-                    afl_files.append(f)
-                    new_files.append(f)
+            for qdir in test_case_dirs(fuzz_dir, cargs):
+                qdir_files = []
+                for f in import_test_cases(qdir):
+                    if f not in afl_files:
+                        qdir_files.append(f)
 
-            if new_files:
-                logr("\n*** Imported %d new test cases from: %s\n" \
-                        % (len(new_files), (fuzz_dir + '/queue')),
-                        cov_paths['log_file'], cargs)
+                if qdir_files:
+                    logr("\n*** Imported %d new test cases from: %s\n" \
+                            % (len(qdir_files), qdir),
+                            cov_paths['log_file'], cargs)
+
+                new_files += qdir_files
+
+            if cargs.sample_fraction:
+                ### the rest is picked up by later refinement passes
+                new_files = sample_test_cases(new_files, fuzz_dir, cov_paths,
+                        cargs)
+
+            afl_files += new_files
+
+            ### the id limit applies to the lowest ids, before --schedule
+            ### changes the order
+            if cargs.afl_queue_id_limit \
+                    and len(new_files) >= cargs.afl_queue_id_limit:
+                new_files = new_files[:cargs.afl_queue_id_limit]
+
+            ### coverage is still attributed to each test case by name, only
+            ### the processing order changes
+            new_files = TEST_CASE_SCHEDULERS[cargs.schedule](new_files, cargs)
+
+            if cargs.pipeline:
+                if cargs.afl_queue_id_limit \
+                        and len(new_files) >= cargs.afl_queue_id_limit:
+                    do_break = True
+                if new_files:
+                    curr_cycle = get_cycle_num(max(id_num(f)
+                            for f in new_files), cargs)
+                    tot_files += process_test_cases_pipelined(new_files,
+                            fuzz_dir, len(afl_files), cov_paths, cov, cargs)
+                if do_break:
+                    logr("[+] queue/ id limit of %d reached..." \
+                            % cargs.afl_queue_id_limit,
+                            cov_paths['log_file'], cargs)
+                continue
 
             for f in new_files:
 
@@ -171,7 +244,8 @@ def process_afl_test_cases(cargs):
                     do_coverage = True
 
                 out_lines = []
-                curr_cycle = get_cycle_num(num_files, cargs)
+                ### by id, --schedule can process test cases out of order
+                curr_cycle = get_cycle_num(id_num(f), cargs)
 
                 logr("[+] AFL test case: %s (%d / %d), cycle: %d" \
                         % (os.path.basename(f), num_files, len(afl_files),
@@ -181,15 +255,61 @@ def process_afl_test_cases(cargs):
                         (cov_paths['diff_dir'], os.path.basename(f))
                 id_range_update(f, cov_paths)
 
+                digest = ''
+                if not cargs.disable_test_case_dedup or cargs.cov_cache_dir:
+                    digest = hash_test_case(f)
+
+                ### AFL sync copies the same inputs into every fuzzer queue, so
+                ### byte-identical test cases are only executed once
+                dup_of = ''
+                if not cargs.disable_test_case_dedup:
+                    dup_of = dedup_test_case(digest, f, cov_paths)
+
+                cached_cov = None
+                if cargs.cov_cache_dir and not dup_of:
+                    cached_cov = load_cached_cov(digest, cov_paths, cov)
+
+                ### inputs without new AFL edges skip the gcov exec and capture
+                ### until the next verification sweep
+                prefiltered = False
+                if cargs.showmap_cmd and not dup_of and cached_cov is None:
+                    prefiltered = not showmap_new_edges(f, cov_paths, cargs)
+
+                if per_test_coverage(cargs) and not dup_of:
+                    ### only measure the coverage of this test case
+                    reset_gcda(cov_paths['gcda_files'])
+
                 ### execute the command to generate code coverage stats
                 ### for the current AFL test case file
-                if run_once:
-                    run_cmd(cargs.coverage_cmd.replace('AFL_FILE', f),
-                            cov_paths['log_file'], cargs, NO_OUTPUT)
+                if dup_of:
+                    record_duplicate(f, dup_of, curr_cycle, cov_paths, cargs)
+                    if cargs.exact_coverage:
+                        exact_store_dup(f, dup_of, cov_paths)
+                elif cached_cov is not None:
+                    logr("[+] Using cached coverage results, skipping exec",
+                            cov_paths['log_file'], cargs)
+                    cov_paths['stats']['cache_hits'] += 1
+                    cov['non_cumulative'] = True
+                elif prefiltered:
+                    logr("[-] No new afl-showmap edges, deferring gcov exec",
+                            cov_paths['log_file'], cargs)
+                    cov_paths['prefilter_skipped'].append(f)
+                    cov_paths['stats']['prefilter_skips'] += 1
+                elif cov_paths['run_once']:
+                    es = timed_stage(cov_paths, 'exec', run_cmd,
+                            cargs.coverage_cmd.replace('AFL_FILE', f),
+                            cov_paths['log_file'], cargs, NO_OUTPUT,
+                            env=test_case_env(f, cov_paths, cargs),
+                            exec_limits=True)[0]
+                    record_exec_status(es, cov_paths)
                 else:
-                    out_lines = run_cmd(cargs.coverage_cmd.replace('AFL_FILE', f),
-                            cov_paths['log_file'], cargs, WANT_OUTPUT)[1]
-                    run_once = True
+                    es, out_lines = timed_stage(cov_paths, 'exec', run_cmd,
+                            cargs.coverage_cmd.replace('AFL_FILE', f),
+                            cov_paths['log_file'], cargs, WANT_OUTPUT,
+                            env=test_case_env(f, cov_paths, cargs),
+                            exec_limits=True)
+                    record_exec_status(es, cov_paths)
+                    cov_paths['run_once'] = True
 
                 if cargs.afl_queue_id_limit \
                         and num_files >= cargs.afl_queue_id_limit - 1:
@@ -200,22 +320,65 @@ def process_afl_test_cases(cargs):
                     if cargs.cover_corpus and last_dir:
                         do_coverage = True
 
-                if do_coverage and not cargs.coverage_at_exit:
+                if is_interval_mode(cargs):
+                    ### capture once every --coverage-every test cases or
+                    ### --coverage-every-seconds seconds
+                    cov_paths['interval_files'] += 1
+                    do_coverage = coverage_interval_reached(cov_paths, cargs) \
+                            or (last_dir and (last_file or do_break))
+
+                ### nothing went from zero to nonzero in the gcda counters,
+                ### so there is nothing new for lcov to find
+                unchanged = False
+                if cargs.gcda_novelty and do_coverage and not dup_of \
+                        and cached_cov is None and not prefiltered:
+                    unchanged = not gcda_new_counters(cov_paths)
+                    if unchanged:
+                        logr("[-] No new gcda counters, skipping coverage capture",
+                                cov_paths['log_file'], cargs)
+                        cov_paths['novelty_skipped'].append(f)
+                        cov_paths['stats']['novelty_skips'] += 1
+                    elif cov_paths['novelty_skipped']:
+                        ### verify the skipped test cases from the counters
+                        ### they left behind, so that the capture below only
+                        ### finds what this test case added
+                        novelty_sweep(curr_cycle, fuzz_dir, cov_paths, cov,
+                                cargs, snapshot=True)
+
+                if do_coverage and not cargs.coverage_at_exit and not prefiltered \
+                        and not unchanged \
+                        and (not dup_of or use_id_ranges(cargs)):
 
                     ### generate the code coverage stats for this test case
-                    lcov_gen_coverage(cov_paths, cargs)
+                    if cached_cov is None:
+                        lcov_gen_coverage(cov_paths, cargs)
+
+                        if per_test_coverage(cargs):
+                            cached_cov = timed_stage(cov_paths, 'extract',
+                                    extract_coverage,
+                                    cov_paths['lcov_info_final'],
+                                    cov_paths['log_file'], cargs,
+                                    cov['branch_map'])
+                            if cargs.cov_cache_dir and cached_cov:
+                                store_cached_cov(digest, cached_cov,
+                                        cov_paths, cov)
+
+                    if cargs.exact_coverage:
+                        exact_store_add(f, cached_cov or {}, cov_paths, cov)
+                    if cargs.sample_fraction:
+                        sample_incidence_add(cached_cov, cov_paths, cov)
 
                     ### diff to the previous code coverage, look for new
                     ### lines/functions, and write out results
-                    coverage_diff(curr_cycle, fuzz_dir, cov_paths, f,
-                            cov, cargs)
+                    delta = coverage_diff(curr_cycle, fuzz_dir, cov_paths,
+                            f, cov, cargs, cached_cov)
 
-                    if cargs.cover_corpus:
+                    if use_id_ranges(cargs):
                         ### reset the range values
-                        cov_paths['id_min'] = cov_paths['id_max'] = -1
+                        reset_id_range(cov_paths)
 
-                    if cargs.lcov_web_all:
-                        gen_web_cov_report(fuzz_dir, cov_paths, cargs)
+                    if delta and web_reports_enabled(cargs):
+                        request_web_report(fuzz_dir, cov_paths, cov, cargs)
 
                     ### log the output of the very first coverage command to
                     ### assist in troubleshooting
@@ -227,14 +390,43 @@ def process_afl_test_cases(cargs):
                             logr("    %s" % (line), cov_paths['log_file'], cargs)
                         logr("++++++ END\n", cov_paths['log_file'], cargs)
 
-                cov_paths['id_file'] = "%s" % os.path.basename(f)
+                if cov_paths['prefilter_skipped'] and (last_file or do_break \
+                        or len(cov_paths['prefilter_skipped']) \
+                            >= cargs.showmap_verify):
+                    prefilter_sweep(curr_cycle, fuzz_dir, cov_paths, cov,
+                            cargs)
+
+                if cov_paths['novelty_skipped'] and (last_file or do_break \
+                        or len(cov_paths['novelty_skipped']) \
+                            >= cargs.gcda_novelty_verify):
+                    novelty_sweep(curr_cycle, fuzz_dir, cov_paths, cov, cargs)
+
+                if not dup_of:
+                    cov_paths['id_file'] = "%s" % os.path.basename(f)
 
                 num_files += 1
                 tot_files += 1
+                count_processed(fuzz_dir, cov_paths)
 
                 if do_break:
                     break
 
+        if is_interval_mode(cargs) and cov_paths['interval_files']:
+            ### flush test cases from earlier fuzzing dirs when the last
+            ### one had nothing new to process
+            lcov_gen_coverage(cov_paths, cargs)
+            coverage_diff(curr_cycle, fuzz_dir, cov_paths,
+                    cov_paths['id_file'], cov, cargs)
+            reset_id_range(cov_paths)
+
+        if cov_paths['sample_deferred']:
+            ### publish an estimate for this sample and refine it with a
+            ### larger one
+            publish_coverage_estimate(cov_paths, cov, cargs,
+                    len(afl_files) + cov_paths['sample_deferred'])
+            cov_paths['sample_pass'] += 1
+            continue
+
         if cargs.live:
             if is_afl_fuzz_running(cargs):
                 if not len(new_files):
@@ -251,26 +443,8 @@ def process_afl_test_cases(cargs):
             break
 
     if tot_files > 0:
-        logr("[+] Processed %d / %d test cases.\n" \
-                % (tot_files, len(afl_files)),
-                cov_paths['log_file'], cargs)
-
-        if cargs.coverage_at_exit:
-            ### generate the code coverage stats for this test case
-            lcov_gen_coverage(cov_paths, cargs)
-
-            ### diff to the previous code coverage, look for new
-            ### lines/functions, and write out results
-            coverage_diff(curr_cycle, fuzz_dir, cov_paths,
-                    cov_paths['id_file'], cov, cargs)
-
-        ### write out the final zero coverage and positive coverage reports
-        write_zero_cov(cov['zero'], cov_paths, cargs)
-        write_pos_cov(cov['pos'], cov_paths, cargs)
-
-        if not cargs.disable_lcov_web:
-            lcov_gen_coverage(cov_paths, cargs)
-            gen_web_cov_report(fuzz_dir, cov_paths, cargs)
+        write_final_reports(tot_files, len(afl_files), curr_cycle, fuzz_dir,
+                cov_paths, cov, cargs)
 
     else:
         if rv:
@@ -278,11 +452,1268 @@ def process_afl_test_cases(cargs):
                     cov_paths['log_file'], cargs)
         rv = False
 
+    if cargs.state_db:
+        close_state_db(cov)
+    finish_tracking(cov_paths)
+
     return rv
 
+def finish_tracking(cov_paths):
+
+    if cov_paths.get('metrics_server'):
+        stop_metrics_server(cov_paths)
+
+    if cov_paths.get('staging_dir'):
+        persist_staged_trace(cov_paths)
+        rmtree(cov_paths['staging_dir'], ignore_errors=True)
+
+    return
+
+def target_cargs(cargs):
+    ### per target copies of the command line args
+    tlist = []
+    for name, cmd, code_dir in cargs.targets:
+        tcargs = copy.copy(cargs)
+        tcargs.coverage_cmd = cmd
+        tcargs.code_dir     = code_dir
+        tcargs.target_name  = name
+        tcargs.targets      = []
+        tlist.append(tcargs)
+    return tlist
+
+def process_multi_target(cargs):
+
+    ### one pass over the queue for several coverage builds: each test case
+    ### is read and hashed once and then replayed against all targets in
+    ### parallel, with separate cov/<name>/ results per target
+    targets = []
+    for tcargs in target_cargs(cargs):
+        t = {'cargs': tcargs, 'cov_paths': {}, 'cov': new_cov_state(),
+                'tot_files': 0}
+        if not import_fuzzing_dirs(t['cov_paths'], tcargs):
+            return False
+        targets.append(t)
+
+    rv         = True
+    afl_files  = []
+    fuzz_dir   = ''
+    curr_cycle = 0
+    executor   = ThreadPoolExecutor(max_workers=len(targets))
+
+    def log_all(msg):
+        for t in targets:
+            logr(msg, t['cov_paths']['log_file'], t['cargs'])
+
+    while True:
+
+        new_files = []
+        for t in targets:
+            import_fuzzing_dirs(t['cov_paths'], t['cargs'])
+
+        for fuzz_dir in targets[0]['cov_paths']['dirs']:
+
+            dir_files = []
+            for qdir in test_case_dirs(fuzz_dir, cargs):
+                qdir_files = [f for f in import_test_cases(qdir)
+                        if f not in afl_files]
+                if qdir_files:
+                    log_all("\n*** Imported %d new test cases from: %s\n" \
+                            % (len(qdir_files), qdir))
+                dir_files += qdir_files
+            afl_files += dir_files
+
+            ### the id limit applies to the lowest ids, before --schedule
+            ### changes the order
+            if cargs.afl_queue_id_limit \
+                    and len(dir_files) > cargs.afl_queue_id_limit:
+                dir_files = dir_files[:cargs.afl_queue_id_limit]
+                log_all("[+] queue/ id limit of %d reached..." \
+                        % cargs.afl_queue_id_limit)
+            dir_files = TEST_CASE_SCHEDULERS[cargs.schedule](dir_files, cargs)
+
+            for num_files, f in enumerate(dir_files):
+                curr_cycle = get_cycle_num(id_num(f), cargs)
+                log_all("[+] AFL test case: %s (%d / %d), cycle: %d" \
+                        % (os.path.basename(f), num_files, len(afl_files),
+                        curr_cycle))
+
+                digest = ''
+                if not cargs.disable_test_case_dedup:
+                    digest = hash_test_case(f)
+
+                list(executor.map(lambda t: replay_target_test_case(f,
+                        digest, curr_cycle, fuzz_dir, t), targets))
+                new_files.append(f)
+
+        if cargs.live:
+            if is_afl_fuzz_running(cargs):
+                if not new_files:
+                    log_all("[-] No new AFL test cases, sleeping for %d " \
+                            "seconds" % cargs.sleep)
+                    time.sleep(cargs.sleep)
+                continue
+            log_all("[+] afl-fuzz appears to be stopped...")
+        break
+
+    executor.shutdown()
+
+    for t in targets:
+        if t['tot_files'] > 0:
+            write_final_reports(t['tot_files'], len(afl_files), curr_cycle,
+                    fuzz_dir, t['cov_paths'], t['cov'], t['cargs'])
+        else:
+            logr("[*] Did not find any AFL test cases, exiting.\n",
+                    t['cov_paths']['log_file'], t['cargs'])
+            rv = False
+        finish_tracking(t['cov_paths'])
+
+    return rv
+
+def replay_target_test_case(afl_file, digest, cycle_num, fuzz_dir, t):
+
+    cargs     = t['cargs']
+    cov_paths = t['cov_paths']
+    cov       = t['cov']
+
+    cov_paths['diff'] = "%s/%s" % (cov_paths['diff_dir'],
+            os.path.basename(afl_file))
+    t['tot_files'] += 1
+
+    dup_of = ''
+    if digest:
+        dup_of = dedup_test_case(digest, afl_file, cov_paths)
+    if dup_of:
+        record_duplicate(afl_file, dup_of, cycle_num, cov_paths, cargs)
+        return
+
+    collect = NO_OUTPUT
+    if not cov_paths['run_once']:
+        collect = WANT_OUTPUT
+        cov_paths['run_once'] = True
+    es, out_lines = timed_stage(cov_paths, 'exec', run_cmd,
+            cargs.coverage_cmd.replace('AFL_FILE', afl_file),
+            cov_paths['log_file'], cargs, collect,
+            env=test_case_env(afl_file, cov_paths, cargs), exec_limits=True)
+    record_exec_status(es, cov_paths)
+
+    lcov_gen_coverage(cov_paths, cargs)
+    delta = coverage_diff(cycle_num, fuzz_dir, cov_paths, afl_file, cov,
+            cargs)
+    if delta and web_reports_enabled(cargs):
+        request_web_report(fuzz_dir, cov_paths, cov, cargs)
+
+    if len(out_lines):
+        logr("\n\n++++++ BEGIN - first exec output for CMD: %s" % \
+                (cargs.coverage_cmd.replace('AFL_FILE', afl_file)),
+                cov_paths['log_file'], cargs)
+        for line in out_lines:
+            logr("    %s" % (line), cov_paths['log_file'], cargs)
+        logr("++++++ END\n", cov_paths['log_file'], cargs)
+
+    cov_paths['id_file'] = os.path.basename(afl_file)
+    count_processed(fuzz_dir, cov_paths)
+
+    return
+
+def write_final_reports(tot_files, num_afl_files, curr_cycle, fuzz_dir,
+        cov_paths, cov, cargs):
+
+    logr("[+] Processed %d / %d test cases.\n" \
+            % (tot_files, num_afl_files),
+            cov_paths['log_file'], cargs)
+
+    if cov_paths['stats']['duplicates']:
+        logr("[+] Skipped %d duplicate test cases.\n" \
+                % cov_paths['stats']['duplicates'],
+                cov_paths['log_file'], cargs)
+
+    if cov_paths['stats']['timeouts']:
+        logr("[+] Killed %d test case executions after the %d second " \
+                "--exec-timeout.\n" % (cov_paths['stats']['timeouts'],
+                cargs.exec_timeout), cov_paths['log_file'], cargs)
+
+    if cov_paths['stats']['exec_failures']:
+        logr("[+] Non-zero exit status for %d test case executions.\n" \
+                % cov_paths['stats']['exec_failures'],
+                cov_paths['log_file'], cargs)
+
+    if cov_paths['stats']['cache_hits']:
+        logr("[+] Used cached coverage results for %d test cases.\n" \
+                % cov_paths['stats']['cache_hits'],
+                cov_paths['log_file'], cargs)
+
+    if cov_paths['stats']['prefilter_skips']:
+        logr("[+] Deferred %d test cases without new afl-showmap edges, " \
+                "%d verification sweeps found missed coverage.\n" \
+                % (cov_paths['stats']['prefilter_skips'],
+                cov_paths['stats']['prefilter_misses']),
+                cov_paths['log_file'], cargs)
+
+    if cov_paths['stats']['novelty_skips']:
+        logr("[+] Skipped the capture for %d test cases without new gcda " \
+                "counters, %d verification captures found missed coverage.\n" \
+                % (cov_paths['stats']['novelty_skips'],
+                cov_paths['stats']['novelty_misses']),
+                cov_paths['log_file'], cargs)
+
+    if cargs.coverage_at_exit:
+        ### generate the code coverage stats for this test case
+        lcov_gen_coverage(cov_paths, cargs)
+
+        ### diff to the previous code coverage, look for new
+        ### lines/functions, and write out results
+        coverage_diff(curr_cycle, fuzz_dir, cov_paths,
+                cov_paths['id_file'], cov, cargs)
+
+    if cargs.exact_coverage:
+        exact_store_columns(cov_paths, cargs)
+
+    if cargs.minimize:
+        minimize_corpus(cov_paths, cargs)
+
+    if cargs.sample_fraction:
+        publish_coverage_estimate(cov_paths, cov, cargs, num_afl_files)
+
+    if cov['non_cumulative']:
+        prune_zero_cov(cov['pos'], cov)
+
+    if cov_paths['web_reports']:
+        ### the final report below supersedes any pending one
+        cov_paths['web_reports'].stop()
+
+    ### write out the final zero coverage and positive coverage reports
+    write_zero_cov(cov['zero'], cov_paths, cargs, cov['branch_map'])
+    write_pos_cov(cov['pos'], cov_paths, cargs, cov['branch_map'])
+    if cargs.id_delta_bin:
+        id_delta_bin_write(cov_paths)
+
+    if not cargs.disable_lcov_web:
+        lcov_gen_coverage(cov_paths, cargs)
+        if cov['non_cumulative']:
+            ### the gcda counters do not reflect all test cases, so
+            ### mark everything in cov['pos'] as executed for genhtml
+            write_lcov_pos(cov_paths, cov, cargs)
+        gen_web_cov_report(fuzz_dir, cov_paths, cargs)
+
+    return
+
+def new_cov_state():
+    cov         = {}
+    cov['zero'] = {}
+    cov['pos']  = {}
+    cov['branch_map'] = {}  ### src file -> (line, block, branch) bit index
+    cov['totals'] = {'line': 0, 'function': 0, 'branch': 0}
+    cov['universe'] = {'line': 0, 'function': 0, 'branch': 0}
+    cov['non_cumulative'] = False  ### set when gcda counters miss some coverage
+    return cov
+
+class CoverageStateStore(object):
+
+    ### cov['pos'] or cov['zero'] kept in an sqlite database (--state-db)
+    ### instead of a dictionary. Source file entries have the usual
+    ### {'function': {}, 'line': {}, 'branch': 0} layout and are loaded on
+    ### access into an LRU working set of at most --state-cache-files
+    ### entries. Entries that changed are written back in batches as they
+    ### are evicted, so memory use no longer grows with the code base.
+
+    def __init__(self, db, kind, cache_files):
+        self.db          = db
+        self.kind        = kind
+        self.cache_files = max(1, cache_files)
+        self.files       = {}  ### src file -> stored counts, None if unwritten
+        self.cache       = OrderedDict()
+        self.loaded      = {}  ### src file -> counts when it was cached
+
+    def __contains__(self, src_file):
+        return src_file in self.files
+
+    def __len__(self):
+        return len(self.files)
+
+    def __iter__(self):
+        return iter(list(self.files))
+
+    def get(self, src_file, default=None):
+        if src_file not in self.files:
+            return default
+        return self[src_file]
+
+    def __getitem__(self, src_file):
+        if src_file in self.cache:
+            self.cache.move_to_end(src_file)
+            return self.cache[src_file]
+        if src_file not in self.files:
+            raise KeyError(src_file)
+
+        row = self.db.execute("SELECT function, line, branch FROM cov " \
+                "WHERE kind = ? AND file = ?", (self.kind, src_file)).fetchone()
+        entry = {'function': dict.fromkeys(row[0].split('\n'), '') \
+                    if row[0] else {},
+                'line': dict.fromkeys(row[1].split('\n'), '') \
+                    if row[1] else {},
+                'branch': int.from_bytes(row[2], 'little')}
+        self.cache_entry(src_file, entry, self.files[src_file])
+        return entry
+
+    def __setitem__(self, src_file, entry):
+        if src_file not in self.files:
+            self.files[src_file] = None
+        self.cache.pop(src_file, None)
+        self.cache_entry(src_file, entry, None)
+
+    def __delitem__(self, src_file):
+        del self.files[src_file]
+        self.cache.pop(src_file, None)
+        self.loaded.pop(src_file, None)
+        self.db.execute("DELETE FROM cov WHERE kind = ? AND file = ?",
+                (self.kind, src_file))
+
+    def counts(self, src_file):
+        if src_file in self.cache:
+            return cov_entry_counts(self.cache[src_file])
+        return self.files.get(src_file)
+
+    def retain(self, src_files):
+        for src_file in self:
+            if src_file not in src_files:
+                del self[src_file]
+
+    def cache_entry(self, src_file, entry, counts):
+        self.cache[src_file] = entry
+        self.loaded[src_file] = counts
+        if len(self.cache) > self.cache_files:
+            self.evict(max(1, self.cache_files * 3 // 4))
+
+    def evict(self, keep):
+        rows = []
+        while len(self.cache) > keep:
+            src_file, entry = self.cache.popitem(last=False)
+            counts = cov_entry_counts(entry)
+            if self.loaded.pop(src_file) != counts:
+                rows.append((self.kind, src_file,
+                        '\n'.join(entry['function']),
+                        '\n'.join(entry['line']),
+                        entry['branch'].to_bytes(
+                            (entry['branch'].bit_length() + 7) // 8,
+                            'little')))
+                self.files[src_file] = counts
+        if rows:
+            self.db.executemany("INSERT OR REPLACE INTO cov " \
+                    "VALUES (?, ?, ?, ?, ?)", rows)
+            self.db.commit()
+        return
+
+class BranchMapStore(object):
+
+    ### cov['branch_map'] kept in the --state-db database next to the
+    ### coverage state. Source file entries are the usual {'ids': {},
+    ### 'keys': []} branch index and are loaded on access into an LRU
+    ### working set of at most --state-cache-files entries. Entries only
+    ### ever grow, so those with new keys are written back as they are
+    ### evicted. Callers hold BRANCH_MAP_LOCK (see branch_bit()).
+
+    def __init__(self, db, cache_files):
+        self.db          = db
+        self.cache_files = max(1, cache_files)
+        self.files       = set()
+        self.cache       = OrderedDict()
+        self.loaded      = {}  ### src file -> number of keys when cached
+
+    def __contains__(self, src_file):
+        return src_file in self.files
+
+    def __getitem__(self, src_file):
+        if src_file in self.cache:
+            self.cache.move_to_end(src_file)
+            return self.cache[src_file]
+        if src_file not in self.files:
+            raise KeyError(src_file)
+
+        row = self.db.execute("SELECT keys FROM branch_map WHERE file = ?",
+                (src_file,)).fetchone()
+        keys = row[0].split('\n') if row[0] else []
+        entry = {'ids': dict((k, i) for i, k in enumerate(keys)),
+                'keys': keys}
+        self.cache_entry(src_file, entry, len(keys))
+        return entry
+
+    def __setitem__(self, src_file, entry):
+        self.files.add(src_file)
+        self.cache.pop(src_file, None)
+        self.cache_entry(src_file, entry, None)
+
+    def cache_entry(self, src_file, entry, num_keys):
+        self.cache[src_file] = entry
+        self.loaded[src_file] = num_keys
+        if len(self.cache) > self.cache_files:
+            self.evict(max(1, self.cache_files * 3 // 4))
+
+    def evict(self, keep):
+        rows = []
+        while len(self.cache) > keep:
+            src_file, entry = self.cache.popitem(last=False)
+            if self.loaded.pop(src_file) != len(entry['keys']):
+                rows.append((src_file, '\n'.join(entry['keys'])))
+        if rows:
+            self.db.executemany("INSERT OR REPLACE INTO branch_map " \
+                    "VALUES (?, ?)", rows)
+            self.db.commit()
+        return
+
+def cov_entry_counts(entry):
+    return (len(entry['function']), len(entry['line']),
+            popcount(entry['branch']))
+
+def open_state_db(cov, cargs):
+
+    ### scratch database, recreated for each run
+    if os.path.exists(cargs.state_db):
+        os.unlink(cargs.state_db)
+    db = sqlite3.connect(cargs.state_db, check_same_thread=False)
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+    db.execute("CREATE TABLE cov (kind TEXT, file TEXT, function TEXT, " \
+            "line TEXT, branch BLOB, PRIMARY KEY (kind, file))")
+    db.execute("CREATE TABLE branch_map (file TEXT PRIMARY KEY, keys TEXT)")
+    cov['pos']  = CoverageStateStore(db, 'pos', cargs.state_cache_files)
+    cov['zero'] = CoverageStateStore(db, 'zero', cargs.state_cache_files)
+    cov['branch_map'] = BranchMapStore(db, cargs.state_cache_files)
+    return
+
+def close_state_db(cov):
+    for k in ['pos', 'zero', 'branch_map']:
+        cov[k].evict(0)
+    cov['pos'].db.close()
+    return
+
+### options that CoverageTracker honors, everything else (--exact-coverage,
+### --state-db, --pipeline, the id range modes, ...) belongs to the queue
+### processing loop
+TRACKER_OPTIONS = ['coverage_backend', 'coverage_include_lines',
+        'dedup_index', 'disable_cmd_redirection', 'disable_coverage_init',
+        'disable_gcno_index', 'disable_lcov_exclude_pattern',
+        'disable_lcov_web', 'disable_test_case_dedup',
+        'enable_branch_coverage', 'exec_cpu_limit', 'exec_mem_limit',
+        'exec_timeout', 'follow', 'genhtml_path', 'granularity',
+        'id_delta_bin', 'include_src', 'lcov_exclude_pattern', 'lcov_path',
+        'llvm_cov_binary', 'llvm_cov_path', 'llvm_profdata_path',
+        'metrics_listen', 'overwrite', 'quiet', 'staging_dir', 'verbose']
+
+class CoverageTracker(object):
+
+    ### In-process interface to afl-cov coverage tracking that keeps the
+    ### coverage state warm across batches of test cases, e.g.:
+    ###
+    ###   tracker = CoverageTracker('/path/to/afl/out',
+    ###           '/path/to/prog AFL_FILE', '/path/to/code', overwrite=True)
+    ###   tracker.add_test_case('/path/to/afl/out/queue/id:000000,orig:a')
+    ###   result = tracker.diff()
+    ###   tracker.close()
+    ###
+    ### Keyword arguments are the same as the long command line options
+    ### (with '-' replaced by '_') in TRACKER_OPTIONS, and results are
+    ### written to the usual cov/ directory as well. The tracker can also be
+    ### used as a context manager, which calls close() on exit.
+
+    def __init__(self, afl_fuzzing_dir, coverage_cmd, code_dir,
+            on_new_coverage=None, **opts):
+
+        self.cargs = parse_cmdline(['--afl-fuzzing-dir', afl_fuzzing_dir,
+                '--coverage-cmd', coverage_cmd, '--code-dir', code_dir])
+        self.cargs.quiet = True
+        for k in opts:
+            if not hasattr(self.cargs, k):
+                raise TypeError("Unknown afl-cov option '%s'" % k)
+            if k not in TRACKER_OPTIONS:
+                raise ValueError("afl-cov option '%s' is not supported " \
+                        "by CoverageTracker" % k)
+            setattr(self.cargs, k, opts[k])
+
+        self.callbacks = []
+        if on_new_coverage:
+            self.callbacks.append(on_new_coverage)
+
+        self.cov       = new_cov_state()
+        self.cov_paths = {}
+        self.pending   = []  ### test cases executed since the last diff()
+        self.records   = []  ### first test case to hit each fcn/line/branch
+        self.closed    = False
+
+        if not init_tracking(self.cov_paths, self.cargs):
+            raise RuntimeError("Could not initialize coverage tracking " \
+                    "in '%s'" % self.cov_paths['top_dir'])
+
+        if self.cargs.metrics_listen:
+            start_metrics_server(self.cov_paths, self.cov, self.cargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+
+        ### stop the metrics server and persist the trace from the
+        ### --staging-dir, the tracker cannot be used afterwards
+        if not self.closed:
+            finish_tracking(self.cov_paths)
+            self.closed = True
+        return
+
+    def on_new_coverage(self, callback):
+        ### callback(result) is called by diff() whenever new coverage is found
+        self.callbacks.append(callback)
+        return callback
+
+    def add_test_case(self, afl_file):
+
+        ### execute a test case, coverage is captured by the next diff()
+        cov_paths = self.cov_paths
+        cargs     = self.cargs
+        result    = {'test_case': afl_file, 'duplicate_of': '',
+                'exit_status': 0}
+
+        if not cargs.disable_test_case_dedup:
+            result['duplicate_of'] = dedup_test_case(hash_test_case(afl_file),
+                    afl_file, cov_paths)
+
+        if result['duplicate_of']:
+            record_duplicate(afl_file, result['duplicate_of'], 0,
+                    cov_paths, cargs)
+            return result
+
+        result['exit_status'] = timed_stage(cov_paths, 'exec', run_cmd,
+                cargs.coverage_cmd.replace('AFL_FILE', afl_file),
+                cov_paths['log_file'], cargs, NO_OUTPUT,
+                env=test_case_env(afl_file, cov_paths, cargs),
+                exec_limits=True)[0]
+        record_exec_status(result['exit_status'], cov_paths)
+
+        if is_afl_test_case(afl_file):
+            id_range_update(afl_file, cov_paths)
+        self.pending.append(afl_file)
+
+        return result
+
+    def diff(self):
+
+        ### capture coverage for the pending test cases and diff it against
+        ### everything seen so far
+        result = {'test_cases': self.pending, 'new': {},
+                'totals': self.totals()}
+        if not self.pending:
+            return result
+
+        cov_paths = self.cov_paths
+        afl_file  = self.pending[-1]
+        cov_paths['diff'] = "%s/%s" % (cov_paths['diff_dir'],
+                os.path.basename(afl_file))
+
+        ### only AFL test case names can be grouped into an id range, other
+        ### batches are named after all of their inputs
+        id_range  = len(self.pending) > 1 and \
+                all(is_afl_test_case(f) for f in self.pending)
+        test_case = None
+        if len(self.pending) > 1 and not id_range:
+            test_case = '[%s]' % ' '.join(os.path.basename(f)
+                    for f in self.pending)
+
+        lcov_gen_coverage(cov_paths, self.cargs)
+        delta = coverage_diff(0, os.path.dirname(afl_file), cov_paths,
+                afl_file, self.cov, self.cargs, id_range=id_range,
+                test_case=test_case)
+
+        if id_range:
+            test_case = 'id:[%d-%d]...' % (cov_paths['id_min'],
+                    cov_paths['id_max'])
+        elif not test_case:
+            test_case = os.path.basename(afl_file)
+
+        for f in delta or {}:
+            for ctype in delta[f]:
+                for val in delta[f][ctype]:
+                    self.records.append({'test_case': test_case,
+                            'src_file': f, 'type': ctype, 'value': val})
+
+        cov_paths['id_file'] = os.path.basename(afl_file)
+        reset_id_range(cov_paths)
+        self.pending = []
+
+        result['new']    = delta or {}
+        result['totals'] = self.totals()
+        if result['new']:
+            for callback in self.callbacks:
+                callback(result)
+
+        return result
+
+    def totals(self):
+        totals = {}
+        for ctype in self.cov['totals']:
+            totals[ctype] = {'covered': self.cov['totals'][ctype],
+                    'total': self.cov['universe'][ctype]}
+        return totals
+
+    def snapshot(self):
+
+        ### copy of all positive coverage so far, per source file
+        pos = {}
+        for f in self.cov['pos']:
+            pos[f] = {}
+            for ctype in self.cov['pos'][f]:
+                if ctype == 'branch':
+                    pos[f][ctype] = branch_keys(self.cov['branch_map'], f,
+                            self.cov['pos'][f][ctype])
+                else:
+                    pos[f][ctype] = sorted(self.cov['pos'][f][ctype])
+        return {'pos': pos, 'totals': self.totals()}
+
+    def query(self, src_file=None, function=None, line=None, test_case=None):
+
+        ### which test case first executed a function/line, or everything
+        ### that was first executed by a test case
+        if function and '()' not in function:
+            function += '()'
+
+        matches = []
+        for rec in self.records:
+            if src_file and rec['src_file'] != src_file:
+                continue
+            if function and (rec['type'] != 'function'
+                    or rec['value'] != function):
+                continue
+            if line and (rec['type'] != 'line' or rec['value'] != str(line)):
+                continue
+            if test_case and rec['test_case'] != os.path.basename(test_case):
+                continue
+            matches.append(dict(rec))
+        return matches
+
+    def write_reports(self):
+
+        ### final zero/positive coverage reports and the lcov web report
+        if self.cov['non_cumulative']:
+            prune_zero_cov(self.cov['pos'], self.cov)
+        write_zero_cov(self.cov['zero'], self.cov_paths, self.cargs,
+                self.cov['branch_map'])
+        write_pos_cov(self.cov['pos'], self.cov_paths, self.cargs,
+                self.cov['branch_map'])
+        if self.cargs.id_delta_bin:
+            id_delta_bin_write(self.cov_paths)
+
+        if not self.cargs.disable_lcov_web:
+            lcov_gen_coverage(self.cov_paths, self.cargs)
+            if self.cov['non_cumulative']:
+                write_lcov_pos(self.cov_paths, self.cov, self.cargs)
+            gen_web_cov_report(self.cargs.afl_fuzzing_dir, self.cov_paths,
+                    self.cargs)
+        persist_staged_trace(self.cov_paths)
+        return
+
+def process_test_cases_pipelined(new_files, fuzz_dir, num_afl_files,
+        cov_paths, cov, cargs):
+
+    ### gcda counters are written to per-slot directories, so lcov captures
+    ### only reflect the test cases executed in that slot
+    cov['non_cumulative'] = True
+
+    return asyncio.run(run_pipeline(new_files, fuzz_dir, num_afl_files,
+            cov_paths, cov, cargs))
+
+async def run_pipeline(new_files, fuzz_dir, num_afl_files, cov_paths, cov,
+        cargs):
+
+    ### exec -> capture -> extract -> diff -> report, with bounded queues
+    ### between the stages. Test cases are executed and captured in parallel
+    ### (one gcda slot each), and diffs are applied in queue order.
+    loop     = asyncio.get_running_loop()
+    slots    = cov_paths['slots']
+    depth    = len(slots) * 2
+    executor = ThreadPoolExecutor(max_workers=len(slots) * 2 + 2)
+
+    exec_q     = asyncio.Queue(maxsize=depth)
+    capture_q  = asyncio.Queue(maxsize=depth)
+    extract_q  = asyncio.Queue(maxsize=depth)
+    diff_q     = asyncio.Queue(maxsize=depth)
+    report_q   = asyncio.Queue(maxsize=depth)
+    free_slots = asyncio.Queue()
+    for slot in slots:
+        free_slots.put_nowait(slot)
+
+    async def feed():
+        for seq, f in enumerate(new_files):
+            item = {'seq': seq, 'afl_file': f, 'digest': '', 'dup_of': '',
+                    'new_cov': None, 'cached': False, 'trace': '',
+                    'out_lines': [], 'want_output': False,
+                    'cycle': get_cycle_num(id_num(f), cargs)}
+
+            logr("[+] AFL test case: %s (%d / %d), cycle: %d" \
+                    % (os.path.basename(f), seq, num_afl_files,
+                    item['cycle']), cov_paths['log_file'], cargs)
+
+            if not cargs.disable_test_case_dedup or cargs.cov_cache_dir:
+                item['digest'] = hash_test_case(f)
+            if not cargs.disable_test_case_dedup:
+                item['dup_of'] = dedup_test_case(item['digest'], f, cov_paths)
+            if cargs.cov_cache_dir and not item['dup_of']:
+                item['new_cov'] = load_cached_cov(item['digest'],
+                        cov_paths, cov)
+                item['cached'] = item['new_cov'] is not None
+
+            if item['dup_of'] or item['cached']:
+                await diff_q.put(item)
+                continue
+
+            if not cov_paths['run_once']:
+                item['want_output'] = True
+                cov_paths['run_once'] = True
+            await exec_q.put(item)
+
+    async def exec_stage():
+        while True:
+            item = await exec_q.get()
+            if item is None:
+                break
+            item['slot'] = await free_slots.get()
+            if per_test_coverage(cargs):
+                reset_gcda([item['slot'] + g for g in cov_paths['gcda_files']])
+            collect = NO_OUTPUT
+            if item['want_output']:
+                collect = WANT_OUTPUT
+            es, item['out_lines'] = await loop.run_in_executor(executor,
+                    timed_stage, cov_paths, 'exec', run_cmd,
+                    cargs.coverage_cmd.replace('AFL_FILE', item['afl_file']),
+                    cov_paths['log_file'], cargs, collect,
+                    gcda_env(item['slot']), True)
+            record_exec_status(es, cov_paths)
+            await capture_q.put(item)
+
+    async def capture_stage():
+        while True:
+            item = await capture_q.get()
+            if item is None:
+                break
+            trace = "%s/%d" % (cov_paths['pipeline_dir'], item['seq'])
+            await loop.run_in_executor(executor, lcov_gen_coverage,
+                    cov_paths, cargs, gcda_dir(item['slot'], cargs),
+                    trace + '.lcov_info', trace + '.lcov_info_final')
+            free_slots.put_nowait(item['slot'])
+            if os.path.exists(trace + '.lcov_info'):
+                os.unlink(trace + '.lcov_info')
+            item['trace'] = trace + '.lcov_info_final'
+            await extract_q.put(item)
+
+    async def extract_stage():
+        while True:
+            item = await extract_q.get()
+            if item is None:
+                break
+            item['new_cov'] = await loop.run_in_executor(executor,
+                    timed_stage, cov_paths, 'extract', extract_coverage,
+                    item['trace'], cov_paths['log_file'], cargs,
+                    cov['branch_map'])
+            await diff_q.put(item)
+
+    async def diff_stage():
+        pending  = {}
+        next_seq = 0
+        while True:
+            item = await diff_q.get()
+            if item is None:
+                break
+            pending[item['seq']] = item
+            while next_seq in pending:
+                await diff_item(pending.pop(next_seq))
+                next_seq += 1
+
+    async def diff_item(item):
+        f = item['afl_file']
+        cov_paths['diff'] = "%s/%s" % (cov_paths['diff_dir'],
+                os.path.basename(f))
+
+        if item['dup_of']:
+            record_duplicate(f, item['dup_of'], item['cycle'], cov_paths,
+                    cargs)
+            if cargs.exact_coverage:
+                exact_store_dup(f, item['dup_of'], cov_paths)
+            count_processed(fuzz_dir, cov_paths)
+            return
+
+        if cargs.exact_coverage:
+            ### a row for every executed test case, like the serial loop
+            exact_store_add(f, item['new_cov'] or {}, cov_paths, cov)
+
+        if cargs.cov_cache_dir and not item['cached'] and item['new_cov']:
+            store_cached_cov(item['digest'], item['new_cov'], cov_paths, cov)
+
+        if item['cached']:
+            logr("[+] Using cached coverage results for: %s" \
+                    % os.path.basename(f), cov_paths['log_file'], cargs)
+            cov_paths['stats']['cache_hits'] += 1
+
+        delta = coverage_diff(item['cycle'], fuzz_dir, cov_paths, f, cov,
+                cargs, item['new_cov'] or {})
+        item['new_coverage'] = bool(delta)
+        count_processed(fuzz_dir, cov_paths)
+
+        if item['out_lines']:
+            logr("\n\n++++++ BEGIN - first exec output for CMD: %s" % \
+                    (cargs.coverage_cmd.replace('AFL_FILE', f)),
+                    cov_paths['log_file'], cargs)
+            for line in item['out_lines']:
+                logr("    %s" % (line), cov_paths['log_file'], cargs)
+            logr("++++++ END\n", cov_paths['log_file'], cargs)
+
+        cov_paths['id_file'] = "%s" % os.path.basename(f)
+
+        if item['trace']:
+            await report_q.put(item)
+
+    async def report_stage():
+        while True:
+            item = await report_q.get()
+            if item is None:
+                break
+            if item.get('new_coverage') and web_reports_enabled(cargs):
+                ### snapshots the trace, genhtml runs on the scheduler thread
+                request_web_report(fuzz_dir, cov_paths, cov, cargs,
+                        item['trace'])
+            if os.path.exists(item['trace']):
+                os.unlink(item['trace'])
+
+    exec_tasks    = [asyncio.create_task(exec_stage()) for s in slots]
+    capture_tasks = [asyncio.create_task(capture_stage()) for s in slots]
+    extract_task  = asyncio.create_task(extract_stage())
+    diff_task     = asyncio.create_task(diff_stage())
+    report_task   = asyncio.create_task(report_stage())
+
+    ### drain each stage in turn once everything upstream has finished
+    await feed()
+    for q, tasks in [(exec_q, exec_tasks), (capture_q, capture_tasks),
+            (extract_q, [extract_task]), (diff_q, [diff_task]),
+            (report_q, [report_task])]:
+        for t in tasks:
+            await q.put(None)
+        await asyncio.gather(*tasks)
+
+    executor.shutdown()
+
+    return len(new_files)
+
+def per_test_coverage(cargs):
+    ### gcda counters are reset so each capture holds one test case
+    return cargs.exact_coverage or cargs.sample_fraction \
+            or cargs.cov_cache_dir
+
+def sample_test_cases(new_files, fuzz_dir, cov_paths, cargs):
+
+    ### systematic stratified sample: the not yet processed test cases of
+    ### each fuzzing dir are split into equal id ranges and one test case is
+    ### drawn from each. The sampled fraction doubles with every pass.
+    fraction = cargs.sample_fraction * 2 ** cov_paths['sample_pass']
+    if fraction >= 1:
+        return new_files
+
+    done = cov_paths['sample_done'].get(fuzz_dir, 0)
+    num  = int(math.ceil((done + len(new_files)) * fraction)) - done
+    num  = max(0, min(len(new_files), num))
+
+    sampled = []
+    for b in range(num):
+        lo = b * len(new_files) // num
+        hi = (b + 1) * len(new_files) // num
+        sampled.append(new_files[cov_paths['sample_rng'].randrange(lo, hi)])
+
+    cov_paths['sample_done'][fuzz_dir] = done + len(sampled)
+    cov_paths['sample_deferred'] += len(new_files) - len(sampled)
+
+    if new_files:
+        logr("[+] Sampling %d of %d test cases (%.1f%%) from: %s" \
+                % (len(sampled), len(new_files), fraction * 100, fuzz_dir),
+                cov_paths['log_file'], cargs)
+    return sampled
+
+def sample_incidence_add(new_cov, cov_paths, cov):
+
+    ### number of sampled test cases that hit each function/line/branch
+    counts = cov_paths['sample_counts']
+    cov_paths['sample_size'] += 1
+    for f in new_cov.get('pos', {}):
+        for ctype in new_cov['pos'][f]:
+            if ctype == 'branch':
+                vals = branch_keys(cov['branch_map'], f,
+                        new_cov['pos'][f][ctype])
+            else:
+                vals = new_cov['pos'][f][ctype]
+            for val in vals:
+                key = (f, ctype, val)
+                counts[key] = counts.get(key, 0) + 1
+    return
+
+def chao2(s_obs, q1, q2, m):
+
+    ### bias-corrected Chao2 estimate of the number of functions/lines/
+    ### branches the whole queue reaches, from how many were hit by exactly
+    ### one (q1) or two (q2) of the m sampled test cases, with a 95%
+    ### log-normal confidence interval
+    if not m or not q1:
+        return s_obs, s_obs, s_obs
+
+    a = (m - 1.0) / m
+    t = a * q1 * (q1 - 1) / (2.0 * (q2 + 1))
+    if t <= 0:
+        return s_obs, s_obs, s_obs
+
+    var = t + a * a * q1 * (2 * q1 - 1) ** 2 / (4.0 * (q2 + 1) ** 2) \
+            + a * a * q1 * q1 * q2 * (q1 - 1) ** 2 / (4.0 * (q2 + 1) ** 4)
+    k = math.exp(1.96 * math.sqrt(math.log(1 + var / (t * t))))
+
+    return s_obs + t, s_obs + t / k, s_obs + t * k
+
+def publish_coverage_estimate(cov_paths, cov, cargs, num_test_cases):
+
+    complete = not cov_paths['sample_deferred']
+
+    obs = {}
+    q1  = {}
+    q2  = {}
+    for (f, ctype, val), n in cov_paths['sample_counts'].items():
+        obs[ctype] = obs.get(ctype, 0) + 1
+        if n == 1:
+            q1[ctype] = q1.get(ctype, 0) + 1
+        elif n == 2:
+            q2[ctype] = q2.get(ctype, 0) + 1
+
+    ctypes = ['function', 'line']
+    if cargs.enable_branch_coverage:
+        ctypes.append('branch')
+
+    with open(cov_paths['coverage_estimate'], 'a') as fh:
+        for ctype in ctypes:
+            s_obs = obs.get(ctype, 0)
+            if complete:
+                est = low = high = s_obs
+            else:
+                est, low, high = chao2(s_obs, q1.get(ctype, 0),
+                        q2.get(ctype, 0), cov_paths['sample_size'])
+            if cov['universe'][ctype]:
+                est  = min(est, cov['universe'][ctype])
+                high = min(high, cov['universe'][ctype])
+            fh.write("%d, %d, %d, %s, %d, %d, %d, %d, %d\n" \
+                    % (time.time(), cov_paths['sample_size'], num_test_cases,
+                    ctype, s_obs, round(est), round(low), round(high),
+                    cov['universe'][ctype]))
+            logr("[+] %s %s coverage from %d / %d test cases: %d " \
+                    "(95%% CI %d-%d) of %d, %d observed" \
+                    % ('Exact' if complete else 'Estimated', ctype,
+                    cov_paths['sample_size'], num_test_cases, round(est),
+                    round(low), round(high), cov['universe'][ctype], s_obs),
+                    cov_paths['log_file'], cargs)
+
+    if not complete:
+        ### coverage reports for what has been sampled so far
+        prune_zero_cov(cov['pos'], cov)
+        write_zero_cov(cov['zero'], cov_paths, cargs, cov['branch_map'])
+        write_pos_cov(cov['pos'], cov_paths, cargs, cov['branch_map'])
+        if not cargs.disable_lcov_web:
+            request_web_report(cargs.afl_fuzzing_dir, cov_paths, cov, cargs)
+    return
+
+GCDA_NONZERO = bytes([0] + [1] * 255)
+
+def reset_gcda(gcda_files):
+    ### same effect as 'lcov --zerocounters' without running lcov or
+    ### walking --code-dir
+    for gcda in gcda_files:
+        try:
+            os.unlink(gcda)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+    return
+
+def exact_store_init(cov_paths):
+
+    ### --exact-coverage columnar store in cov/exact/:
+    ###   index   - one 'src_file, coverage_type, fcn/line/branch' per line,
+    ###             the line number is the bit index in the bitsets
+    ###   ids     - one test case path per row
+    ###   offsets - (offset, length) uint64 pairs per row into bitsets
+    ###   bitsets - zlib compressed little-endian bitsets
+    ###   columns - the same bits sliced per index entry (a compressed
+    ###             bitset over the rows), written at the end of the run
+    ###   column_offsets - number of rows, then (offset, length) uint64
+    ###             pairs per index entry into columns
+    store = {'dir': cov_paths['exact_dir'], 'keys': {}, 'rows': {},
+            'size': 0}
+    os.mkdir(store['dir'])
+    for name in ['index', 'ids', 'offsets', 'bitsets']:
+        store[name] = "%s/%s" % (store['dir'], name)
+        open(store[name], 'w').close()
+    cov_paths['exact'] = store
+    return
+
+def exact_store_add(afl_file, new_cov, cov_paths, cov):
+
+    store    = cov_paths['exact']
+    bits     = []
+    new_keys = []
+    for f in new_cov.get('pos', {}):
+        for ctype in new_cov['pos'][f]:
+            if ctype == 'branch':
+                vals = branch_keys(cov['branch_map'], f,
+                        new_cov['pos'][f][ctype])
+            else:
+                vals = new_cov['pos'][f][ctype]
+            for val in vals:
+                key = "%s, %s, %s" % (f, ctype, val)
+                bit = store['keys'].get(key)
+                if bit is None:
+                    bit = len(store['keys'])
+                    store['keys'][key] = bit
+                    new_keys.append(key)
+                bits.append(bit)
+
+    if new_keys:
+        with open(store['index'], 'a') as fh:
+            fh.write(''.join(k + '\n' for k in new_keys))
+
+    bitset = bytearray((max(bits) >> 3) + 1 if bits else 0)
+    for bit in bits:
+        bitset[bit >> 3] |= 1 << (bit & 7)
+    blob = zlib.compress(bytes(bitset))
+
+    store['rows'][afl_file] = (store['size'], len(blob))
+    store['size'] += len(blob)
+    with open(store['bitsets'], 'ab') as fh:
+        fh.write(blob)
+    exact_store_row(afl_file, store['rows'][afl_file], store)
+    return
+
+def exact_store_dup(afl_file, dup_of, cov_paths):
+    ### byte-identical test cases share the bitset of the first copy
+    store = cov_paths['exact']
+    if dup_of in store['rows']:
+        store['rows'][afl_file] = store['rows'][dup_of]
+        exact_store_row(afl_file, store['rows'][afl_file], store)
+    return
+
+def exact_store_row(afl_file, row, store):
+    with open(store['offsets'], 'ab') as fh:
+        array('Q', row).tofile(fh)
+    append_file(afl_file, store['ids'])
+    return
+
+### memory for the columns built in one pass over the rows
+EXACT_COLUMNS_MEM = 64 * 1024 * 1024
+
+def exact_store_columns(cov_paths, cargs):
+
+    ### transpose the row bitsets so that exact_inputs_hitting() only reads
+    ### the column of one index entry instead of every row, with as many
+    ### passes over the rows as it takes to stay within EXACT_COLUMNS_MEM
+    store = exact_store_load(cov_paths['exact_dir'])
+    if not store:
+        return
+
+    num_rows = len(store['ids'])
+    num_keys = len(store['keys'])
+    col_len  = (num_rows >> 3) + 1
+    block    = max(1, EXACT_COLUMNS_MEM // col_len)
+
+    col_offsets = array('Q', [num_rows])
+    size = 0
+    cfile = open(cov_paths['exact_dir'] + '/columns', 'wb')
+    for start in range(0, num_keys, block):
+        cols = [bytearray(col_len) for i in range(min(block,
+                num_keys - start))]
+        mask = (1 << len(cols)) - 1
+        for row in range(num_rows):
+            bits = (int.from_bytes(exact_bitset(store, row), 'little') \
+                    >> start) & mask
+            while bits:
+                low = bits & -bits
+                cols[low.bit_length() - 1][row >> 3] |= 1 << (row & 7)
+                bits ^= low
+        for col in cols:
+            blob = zlib.compress(bytes(col))
+            col_offsets.extend([size, len(blob)])
+            size += len(blob)
+            cfile.write(blob)
+    cfile.close()
+
+    with open(cov_paths['exact_dir'] + '/column_offsets', 'wb') as fh:
+        col_offsets.tofile(fh)
+
+    logr("[+] Wrote --exact-coverage columns for %d index entries" \
+            % num_keys, cov_paths['log_file'], cargs)
+    return
+
+def exact_store_load(exact_dir):
+
+    store = {'ids': [], 'offsets': array('Q'), 'bitsets': b'',
+            'keys': {}, 'columns': None}
+    if not is_dir(exact_dir):
+        return None
+
+    with open(exact_dir + '/ids', 'r') as f:
+        store['ids'] = f.read().splitlines()
+    with open(exact_dir + '/offsets', 'rb') as f:
+        store['offsets'].frombytes(f.read())
+    if os.path.getsize(exact_dir + '/bitsets'):
+        with open(exact_dir + '/bitsets', 'rb') as f:
+            store['bitsets'] = mmap.mmap(f.fileno(), 0,
+                    access=mmap.ACCESS_READ)
+    store['index'] = exact_dir + '/index'
+    with open(store['index'], 'r') as f:
+        for i, line in enumerate(f):
+            store['keys'][line.rstrip('\n')] = i
+
+    ### columns from an interrupted or older run are not used
+    if os.path.exists(exact_dir + '/column_offsets'):
+        col_offsets = array('Q')
+        with open(exact_dir + '/column_offsets', 'rb') as f:
+            col_offsets.frombytes(f.read())
+        if col_offsets and col_offsets[0] == len(store['ids']) \
+                and len(col_offsets) == 1 + 2 * len(store['keys']):
+            store['col_offsets'] = col_offsets
+            ### a lookup only touches the pages of its own column
+            store['columns'] = b''
+            if os.path.getsize(exact_dir + '/columns'):
+                with open(exact_dir + '/columns', 'rb') as f:
+                    store['columns'] = mmap.mmap(f.fileno(), 0,
+                            access=mmap.ACCESS_READ)
+
+    return store
+
+def exact_bitset(store, row):
+    offset = store['offsets'][row * 2]
+    length = store['offsets'][row * 2 + 1]
+    return zlib.decompress(store['bitsets'][offset:offset+length])
+
+def exact_inputs_hitting(store, key):
+
+    ### all test cases that executed 'src_file, coverage_type, val'
+    bit = store['keys'].get(key)
+    if bit is None:
+        return []
+
+    hits = []
+    if store['columns'] is not None:
+        offset = store['col_offsets'][1 + bit * 2]
+        length = store['col_offsets'][2 + bit * 2]
+        rows = int.from_bytes(zlib.decompress(
+                store['columns'][offset:offset+length]), 'little')
+        while rows:
+            low = rows & -rows
+            hits.append(store['ids'][low.bit_length() - 1])
+            rows ^= low
+        return hits
+
+    byte, mask = bit >> 3, 1 << (bit & 7)
+    for row in range(len(store['ids'])):
+        bitset = exact_bitset(store, row)
+        if byte < len(bitset) and bitset[byte] & mask:
+            hits.append(store['ids'][row])
+    return hits
+
+def exact_test_case_cov(store, afl_file):
+
+    ### everything executed by a single test case
+    rows = [i for i, t in enumerate(store['ids'])
+            if t == afl_file or os.path.basename(t) == afl_file]
+    if not rows:
+        return None
+
+    bitset = exact_bitset(store, rows[0])
+    bits = set()
+    for byte, val in enumerate(bitset):
+        while val:
+            low = val & -val
+            bits.add((byte << 3) + low.bit_length() - 1)
+            val ^= low
+
+    return [key for key, bit in store['keys'].items() if bit in bits]
+
+def popcount(bits):
+    if hasattr(bits, 'bit_count'):
+        return bits.bit_count()
+    return bin(bits).count('1')
+
+def minimize_corpus(cov_paths, cargs):
+
+    ### greedy set cover over the --exact-coverage bitsets: repeatedly pick
+    ### the test case that adds the most uncovered functions/lines/branches.
+    ### Gains only shrink as coverage grows, so a test case whose stale gain
+    ### is still the best one after re-evaluation is picked without looking
+    ### at the rest (lazy greedy). Bitsets stay compressed until needed.
+    store = exact_store_load(cov_paths['exact_dir'])
+    if not store:
+        return
+
+    heap = []
+    seen = {}
+    for row in range(len(store['ids'])):
+        blob = (store['offsets'][row * 2], store['offsets'][row * 2 + 1])
+        if blob in seen:
+            ### byte-identical copy of an earlier test case
+            continue
+        seen[blob] = row
+        gain = popcount(int.from_bytes(exact_bitset(store, row), 'little'))
+        if gain:
+            heap.append((-gain, os.path.getsize(store['ids'][row]), row))
+    heapq.heapify(heap)
+
+    covered = 0
+    chosen  = []
+    while heap:
+        stale_gain, size, row = heapq.heappop(heap)
+        bits = int.from_bytes(exact_bitset(store, row), 'little')
+        gain = popcount(bits & ~covered)
+        if not gain:
+            continue
+        if heap and (-gain, size) > heap[0][:2]:
+            ### equal gains go to the smaller test case
+            heapq.heappush(heap, (-gain, size, row))
+            continue
+        covered |= bits
+        chosen.append((row, gain, size))
+
+    min_dir = cov_paths['min_dir']
+    if not is_dir(min_dir):
+        os.makedirs(min_dir)
+
+    mfile = open(cov_paths['min_manifest'], 'w')
+    mfile.write("# min_corpus_file, new_coverage_items, size, afl_file\n")
+    for row, gain, size in chosen:
+        afl_file = store['ids'][row]
+        dst = os.path.basename(afl_file)
+        if os.path.exists("%s/%s" % (min_dir, dst)):
+            ### same queue id from another parallel fuzzer instance
+            dst = "%s_%s" % (os.path.basename(os.path.dirname(
+                    os.path.dirname(afl_file))), dst)
+        copyfile(afl_file, "%s/%s" % (min_dir, dst))
+        mfile.write("%s, %d, %d, %s\n" % (dst, gain, size, afl_file))
+    mfile.close()
+
+    logr("[+] Minimized corpus: %d / %d test cases cover %d " \
+            "functions/lines/branches: %s" % (len(chosen), len(seen),
+            popcount(covered), min_dir), cov_paths['log_file'], cargs)
+    return
+
+def id_num(afl_file):
+    return int(os.path.basename(afl_file).split(',')[0].split(':')[1])
+
+def is_afl_test_case(afl_file):
+    ### AFL names test cases id:NNNNNN,... while CoverageTracker callers
+    ### can pass any path
+    return re.match(r'id:\d+(,|$)', os.path.basename(afl_file)) is not None
+
 def id_range_update(afl_file, cov_paths):
 
-    id_val = int(os.path.basename(afl_file).split(',')[0].split(':')[1])
+    id_val = id_num(afl_file)
 
     if cov_paths['id_min'] == -1:
         cov_paths['id_min'] = id_val
@@ -296,84 +1727,340 @@ def id_range_update(afl_file, cov_paths):
 
     return
 
-def coverage_diff(cycle_num, fuzz_dir, cov_paths, afl_file, cov, cargs):
+def hash_test_case(afl_file):
+    h = hashlib.sha1()
+    with open(afl_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def dedup_test_case(digest, afl_file, cov_paths):
+
+    ### return the path of a byte-identical test case that was already
+    ### processed, or an empty string if this content is new
+    if digest in cov_paths['hashes']:
+        if cov_paths['hashes'][digest] == afl_file:
+            ### never a duplicate of itself
+            return ''
+        return cov_paths['hashes'][digest]
+
+    cov_paths['hashes'][digest] = afl_file
+    if cov_paths['dedup_index']:
+        append_file("%s, %s" % (digest, afl_file), cov_paths['dedup_index'])
+
+    return ''
+
+def record_duplicate(afl_file, dup_of, cycle_num, cov_paths, cargs):
+
+    logr("[-] Duplicate of: %s, skipping exec" % dup_of,
+            cov_paths['log_file'], cargs)
+    ### no source file, the value is the test case that was executed
+    append_file("%s, %s, , duplicate, %s" \
+            % (os.path.basename(afl_file), cycle_num, dup_of),
+            cov_paths['id_delta_cov'])
+    id_delta_bin_add(os.path.basename(afl_file), cycle_num, '',
+            'duplicate', dup_of, cov_paths)
+    cov_paths['stats']['duplicates'] += 1
+
+    return
+
+def load_dedup_index(cov_paths):
+
+    if not os.path.exists(cov_paths['dedup_index']):
+        return
+
+    with open(cov_paths['dedup_index'], 'r') as f:
+        for line in f:
+            ### sha1, /path/to/first/test/case
+            vals = line.rstrip('\n').split(', ', 1)
+            if len(vals) == 2 and vals[0] not in cov_paths['hashes']:
+                cov_paths['hashes'][vals[0]] = vals[1]
+
+    return
+
+def showmap_new_edges(afl_file, cov_paths, cargs):
+
+    ### run the test case through the AFL instrumented target and merge its
+    ### edge/hit count bucket tuples into the global set
+    out = cov_paths['showmap_out']
+    if os.path.exists(out):
+        os.unlink(out)
+    run_cmd("%s -q -o %s -- %s" % (cargs.afl_showmap_path, out,
+            cargs.showmap_cmd.replace('AFL_FILE', afl_file)),
+            cov_paths['log_file'], cargs, NO_OUTPUT, exec_limits=True)
+
+    if not os.path.exists(out):
+        ### no trace, so let gcov decide
+        return True
+
+    edges = cov_paths['showmap_edges']
+    num   = len(edges)
+    with open(out, 'r') as f:
+        edges.update(line.rstrip('\n') for line in f if line.strip())
+
+    return len(edges) > num
+
+def prefilter_sweep(cycle_num, fuzz_dir, cov_paths, cov, cargs):
+
+    ### the gcda counters are cumulative, so replaying every deferred test
+    ### case and capturing once finds anything the edge prefilter missed,
+    ### which is attributed to the id range of the deferred test cases
+    skipped = cov_paths['prefilter_skipped']
+    logr("[+] Verification sweep over %d test cases without new " \
+            "afl-showmap edges" % len(skipped), cov_paths['log_file'], cargs)
+
+    for f in skipped:
+        es = timed_stage(cov_paths, 'exec', run_cmd,
+                cargs.coverage_cmd.replace('AFL_FILE', f),
+                cov_paths['log_file'], cargs, NO_OUTPUT,
+                env=test_case_env(f, cov_paths, cargs), exec_limits=True)[0]
+        record_exec_status(es, cov_paths)
+
+    if capture_deferred(cycle_num, fuzz_dir, skipped, cov_paths, cov, cargs):
+        logr("[*] afl-showmap prefilter missed new coverage in id:[%d-%d]" \
+                % (cov_paths['id_min'], cov_paths['id_max']),
+                cov_paths['log_file'], cargs)
+        cov_paths['stats']['prefilter_misses'] += 1
+
+    reset_id_range(cov_paths)
+    cov_paths['prefilter_skipped'] = []
+    return
+
+def capture_deferred(cycle_num, fuzz_dir, deferred, cov_paths, cov, cargs,
+        gcda_dir=None):
+
+    ### capture once for test cases whose counters are already in the gcda
+    ### files and attribute anything new to their id range
+    ids = [id_num(f) for f in deferred]
+    cov_paths['id_min'] = min(ids)
+    cov_paths['id_max'] = max(ids)
+    cov_paths['diff'] = "%s/%s" % (cov_paths['diff_dir'],
+            os.path.basename(deferred[-1]))
+
+    lcov_gen_coverage(cov_paths, cargs, gcda_dir)
+    return coverage_diff(cycle_num, fuzz_dir, cov_paths, deferred[-1], cov,
+            cargs, id_range=True)
+
+def gcda_new_counters(cov_paths):
+
+    ### --gcda-novelty: a counter going from zero to nonzero turns at least
+    ### one zero byte of its gcda file nonzero, so comparing byte level
+    ### nonzero masks finds new counters without parsing the gcda format.
+    ### A gcda file that appears or changes size always counts as new.
+    novel    = False
+    snapshot = {}
+    for gcda in cov_paths['gcda_files']:
+        try:
+            with open(gcda, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            continue
+
+        snapshot[gcda] = data
+
+        mask = int.from_bytes(data.translate(GCDA_NONZERO), 'little')
+        prev = cov_paths['gcda_nonzero'].get(gcda)
+        if prev is None or prev[0] != len(data):
+            cov_paths['gcda_nonzero'][gcda] = (len(data), mask)
+            novel = True
+        elif mask & ~prev[1]:
+            cov_paths['gcda_nonzero'][gcda] = (len(data), mask | prev[1])
+            novel = True
+
+    if not novel:
+        ### the counters as of the last skipped test case
+        cov_paths['gcda_snapshot'] = snapshot
+    return novel
+
+def novelty_sweep(cycle_num, fuzz_dir, cov_paths, cov, cargs,
+        snapshot=False):
+
+    ### counters that only grew can still make gcov derive a new arc, so the
+    ### skipped test cases (already in the gcda counters) are captured once.
+    ### A test case with new counters ends the skipped range, and then the
+    ### counters from before it ran are captured from the gcda snapshot
+    skipped = cov_paths['novelty_skipped']
+    logr("[+] Verification capture over %d test cases without new gcda " \
+            "counters" % len(skipped), cov_paths['log_file'], cargs)
+
+    snapshot_dir = None
+    if snapshot:
+        prefix = cov_paths['novelty_dir']
+        strip  = len(cov_paths['gcda_prefix'])
+        reset_gcda([prefix + g[strip:] for g in cov_paths['gcda_files']])
+        for gcda, data in cov_paths['gcda_snapshot'].items():
+            with open(prefix + gcda[strip:], 'wb') as f:
+                f.write(data)
+        snapshot_dir = gcda_dir(prefix, cargs)
+
+    if capture_deferred(cycle_num, fuzz_dir, skipped, cov_paths, cov, cargs,
+            snapshot_dir):
+        logr("[*] gcda novelty check missed new coverage in id:[%d-%d]" \
+                % (cov_paths['id_min'], cov_paths['id_max']),
+                cov_paths['log_file'], cargs)
+        cov_paths['stats']['novelty_misses'] += 1
+
+    reset_id_range(cov_paths)
+    cov_paths['novelty_skipped'] = []
+    return
+
+def reset_id_range(cov_paths):
+    cov_paths['id_min'] = cov_paths['id_max'] = -1
+    cov_paths['interval_files'] = 0
+    cov_paths['interval_start'] = time.time()
+    return
+
+def use_id_ranges(cargs):
+    ### coverage is attributed to a range of AFL test case ids instead of
+    ### to each individual test case
+    return cargs.cover_corpus or cargs.coverage_at_exit \
+            or is_interval_mode(cargs)
+
+def is_interval_mode(cargs):
+    return cargs.coverage_every or cargs.coverage_every_seconds
+
+def coverage_interval_reached(cov_paths, cargs):
+
+    if cargs.coverage_every \
+            and cov_paths['interval_files'] >= cargs.coverage_every:
+        return True
+
+    if cargs.coverage_every_seconds \
+            and time.time() - cov_paths['interval_start'] \
+                >= cargs.coverage_every_seconds:
+        return True
+
+    return False
+
+def coverage_diff(cycle_num, fuzz_dir, cov_paths, afl_file, cov, cargs,
+        new_cov=None, id_range=None, test_case=None):
 
     log_lines         = []
     delta_log_lines   = []
     print_diff_header = True
+    delta             = {}
 
     ### defaults
     a_file = '(init)'
     if cov_paths['id_file']:
         a_file = cov_paths['id_file']
-    delta_file = b_file = os.path.basename(afl_file)
+    delta_file = b_file = test_case or os.path.basename(afl_file)
 
-    if cargs.cover_corpus or cargs.coverage_at_exit:
+    if id_range is None:
+        id_range = use_id_ranges(cargs)
+
+    if id_range:
         a_file = 'id:%d...' % cov_paths['id_min']
         b_file = 'id:%d...' % cov_paths['id_max']
         delta_file = 'id:[%d-%d]...' % \
                 (cov_paths['id_min'], cov_paths['id_max'])
 
-    new_cov = extract_coverage(cov_paths['lcov_info_final'],
-            cov_paths['log_file'], cargs)
+    ### new_cov is passed in for cached or already extracted results
+    streaming = new_cov is None and isinstance(cov['pos'], CoverageStateStore)
+    if streaming:
+        ### --state-db streams the trace one source file at a time instead
+        ### of extracting all of it first
+        records = lcov_records(cov_paths['lcov_info_final'],
+                cov_paths['log_file'], cargs, cov['branch_map'])
+    else:
+        if new_cov is None:
+            new_cov = timed_stage(cov_paths, 'extract', extract_coverage,
+                    cov_paths['lcov_info_final'], cov_paths['log_file'],
+                    cargs, cov['branch_map'])
 
-    if not new_cov:
-        return
+        if not new_cov:
+            return None
+
+        records = ((f, {'pos': {f: new_cov['pos'][f]}}) for f in new_cov['pos'])
+
+    seen     = set()
+    universe = {'line': 0, 'function': 0, 'branch': 0}
+
+    start = time.time()
 
     ### We aren't interested in the number of times AFL has executed
     ### a line or function (since we can't really get this anyway because
     ### gcov stats aren't influenced by AFL directly) - what we want is
     ### simply whether a new line or function has been executed at all by
     ### this test case. So, we look for new positive coverage.
-    for f in new_cov['pos']:
+    for f, rec in records:
         print_filename = True
+        new_file = False
+        if streaming:
+            seen.add(f)
+            for ctype, num in count_cov(rec).items():
+                universe[ctype] += num
+            ### the gcda counters only ever add positive coverage, so the
+            ### same counts mean nothing changed in this file
+            if f in cov['zero'] \
+                    and cov['pos'].counts(f) == cov_entry_counts(rec['pos'][f]):
+                continue
         if f not in cov['zero'] and f not in cov['pos']: ### completely new file
             cov_init(f, cov)
+            new_file = True
             if print_diff_header:
                 log_lines.append("diff %s -> %s" % \
                         (a_file, b_file))
                 print_diff_header = False
-            for ctype in new_cov['pos'][f]:
-                for val in sorted(new_cov['pos'][f][ctype]):
-                    cov['pos'][f][ctype][val] = ''
-                    if print_filename:
+        elif f not in cov['zero'] or f not in cov['pos']:
+            continue
+        for ctype in rec['pos'][f]:
+            new_vals = update_pos_cov(f, ctype, rec, cov)
+            cov['totals'][ctype] += len(new_vals)
+            if new_vals:
+                if f not in delta:
+                    delta[f] = {}
+                delta[f][ctype] = new_vals
+            for val in new_vals:
+                if print_diff_header:
+                    log_lines.append("diff %s -> %s" % \
+                            (a_file, b_file))
+                    print_diff_header = False
+                if print_filename:
+                    if new_file:
                         log_lines.append("New src file: " + f)
-                        print_filename = False
-                    log_lines.append("  New '" + ctype + "' coverage: " + val)
-                    if ctype == 'line':
-                        if cargs.coverage_include_lines:
-                            delta_log_lines.append("%s, %s, %s, %s, %s\n" \
-                                    % (delta_file, cycle_num, f, ctype, val))
                     else:
+                        log_lines.append("Src file: " + f)
+                    print_filename = False
+                log_lines.append("  New '" + ctype + "' coverage: " + val)
+                if ctype == 'line':
+                    if cargs.coverage_include_lines:
                         delta_log_lines.append("%s, %s, %s, %s, %s\n" \
                                 % (delta_file, cycle_num, f, ctype, val))
-        elif f in cov['zero'] and f in cov['pos']:
-            for ctype in new_cov['pos'][f]:
-                for val in sorted(new_cov['pos'][f][ctype]):
-                    if val not in cov['pos'][f][ctype]:
-                        cov['pos'][f][ctype][val] = ''
-                        if print_diff_header:
-                            log_lines.append("diff %s -> %s" % \
-                                    (a_file, b_file))
-                            print_diff_header = False
-                        if print_filename:
-                            log_lines.append("Src file: " + f)
-                            print_filename = False
-                        log_lines.append("  New '" + ctype + "' coverage: " + val)
-                        if ctype == 'line':
-                            if cargs.coverage_include_lines:
-                                delta_log_lines.append("%s, %s, %s, %s, %s\n" \
-                                        % (delta_file, cycle_num, f, \
-                                        ctype, val))
-                        else:
-                            delta_log_lines.append("%s, %s, %s, %s, %s\n" \
-                                    % (delta_file, cycle_num, f, \
-                                    ctype, val))
+                        id_delta_bin_add(delta_file, cycle_num, f, ctype,
+                                val, cov_paths)
+                else:
+                    delta_log_lines.append("%s, %s, %s, %s, %s\n" \
+                            % (delta_file, cycle_num, f, ctype, val))
+                    id_delta_bin_add(delta_file, cycle_num, f, ctype, val,
+                            cov_paths)
+        if streaming:
+            cov['zero'][f] = rec['zero'][f]
 
     ### now that new positive coverage has been added, reset zero
     ### coverage to the current new zero coverage
-    cov['zero'] = {}
-    cov['zero'] = new_cov['zero'].copy()
+    ### (cached results only carry positive coverage). When the gcda
+    ### counters do not account for every test case, cov['zero'] may
+    ### still contain positive coverage until prune_zero_cov() is called.
+    if streaming:
+        if not seen:
+            return None
+        cov['zero'].retain(seen)
+        cov['universe'] = universe
+    elif new_cov['zero'] is not None:
+        cov['zero'] = {}
+        cov['zero'] = new_cov['zero'].copy()
+        cov['universe'] = count_cov(new_cov)
+
+    if id_range:
+        id_val = cov_paths['id_max']
+    elif is_afl_test_case(afl_file):
+        id_val = id_num(afl_file)
+    else:
+        id_val = -1
+    write_plot_data(id_val, cycle_num, cov_paths, cov)
 
     if len(log_lines):
         logr("\n    Coverage diff %s %s" \
@@ -384,15 +2071,456 @@ def coverage_diff(cycle_num, fuzz_dir, cov_paths, afl_file, cov, cargs):
             append_file(l, cov_paths['diff'])
         logr("", cov_paths['log_file'], cargs)
 
-    if len(delta_log_lines):
-        cfile = open(cov_paths['id_delta_cov'], 'a')
-        for l in delta_log_lines:
-            cfile.write(l)
-        cfile.close()
+    if len(delta_log_lines):
+        cfile = open(cov_paths['id_delta_cov'], 'a')
+        for l in delta_log_lines:
+            cfile.write(l)
+        cfile.close()
+
+    observe_stage(cov_paths, 'diff', time.time() - start)
+
+    return delta
+
+### Binary columnar id-delta-cov (--id-delta-bin), all values little-endian:
+###
+###   header   - magic, version (uint32), number of sections (uint32),
+###              number of rows (uint64)
+###   sections - name (16 bytes, NUL padded), offset (uint64), length (uint64)
+###              per section, each section starts on an 8 byte boundary
+###
+### The 'ids', 'files' and 'values' string dictionaries are stored as utf-8
+### blobs with '<name>.off' uint64 offset arrays (one more entry than there
+### are strings). One column per row field follows: 'test', 'cycle', 'file'
+### and 'value' are uint32 ('test'/'file'/'value' index the dictionaries,
+### ID_DELTA_NONE for no value), 'line' is the uint32 line number of line
+### and branch coverage, and 'ctype' is a uint8 index into ID_DELTA_CTYPES.
+ID_DELTA_MAGIC   = b'AFLCOVD\0'
+ID_DELTA_VERSION = 1
+ID_DELTA_HEADER  = '<8sIIQ'
+ID_DELTA_SECTION = '<16sQQ'
+ID_DELTA_CTYPES  = ['function', 'line', 'branch', 'duplicate']
+ID_DELTA_DICTS   = ['ids', 'files', 'values']
+ID_DELTA_COLUMNS = [('test', 'I'), ('cycle', 'I'), ('file', 'I'),
+        ('ctype', 'B'), ('line', 'I'), ('value', 'I')]
+ID_DELTA_NONE    = 0xffffffff
+
+def id_delta_bin_init(cov_paths):
+    cov_paths['id_delta_cols'] = {
+        'dicts': dict((d, {}) for d in ID_DELTA_DICTS),
+        'cols':  dict((c, array(t)) for c, t in ID_DELTA_COLUMNS),
+    }
+    return
+
+def id_delta_bin_add(test_case, cycle_num, src_file, ctype, val, cov_paths):
+
+    data = cov_paths['id_delta_cols']
+    if not data:
+        return
+
+    dicts = data['dicts']
+    line  = 0
+    value = ID_DELTA_NONE
+    if ctype == 'line':
+        line = int(val)
+    else:
+        if ctype == 'branch':
+            line = int(val.split(',')[0])
+        value = dicts['values'].setdefault(val, len(dicts['values']))
+
+    cols = data['cols']
+    cols['test'].append(dicts['ids'].setdefault(test_case, len(dicts['ids'])))
+    cols['cycle'].append(int(cycle_num))
+    if src_file:
+        cols['file'].append(dicts['files'].setdefault(src_file,
+                len(dicts['files'])))
+    else:
+        cols['file'].append(ID_DELTA_NONE)
+    cols['ctype'].append(ID_DELTA_CTYPES.index(ctype))
+    cols['line'].append(line)
+    cols['value'].append(value)
+    return
+
+def id_delta_bin_write(cov_paths):
+
+    data = cov_paths['id_delta_cols']
+    sections = []
+    for name in ID_DELTA_DICTS:
+        strs = [k.encode('utf-8') for k in data['dicts'][name]]
+        offsets = array('Q', [0])
+        for k in strs:
+            offsets.append(offsets[-1] + len(k))
+        sections.append((name + '.off', offsets))
+        sections.append((name, b''.join(strs)))
+    for name, t in ID_DELTA_COLUMNS:
+        sections.append((name, data['cols'][name]))
+
+    hdr_len = struct.calcsize(ID_DELTA_HEADER) \
+            + len(sections) * struct.calcsize(ID_DELTA_SECTION)
+    table  = []
+    blobs  = []
+    offset = hdr_len
+    for name, sec in sections:
+        if isinstance(sec, array):
+            if sys.byteorder != 'little':
+                sec = array(sec.typecode, sec)
+                sec.byteswap()
+            sec = sec.tobytes()
+        pad = -offset % 8
+        offset += pad
+        table.append(struct.pack(ID_DELTA_SECTION, name.encode('ascii'),
+                offset, len(sec)))
+        blobs.append(b'\0' * pad + sec)
+        offset += len(sec)
+
+    tmp_path = cov_paths['id_delta_bin'] + '.tmp'
+    with open(tmp_path, 'wb') as fh:
+        fh.write(struct.pack(ID_DELTA_HEADER, ID_DELTA_MAGIC,
+                ID_DELTA_VERSION, len(sections), len(data['cols']['test'])))
+        fh.write(b''.join(table))
+        for blob in blobs:
+            fh.write(blob)
+    os.rename(tmp_path, cov_paths['id_delta_bin'])
+    return
+
+def id_delta_bin_load(path):
+
+    ### columns are zero-copy views into the mmap'd file, only the string
+    ### dictionaries are decoded
+    with open(path, 'rb') as fh:
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, num_sections, num_rows = \
+            struct.unpack_from(ID_DELTA_HEADER, mm, 0)
+    if magic != ID_DELTA_MAGIC or version > ID_DELTA_VERSION:
+        raise ValueError("'%s' is not a version %d id-delta-cov.bin file" \
+                % (path, ID_DELTA_VERSION))
+
+    sections = {}
+    pos = struct.calcsize(ID_DELTA_HEADER)
+    for i in range(num_sections):
+        name, offset, length = struct.unpack_from(ID_DELTA_SECTION, mm, pos)
+        sections[name.rstrip(b'\0').decode('ascii')] = (offset, length)
+        pos += struct.calcsize(ID_DELTA_SECTION)
+
+    view = memoryview(mm)
+    data = {'rows': num_rows, 'ctypes': ID_DELTA_CTYPES, 'mmap': mm}
+    for name, t in [(d + '.off', 'Q') for d in ID_DELTA_DICTS] \
+            + ID_DELTA_COLUMNS:
+        offset, length = sections[name]
+        if sys.byteorder == 'little':
+            data[name] = view[offset:offset+length].cast(t)
+        else:
+            data[name] = array(t, bytes(view[offset:offset+length]))
+            data[name].byteswap()
+
+    for name in ID_DELTA_DICTS:
+        offset = sections[name][0]
+        offsets = data.pop(name + '.off')
+        blob = mm[offset:offset+offsets[-1]]
+        data[name] = [blob[offsets[i]:offsets[i+1]].decode('utf-8')
+                for i in range(len(offsets) - 1)]
+
+    return data
+
+def id_delta_bin_rows(data):
+    ### (test_case, cycle, src_file, coverage_type, fcn/line) tuples in
+    ### id-delta-cov order
+    for i in range(data['rows']):
+        ctype = ID_DELTA_CTYPES[data['ctype'][i]]
+        if ctype == 'line':
+            val = str(data['line'][i])
+        else:
+            val = data['values'][data['value'][i]]
+        src_file = ''
+        if data['file'][i] != ID_DELTA_NONE:
+            src_file = data['files'][data['file'][i]]
+        yield (data['ids'][data['test'][i]], data['cycle'][i], src_file,
+                ctype, val)
+
+def prune_zero_cov(pos_cov, cov):
+
+    ### drop positive coverage from cov['zero'] when the latest lcov capture
+    ### (or lack of one) does not account for every test case
+    for f in pos_cov:
+        if f not in cov['zero']:
+            continue
+        for ctype in pos_cov[f]:
+            if ctype not in cov['zero'][f]:
+                continue
+            if ctype == 'branch':
+                cov['zero'][f][ctype] &= ~pos_cov[f][ctype]
+            else:
+                for val in pos_cov[f][ctype]:
+                    cov['zero'][f][ctype].pop(val, None)
+    return
+
+def seed_zero_cov(cov_paths, cov, cargs):
+
+    base_cov = extract_coverage(cov_paths['lcov_base'],
+            cov_paths['log_file'], cargs, cov['branch_map'])
+
+    if not base_cov:
+        return
+
+    for f in list(base_cov['zero']):
+        if is_excluded(f, cargs):
+            del base_cov['zero'][f]
+        else:
+            cov_init(f, cov)
+
+    cov['zero'] = base_cov['zero']
+    cov['universe'] = count_cov(base_cov)
+    return
+
+def is_included(src_file, cargs):
+    if not cargs.include_src:
+        return True
+    for pattern in cargs.include_src:
+        if fnmatch.fnmatch(src_file, pattern):
+            return True
+    return False
+
+def is_excluded(src_file, cargs):
+    if not is_included(src_file, cargs):
+        return True
+    if cargs.disable_lcov_exclude_pattern:
+        return False
+    for pattern in cargs.lcov_exclude_pattern.split():
+        if fnmatch.fnmatch(src_file, pattern.strip('\'"')):
+            return True
+    return False
+
+def cov_fingerprint(cov_paths, cargs):
+
+    ### identifies the instrumented build and the options that influence
+    ### the extracted coverage, so cached results are invalidated whenever
+    ### either changes
+    h = hashlib.sha1()
+    for opt in ['full-coverage', cargs.coverage_cmd, cargs.lcov_exclude_pattern,
+            str(cargs.disable_lcov_exclude_pattern),
+            str(cargs.enable_branch_coverage), str(cargs.include_src),
+            cargs.granularity]:
+        h.update(opt.encode('utf-8') + b'\0')
+
+    paths = list(find_gcno_files(cov_paths, cargs))
+    for part in cargs.coverage_cmd.split(' '):
+        if not part or part[0] == '-':
+            continue
+        exe = which(part)
+        if exe:
+            paths.append(exe)
+
+    for path in sorted(paths):
+        st = os.stat(path)
+        h.update(("%s %d %d\n" % (path, st.st_mtime_ns,
+                st.st_size)).encode('utf-8'))
+
+    return h.hexdigest()
+
+def cached_cov_path(digest, cov_paths):
+    return "%s/%s/%s" % (cov_paths['cache_dir'], digest[:2], digest)
+
+def load_cached_cov(digest, cov_paths, cov):
+
+    cpath = cached_cov_path(digest, cov_paths)
+    if not os.path.exists(cpath):
+        return None
+
+    cached_cov = {}
+    with open(cpath, 'r') as f:
+        for line in f:
+            ### src_file, coverage_type, fcn/line/branch
+            [src_file, ctype, val] = line.rstrip('\n').split(', ')
+            cov_init(src_file, cached_cov)
+            if ctype == 'branch':
+                cached_cov['pos'][src_file][ctype] |= \
+                        1 << branch_bit(cov['branch_map'], src_file, val)
+            else:
+                cached_cov['pos'][src_file][ctype][val] = ''
+
+    if 'pos' not in cached_cov:
+        cached_cov['pos'] = {}
+    cached_cov['zero'] = None
+
+    return cached_cov
+
+def store_cached_cov(digest, new_cov, cov_paths, cov):
+
+    ### the full coverage of one test case (its gcda counters are reset
+    ### before it is executed), so the result does not depend on the queue
+    ### order it was recorded in
+    cpath = cached_cov_path(digest, cov_paths)
+    if not is_dir(os.path.dirname(cpath)):
+        os.makedirs(os.path.dirname(cpath), exist_ok=True)
+
+    ### write to a temporary file first so that concurrent afl-cov
+    ### instances sharing the cache never see partial results
+    tmp_path = "%s.%d" % (cpath, os.getpid())
+    cfile = open(tmp_path, 'w')
+    for f in new_cov['pos']:
+        for ctype in new_cov['pos'][f]:
+            if ctype == 'branch':
+                vals = branch_keys(cov['branch_map'], f,
+                        new_cov['pos'][f][ctype])
+            else:
+                vals = sorted(new_cov['pos'][f][ctype])
+            for val in vals:
+                cfile.write("%s, %s, %s\n" % (f, ctype, val))
+    cfile.close()
+    os.rename(tmp_path, cpath)
+
+    return
+
+def write_lcov_pos(cov_paths, cov, cargs, lcov_file=None):
+
+    ### rewrite the final lcov trace file so that everything in cov['pos']
+    ### counts as executed at least once, and fix up the LH/FNH/BRH totals
+    if not lcov_file:
+        lcov_file = cov_paths['lcov_info_final']
+
+    src_path = lcov_file
+    if not os.path.exists(src_path):
+        src_path = cov_paths['lcov_base']
+    if not os.path.exists(src_path):
+        return
+
+    tmp_path = lcov_file + '.pos'
+    out = open(tmp_path, 'w')
+    with open(src_path, 'rb') as f:
+        src_file = ''
+        pos      = None
+        hits     = {'LH': 0, 'FNH': 0, 'BRH': 0}
+        for line in f:
+            line = line.decode('utf-8', errors='ignore').rstrip('\n')
+
+            if line.startswith('SF:'):
+                src_file = line[3:]
+                pos  = cov['pos'].get(src_file)
+                hits = {'LH': 0, 'FNH': 0, 'BRH': 0}
+            elif line.startswith('FNDA:'):
+                [cnt, fcn] = line[5:].split(',', 1)
+                if cnt == '0' and pos and fcn + '()' in pos['function']:
+                    cnt  = '1'
+                    line = 'FNDA:1,' + fcn
+                if cnt != '0':
+                    hits['FNH'] += 1
+            elif line.startswith('DA:'):
+                vals = line[3:].split(',')
+                if vals[1] == '0' and pos and vals[0] in pos['line']:
+                    vals[1] = '1'
+                    line = 'DA:' + ','.join(vals)
+                if vals[1] != '0':
+                    hits['LH'] += 1
+            elif line.startswith('BRDA:'):
+                vals = line[5:].split(',')
+                if vals[3] in ['0', '-'] and pos and pos['branch']:
+                    bit = branch_index(cov['branch_map'], src_file,
+                            ','.join(vals[:3]))
+                    if bit is not None and (pos['branch'] >> bit) & 1:
+                        vals[3] = '1'
+                        line = 'BRDA:' + ','.join(vals)
+                if vals[3] not in ['0', '-']:
+                    hits['BRH'] += 1
+            else:
+                for k in hits:
+                    if line.startswith(k + ':'):
+                        line = "%s:%d" % (k, hits[k])
+
+            out.write(line + '\n')
+    out.close()
+    os.rename(tmp_path, lcov_file)
+
+    return
+
+def update_pos_cov(src_file, ctype, new_cov, cov):
+
+    ### merge new positive coverage for one coverage type of src_file into
+    ### cov['pos'] and return the values that were not covered before
+    if ctype == 'branch':
+        ### branches are stored as a per-file bitmask over the
+        ### (line, block, branch) index in cov['branch_map']
+        new_bits = new_cov['pos'][src_file][ctype] \
+                & ~cov['pos'][src_file][ctype]
+        if not new_bits:
+            return []
+        cov['pos'][src_file][ctype] |= new_bits
+        return branch_keys(cov['branch_map'], src_file, new_bits)
+
+    new_vals = []
+    for val in sorted(new_cov['pos'][src_file][ctype]):
+        if val not in cov['pos'][src_file][ctype]:
+            cov['pos'][src_file][ctype][val] = ''
+            new_vals.append(val)
+
+    return new_vals
+
+### the pipeline extracts coverage on a worker thread and web reports are
+### written on the scheduler thread, while the diff uses the same branch
+### index (and a --state-db BranchMapStore swaps entries in and out)
+BRANCH_MAP_LOCK = threading.Lock()
+
+def branch_bit(branch_map, src_file, key):
+
+    ### map a 'line,block,branch' key to its bit index within src_file
+    with BRANCH_MAP_LOCK:
+        if src_file not in branch_map:
+            branch_map[src_file] = {'ids': {}, 'keys': []}
+
+        bmap = branch_map[src_file]
+        bit  = bmap['ids'].get(key)
+        if bit is None:
+            bit = len(bmap['keys'])
+            bmap['ids'][key] = bit
+            bmap['keys'].append(key)
+
+    return bit
+
+def branch_index(branch_map, src_file, key):
+    ### bit index of a known branch key, None otherwise
+    with BRANCH_MAP_LOCK:
+        if src_file not in branch_map:
+            return None
+        return branch_map[src_file]['ids'].get(key)
+
+def branch_keys(branch_map, src_file, mask):
+
+    keys = []
+    with BRANCH_MAP_LOCK:
+        bkeys = branch_map[src_file]['keys'] if mask else []
+        while mask:
+            low = mask & -mask
+            keys.append(bkeys[low.bit_length() - 1])
+            mask ^= low
+
+    return sorted(keys, key=lambda k: [int(v) for v in k.split(',')])
+
+def count_cov(new_cov):
+
+    ### number of functions/lines/branches known to lcov in an extracted
+    ### coverage capture
+    counts = {'line': 0, 'function': 0, 'branch': 0}
+    for k in ['pos', 'zero']:
+        for f in new_cov[k]:
+            for ctype in new_cov[k][f]:
+                if ctype == 'branch':
+                    counts[ctype] += bin(new_cov[k][f][ctype]).count('1')
+                else:
+                    counts[ctype] += len(new_cov[k][f][ctype])
+    return counts
+
+def write_plot_data(id_val, cycle_num, cov_paths, cov):
 
+    ### covered counts are maintained in coverage_diff() as new positive
+    ### coverage is found
+    row = [str(int(time.time())), str(id_val), str(cycle_num)]
+    for ctype in ['line', 'function', 'branch']:
+        row.append(str(cov['totals'][ctype]))
+        row.append(str(cov['universe'][ctype]))
+
+    append_file(', '.join(row), cov_paths['plot_data'])
     return
 
-def write_zero_cov(zero_cov, cov_paths, cargs):
+def write_zero_cov(zero_cov, cov_paths, cargs, branch_map):
 
     cpath = cov_paths['zero_cov']
 
@@ -402,10 +2530,10 @@ def write_zero_cov(zero_cov, cov_paths, cargs):
     cfile.write("# All functions / lines in this file were never executed by any\n")
     cfile.write("# AFL test case.\n")
     cfile.close()
-    write_cov(cpath, zero_cov, cargs)
+    write_cov(cpath, zero_cov, cargs, branch_map)
     return
 
-def write_pos_cov(pos_cov, cov_paths, cargs):
+def write_pos_cov(pos_cov, cov_paths, cargs, branch_map):
 
     cpath = cov_paths['pos_cov']
 
@@ -416,10 +2544,10 @@ def write_pos_cov(pos_cov, cov_paths, cargs):
     cfile.write("# least one AFL test case. See the cov/id-delta-cov file\n")
     cfile.write("# for more information.\n")
     cfile.close()
-    write_cov(cpath, pos_cov, cargs)
+    write_cov(cpath, pos_cov, cargs, branch_map)
     return
 
-def write_cov(cpath, cov, cargs):
+def write_cov(cpath, cov, cargs, branch_map):
     cfile = open(cpath, 'a')
     for f in cov:
         cfile.write("File: %s\n" % f)
@@ -431,6 +2559,10 @@ def write_cov(cpath, cov, cargs):
                 if cargs.coverage_include_lines:
                     for val in sorted(cov[f][ctype], key=int):
                         cfile.write("    %s: %s\n" % (ctype, val))
+            elif ctype == 'branch':
+                if cov[f][ctype]:
+                    for val in branch_keys(branch_map, f, cov[f][ctype]):
+                        cfile.write("    %s: %s\n" % (ctype, val))
     cfile.close()
 
     return
@@ -457,9 +2589,10 @@ def cov_init(cfile, cov):
             cov[k][cfile] = {}
             cov[k][cfile]['function'] = {}
             cov[k][cfile]['line'] = {}
+            cov[k][cfile]['branch'] = 0
     return
 
-def extract_coverage(lcov_file, log_file, cargs):
+def extract_coverage(lcov_file, log_file, cargs, branch_map):
 
     search_rv = False
     tmp_cov = {}
@@ -469,10 +2602,42 @@ def extract_coverage(lcov_file, log_file, cargs):
                 log_file, cargs)
         return tmp_cov
 
+    if cargs.coverage_backend == 'llvm':
+        return llvm_extract_coverage(lcov_file, cargs, branch_map)
+
+    for src_file, rec in lcov_records(lcov_file, log_file, cargs,
+            branch_map):
+        if 'pos' in tmp_cov and src_file in tmp_cov['pos']:
+            ### the same source file appears in more than one SF: record
+            for k in ['pos', 'zero']:
+                for ctype in ['function', 'line']:
+                    tmp_cov[k][src_file][ctype].update(rec[k][src_file][ctype])
+                tmp_cov[k][src_file]['branch'] |= rec[k][src_file]['branch']
+        else:
+            cov_init(src_file, tmp_cov)
+            for k in ['pos', 'zero']:
+                tmp_cov[k][src_file] = rec[k][src_file]
+
+    return tmp_cov
+
+def lcov_records(lcov_file, log_file, cargs, branch_map):
+
+    ### yield (src_file, coverage) for each SF: record of an lcov trace,
+    ### where coverage has the same 'pos'/'zero' layout as the dictionary
+    ### extract_coverage() returns but for a single source file
+    if not os.path.exists(lcov_file):
+        logr("[-] Coverage file '%s' does not exist, skipping." % lcov_file,
+                log_file, cargs)
+        return
+
+    ### --granularity function never looks at DA: records
+    skip_lines = cargs.granularity == 'function'
+
     ### populate old lcov output for functions/lines that were called
     ### zero times
     with open(lcov_file, 'rb') as f:
         current_file = ''
+        rec = {}
         for line in f:
             try: 
                 line = line.decode('utf-8')
@@ -484,19 +2649,30 @@ def extract_coverage(lcov_file, log_file, cargs):
 
             m = re.search(r'SF:(\S+)', line)
             if m and m.group(1):
+                if rec:
+                    yield current_file, rec
                 current_file = m.group(1)
-                cov_init(current_file, tmp_cov)
+                rec = {}
+                if not is_included(current_file, cargs):
+                    ### skip the record, nothing outside --include-src
+                    ### is tracked
+                    current_file = ''
+                    continue
+                cov_init(current_file, rec)
                 continue
 
             if current_file:
+                if skip_lines and line[:3] == 'DA:':
+                    continue
+
                 m = re.search(r'^FNDA:(\d+),(\S+)', line)
                 if m and m.group(2):
                     fcn = m.group(2) + '()'
                     if m.group(1) == '0':
                         ### the function was never called
-                        tmp_cov['zero'][current_file]['function'][fcn] = ''
+                        rec['zero'][current_file]['function'][fcn] = ''
                     else:
-                        tmp_cov['pos'][current_file]['function'][fcn] = ''
+                        rec['pos'][current_file]['function'][fcn] = ''
                     continue
 
                 ### look for lines that were never called
@@ -505,9 +2681,164 @@ def extract_coverage(lcov_file, log_file, cargs):
                     lnum = m.group(1)
                     if m.group(2) == '0':
                         ### the line was never executed
-                        tmp_cov['zero'][current_file]['line'][lnum] = ''
+                        rec['zero'][current_file]['line'][lnum] = ''
                     else:
-                        tmp_cov['pos'][current_file]['line'][lnum] = ''
+                        rec['pos'][current_file]['line'][lnum] = ''
+                    continue
+
+                if cargs.enable_branch_coverage:
+                    ### BRDA:<line>,<block>,<branch>,<taken> where taken
+                    ### is '-' if the enclosing block was never executed
+                    m = re.search(r'^BRDA:(\d+,\d+,\d+),(\S+)', line)
+                    if m and m.group(1):
+                        bit = branch_bit(branch_map, current_file, m.group(1))
+                        if m.group(2) == '0' or m.group(2) == '-':
+                            rec['zero'][current_file]['branch'] |= 1 << bit
+                        else:
+                            rec['pos'][current_file]['branch'] |= 1 << bit
+
+    if rec:
+        yield current_file, rec
+    return
+
+def llvm_cov_binary(cargs):
+    if cargs.llvm_cov_binary:
+        return cargs.llvm_cov_binary
+    for part in cargs.coverage_cmd.split(' '):
+        if part and part[0] != '-' and which(part):
+            return part
+    return ''
+
+def llvm_gen_coverage(cov_paths, cargs, trace_file):
+
+    ### --coverage-backend llvm: merge the profraw files written since the
+    ### last capture into the cumulative profdata (the equivalent of the
+    ### gcda counters), then export it as llvm-cov JSON for extract_coverage()
+    profraw = glob.glob(cov_paths['profraw_dir'] + '/*.profraw')
+    if profraw:
+        inputs = list(profraw)
+        if os.path.exists(cov_paths['profdata']):
+            inputs.append(cov_paths['profdata'])
+        with open(cov_paths['profraw_list'], 'w') as f:
+            f.write(''.join(p + '\n' for p in inputs))
+
+        tmp_profdata = cov_paths['profdata'] + '.tmp'
+        run_cmd(cargs.llvm_profdata_path \
+                + " merge -sparse -f " + cov_paths['profraw_list'] \
+                + " -o " + tmp_profdata, \
+                cov_paths['log_file'], cargs, LOG_ERRORS)
+        if os.path.exists(tmp_profdata):
+            ### renamed so the web report thread never sees a partial file
+            os.rename(tmp_profdata, cov_paths['profdata'])
+        for p in profraw:
+            os.unlink(p)
+
+    if not os.path.exists(cov_paths['profdata']):
+        return
+
+    run_cmd(cargs.llvm_cov_path \
+            + " export -instr-profile=" + cov_paths['profdata'] \
+            + " " + llvm_cov_binary(cargs) \
+            + " > " + trace_file, \
+            cov_paths['log_file'], cargs, LOG_ERRORS)
+    return
+
+def llvm_export_lcov(cov_paths, cargs):
+    lcov_file = "%s/trace.llvm.lcov_info" % cov_paths['lcov_dir']
+    run_cmd(cargs.llvm_cov_path \
+            + " export -format=lcov -instr-profile=" + cov_paths['profdata'] \
+            + " " + llvm_cov_binary(cargs) \
+            + " > " + lcov_file, \
+            cov_paths['log_file'], cargs, LOG_ERRORS)
+    return lcov_file
+
+def llvm_line_counts(segments):
+
+    ### (line, count) for every mapped line, from llvm-cov export segments
+    ### [line, col, count, has_count, is_region_entry, is_gap_region]
+    ### following llvm::coverage::LineCoverageStats
+    counts       = []
+    wrapped      = None
+    wrapped_line = 0
+    i            = 0
+
+    def region_start(seg):
+        return seg[3] and seg[4] and not (len(seg) > 5 and seg[5])
+
+    while i < len(segments):
+        line      = segments[i][0]
+        line_segs = []
+        while i < len(segments) and segments[i][0] == line:
+            line_segs.append(segments[i])
+            i += 1
+
+        ### lines covered only by the region carried over from before
+        if wrapped and wrapped[3]:
+            for l in range(wrapped_line + 1, line):
+                counts.append((l, wrapped[2]))
+
+        num_starts = len([s for s in line_segs if region_start(s)])
+        skipped    = not line_segs[0][3] and line_segs[0][4]
+        if not skipped and ((wrapped and wrapped[3]) or num_starts):
+            count = wrapped[2] if wrapped and wrapped[3] else 0
+            for s in line_segs:
+                if region_start(s):
+                    count = max(count, s[2])
+            counts.append((line, count))
+
+        wrapped      = line_segs[-1]
+        wrapped_line = line
+
+    return counts
+
+def llvm_extract_coverage(json_file, cargs, branch_map):
+
+    ### llvm-cov export JSON into the same structure extract_coverage()
+    ### builds from lcov traces
+    tmp_cov = {}
+    try:
+        with open(json_file, 'r') as f:
+            export = json.load(f)
+    except ValueError:
+        return tmp_cov
+
+    for data in export.get('data', []):
+        for finfo in data.get('files', []):
+            src_file = finfo['filename']
+            if is_excluded(src_file, cargs):
+                continue
+            cov_init(src_file, tmp_cov)
+
+            segments = finfo.get('segments', [])
+            if cargs.granularity == 'function':
+                segments = []
+            for lnum, count in llvm_line_counts(segments):
+                if count:
+                    tmp_cov['pos'][src_file]['line'][str(lnum)] = ''
+                else:
+                    tmp_cov['zero'][src_file]['line'][str(lnum)] = ''
+
+            if cargs.enable_branch_coverage:
+                ### [line, col, end_line, end_col, true_count, false_count,
+                ### ...], the column stands in for the lcov block number
+                for br in finfo.get('branches', []):
+                    for idx, count in enumerate(br[4:6]):
+                        bit = branch_bit(branch_map, src_file,
+                                "%d,%d,%d" % (br[0], br[1], idx))
+                        if count:
+                            tmp_cov['pos'][src_file]['branch'] |= 1 << bit
+                        else:
+                            tmp_cov['zero'][src_file]['branch'] |= 1 << bit
+
+        for fn in data.get('functions', []):
+            src_file = fn['filenames'][0] if fn.get('filenames') else ''
+            if src_file not in tmp_cov.get('pos', {}):
+                continue
+            fcn = fn['name'] + '()'
+            if fn['count']:
+                tmp_cov['pos'][src_file]['function'][fcn] = ''
+            else:
+                tmp_cov['zero'][src_file]['function'][fcn] = ''
 
     return tmp_cov
 
@@ -518,6 +2849,9 @@ def search_cov(cargs):
     id_delta_file = cargs.afl_fuzzing_dir + '/cov/id-delta-cov'
     log_file      = cargs.afl_fuzzing_dir + '/cov/afl-cov.log'
 
+    if cargs.exact_search:
+        return search_exact_cov(cargs)
+
     with open(id_delta_file, 'rb') as f:
         for line in f:
             try:
@@ -561,6 +2895,68 @@ def search_cov(cargs):
 
     return search_rv
 
+def search_exact_cov(cargs):
+
+    ### report every test case that executed a function or line from the
+    ### --exact-coverage store instead of just the first one
+    log_file = cargs.afl_fuzzing_dir + '/cov/afl-cov.log'
+    store    = exact_store_load(cargs.afl_fuzzing_dir + '/cov/exact')
+    if not store:
+        print("[*] No --exact-coverage results in %s/cov" \
+                % cargs.afl_fuzzing_dir)
+        return False
+
+    if cargs.func_search:
+        ctype, val, desc = 'function', cargs.func_search, \
+                "Function '%s'" % cargs.func_search
+    else:
+        ctype, val, desc = 'line', cargs.line_search, \
+                "Line '%s'" % cargs.line_search
+
+    src_files = []
+    if cargs.src_file:
+        src_files.append(cargs.src_file)
+    else:
+        for key in store['keys']:
+            [src_file, key_ctype, key_val] = key.split(', ')
+            if key_ctype == ctype and key_val == val \
+                    and src_file not in src_files:
+                src_files.append(src_file)
+
+    search_rv = False
+    for src_file in src_files:
+        for afl_file in exact_inputs_hitting(store,
+                "%s, %s, %s" % (src_file, ctype, val)):
+            logr("[+] %s in file: '%s' executed by: '%s'" \
+                    % (desc, src_file, afl_file), log_file, cargs)
+            search_rv = True
+
+    if not search_rv:
+        logr("[-] %s not found..." % desc, log_file, cargs)
+
+    return search_rv
+
+def show_test_case_cov(cargs):
+
+    if not cargs.afl_fuzzing_dir:
+        print("[*] Must set --afl-fuzzing-dir")
+        return False
+
+    store = exact_store_load(cargs.afl_fuzzing_dir + '/cov/exact')
+    if not store:
+        print("[*] No --exact-coverage results in %s/cov" \
+                % cargs.afl_fuzzing_dir)
+        return False
+
+    keys = exact_test_case_cov(store, cargs.test_case_cov)
+    if keys is None:
+        print("[-] Test case '%s' not found" % cargs.test_case_cov)
+        return False
+
+    for key in keys:
+        print(key)
+    return True
+
 def get_cycle_num(id_num, cargs):
 
     ### default cycle
@@ -581,48 +2977,64 @@ def get_cycle_num(id_num, cargs):
 
     return cycle_num
 
-def lcov_gen_coverage(cov_paths, cargs):
+def lcov_gen_coverage(cov_paths, cargs, gcda_dir=None, lcov_info=None,
+        lcov_info_final=None):
 
     out_lines = []
+    start     = time.time()
+
+    if not gcda_dir:
+        gcda_dir = cov_paths['gcda_dir']
+    if not lcov_info:
+        lcov_info = cov_paths['lcov_info']
+    if not lcov_info_final:
+        lcov_info_final = cov_paths['lcov_info_final']
+
+    if cargs.coverage_backend == 'llvm':
+        llvm_gen_coverage(cov_paths, cargs, lcov_info_final)
+        observe_stage(cov_paths, 'capture', time.time() - start)
+        return
 
     lcov_opts = ''
     if cargs.enable_branch_coverage:
         lcov_opts += ' --rc lcov_branch_coverage=1'
-    if cargs.follow:
+    if cargs.follow or cov_paths['capture_scope']:
         lcov_opts += ' --follow'
 
     run_cmd(cargs.lcov_path \
             + lcov_opts
             + " --no-checksum --capture --directory " \
-            + cargs.code_dir + " --output-file " \
-            + cov_paths['lcov_info'], \
+            + gcda_dir + " --output-file " \
+            + lcov_info, \
             cov_paths['log_file'], cargs, LOG_ERRORS)
 
     if (cargs.disable_lcov_exclude_pattern):
         out_lines = run_cmd(cargs.lcov_path \
                 + lcov_opts
                 + " --no-checksum -a " + cov_paths['lcov_base'] \
-                + " -a " + cov_paths['lcov_info'] \
-                + " --output-file " + cov_paths['lcov_info_final'], \
+                + " -a " + lcov_info \
+                + " --output-file " + lcov_info_final, \
                 cov_paths['log_file'], cargs, WANT_OUTPUT)[1]
     else:
-        tmp_file = NamedTemporaryFile(delete=False)
+        tmp_file = NamedTemporaryFile(delete=False,
+                dir=cov_paths['staging_dir'] or None)
         run_cmd(cargs.lcov_path \
                 + lcov_opts
                 + " --no-checksum -a " + cov_paths['lcov_base'] \
-                + " -a " + cov_paths['lcov_info'] \
+                + " -a " + lcov_info \
                 + " --output-file " + tmp_file.name, \
                 cov_paths['log_file'], cargs, LOG_ERRORS)
         out_lines = run_cmd(cargs.lcov_path \
                 + lcov_opts
                 + " --no-checksum -r " + tmp_file.name \
                 + " " + cargs.lcov_exclude_pattern + "  --output-file " \
-                + cov_paths['lcov_info_final'],
+                + lcov_info_final,
                 cov_paths['log_file'], cargs, WANT_OUTPUT)[1]
         if os.path.exists(tmp_file.name):
             os.unlink(tmp_file.name)
 
     log_coverage(out_lines, cov_paths['log_file'], cargs)
+    observe_stage(cov_paths, 'capture', time.time() - start)
 
     return
 
@@ -643,23 +3055,309 @@ def log_coverage(out_lines, log_file, cargs):
                                 log_file, cargs)
     return
 
-def gen_web_cov_report(fuzz_dir, cov_paths, cargs):
+def web_reports_enabled(cargs):
+    ### web reports while test cases are still being processed
+    if cargs.disable_lcov_web:
+        return False
+    return cargs.lcov_web_all or (cargs.live and cargs.lcov_web_interval > 0)
+
+def request_web_report(fuzz_dir, cov_paths, cov, cargs, lcov_file=None):
+    if not cov_paths['web_reports']:
+        cov_paths['web_reports'] = WebReportScheduler(fuzz_dir,
+                cov_paths, cargs)
+    if not lcov_file:
+        lcov_file = cov_paths['lcov_info_final']
+    if cov['non_cumulative']:
+        cov_paths['web_reports'].request(lcov_file, cov)
+    else:
+        cov_paths['web_reports'].request(lcov_file)
+    return
+
+class WebReportScheduler(object):
+
+    ### Runs genhtml on a background thread for test cases that found new
+    ### coverage. Requests made while a report is being generated or within
+    ### --lcov-web-interval seconds of the last one are coalesced, and only
+    ### the most recent trace snapshot is rendered.
+
+    def __init__(self, fuzz_dir, cov_paths, cargs):
+        self.fuzz_dir     = fuzz_dir
+        self.cov_paths    = cov_paths
+        self.cargs        = cargs
+        self.active_file  = cov_paths['lcov_web']
+        self.pending_file = cov_paths['lcov_web'] + '.pending'
+        self.cond         = threading.Condition()
+        self.pending      = False
+        self.stopping     = False
+        self.last_run     = 0
+        self.requests     = 0
+        self.runs         = 0
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def request(self, lcov_file, cov=None):
+
+        ### snapshot the trace now since the next capture overwrites it,
+        ### cov is given when the gcda counters miss earlier coverage
+        if not os.path.exists(lcov_file):
+            return
+        with self.cond:
+            copyfile(lcov_file, self.pending_file)
+            if cov is not None:
+                write_lcov_pos(self.cov_paths, cov, self.cargs,
+                        self.pending_file)
+            self.pending = True
+            self.requests += 1
+            self.cond.notify()
+        return
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.stopping:
+                    self.cond.wait()
+                if self.stopping:
+                    return
+                delay = self.last_run + self.cargs.lcov_web_interval \
+                        - time.time()
+                while delay > 0 and not self.stopping:
+                    self.cond.wait(delay)
+                    delay = self.last_run + self.cargs.lcov_web_interval \
+                            - time.time()
+                if self.stopping:
+                    return
+                os.rename(self.pending_file, self.active_file)
+                self.pending = False
+
+            gen_web_cov_report(self.fuzz_dir, self.cov_paths, self.cargs,
+                    self.active_file)
+            self.last_run = time.time()
+            self.runs += 1
+
+    def stop(self):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        self.thread.join()
+
+        for f in [self.active_file, self.pending_file]:
+            if os.path.exists(f):
+                os.unlink(f)
+
+        logr("[+] Generated %d web reports for %d test cases with new " \
+                "coverage." % (self.runs, self.requests),
+                self.cov_paths['log_file'], self.cargs)
+        return
+
+def gen_web_cov_report(fuzz_dir, cov_paths, cargs, lcov_file=None):
 
     genhtml_opts = ''
+    start        = time.time()
+
+    if not lcov_file:
+        lcov_file = cov_paths['lcov_info_final']
 
     if cargs.enable_branch_coverage:
         genhtml_opts += ' --branch-coverage'
 
+    if cargs.coverage_backend == 'llvm':
+        ### genhtml needs lcov format, exported from the cumulative profdata
+        lcov_file = llvm_export_lcov(cov_paths, cargs)
+
     run_cmd(cargs.genhtml_path \
             + genhtml_opts
             + " --output-directory " \
             + cov_paths['web_dir'] + " " \
-            + cov_paths['lcov_info_final'], \
+            + lcov_file, \
             cov_paths['log_file'], cargs, LOG_ERRORS)
 
     logr("[+] Final lcov web report: %s/%s" % \
             (cov_paths['web_dir'], 'index.html'), cov_paths['log_file'], cargs)
+    observe_stage(cov_paths, 'report', time.time() - start)
+
+    return
+
+### --metrics-listen: Prometheus text format metrics served over HTTP
+METRICS_STAGES  = ['exec', 'capture', 'extract', 'diff', 'report']
+METRICS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+        30, 60]
+
+def metrics_init(cov_paths):
+    cov_paths['metrics'] = {
+        'lock': threading.Lock(),
+        'processed': {},  ### fuzzing dir -> test cases processed
+        'stages': dict((stage, {'buckets': [0] * len(METRICS_BUCKETS),
+                'sum': 0.0, 'count': 0}) for stage in METRICS_STAGES),
+    }
+    return
+
+def observe_stage(cov_paths, stage, secs):
+    metrics = cov_paths.get('metrics')
+    if not metrics:
+        return
+    hist = metrics['stages'][stage]
+    with metrics['lock']:
+        for i, le in enumerate(METRICS_BUCKETS):
+            if secs <= le:
+                hist['buckets'][i] += 1
+        hist['sum']   += secs
+        hist['count'] += 1
+    return
+
+def timed_stage(cov_paths, stage, func, *args, **kwargs):
+    start = time.time()
+    rv = func(*args, **kwargs)
+    observe_stage(cov_paths, stage, time.time() - start)
+    return rv
+
+def count_processed(fuzz_dir, cov_paths):
+    metrics = cov_paths.get('metrics')
+    if metrics:
+        with metrics['lock']:
+            metrics['processed'][fuzz_dir] = \
+                    metrics['processed'].get(fuzz_dir, 0) + 1
+    return
 
+def metrics_text(cov_paths, cov, cargs):
+
+    metrics = cov_paths['metrics']
+    lines   = []
+
+    def metric(name, mtype, help_str, samples):
+        lines.append("# HELP afl_cov_%s %s" % (name, help_str))
+        lines.append("# TYPE afl_cov_%s %s" % (name, mtype))
+        for labels, val in samples:
+            lines.append("afl_cov_%s%s %s" % (name, labels, val))
+
+    def label(**kv):
+        return '{%s}' % ','.join('%s="%s"' % (k, str(kv[k]).replace('\\',
+                '\\\\').replace('"', '\\"')) for k in sorted(kv))
+
+    with metrics['lock']:
+        processed = dict(metrics['processed'])
+        stages    = dict((k, {'buckets': list(v['buckets']), 'sum': v['sum'],
+                'count': v['count']}) for k, v in metrics['stages'].items())
+
+    metric('test_cases_processed_total', 'counter',
+            'Test cases processed per fuzzing dir.',
+            [(label(fuzz_dir=d), processed[d]) for d in sorted(processed)])
+
+    ### queued test cases on disk that afl-cov has not processed yet
+    backlog = []
+    for fuzz_dir in list(cov_paths['dirs']):
+        queued = 0
+        for qdir in test_case_dirs(fuzz_dir, cargs):
+            if is_dir(qdir):
+                queued += len([f for f in os.listdir(qdir)
+                        if f.startswith('id:')])
+        backlog.append((label(fuzz_dir=fuzz_dir),
+                max(queued - processed.get(fuzz_dir, 0), 0)))
+    metric('backlog', 'gauge',
+            'AFL test cases not processed yet per fuzzing dir.', backlog)
+
+    stats = cov_paths['stats']
+    metric('duplicates_total', 'counter',
+            'Byte-identical test cases that were skipped.',
+            [('', stats['duplicates'])])
+    metric('cache_hits_total', 'counter',
+            'Test cases with cached coverage results.',
+            [('', stats['cache_hits'])])
+    metric('exec_timeouts_total', 'counter',
+            'Coverage command executions killed after --exec-timeout.',
+            [('', stats['timeouts'])])
+    metric('exec_failures_total', 'counter',
+            'Coverage command executions with a non-zero exit status.',
+            [('', stats['exec_failures'])])
+
+    metric('covered', 'gauge', 'Covered functions, lines and branches.',
+            [(label(type=t), cov['totals'][t]) for t in sorted(cov['totals'])])
+    metric('instrumented', 'gauge',
+            'Functions, lines and branches in the last lcov capture.',
+            [(label(type=t), cov['universe'][t])
+                for t in sorted(cov['universe'])])
+
+    lines.append("# HELP afl_cov_stage_seconds Time spent per processing stage.")
+    lines.append("# TYPE afl_cov_stage_seconds histogram")
+    for stage in METRICS_STAGES:
+        hist = stages[stage]
+        for i, le in enumerate(METRICS_BUCKETS):
+            lines.append("afl_cov_stage_seconds_bucket%s %d" \
+                    % (label(stage=stage, le=le), hist['buckets'][i]))
+        lines.append("afl_cov_stage_seconds_bucket%s %d" \
+                % (label(stage=stage, le='+Inf'), hist['count']))
+        lines.append("afl_cov_stage_seconds_sum%s %f" \
+                % (label(stage=stage), hist['sum']))
+        lines.append("afl_cov_stage_seconds_count%s %d" \
+                % (label(stage=stage), hist['count']))
+
+    return '\n'.join(lines) + '\n'
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ['/', '/metrics']:
+            self.send_error(404)
+            return
+        body = metrics_text(self.server.cov_paths, self.server.cov,
+                self.server.cargs).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        ### scrapes are not worth an afl-cov.log entry
+        return
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        ### BaseHTTPRequestHandler expects a (host, port) client address
+        request, client_address = self.socket.accept()
+        return request, ('unix', 0)
+
+def parse_metrics_listen(listen):
+    ### 'unix:/path', 'host:port' or 'port' (localhost)
+    if listen.startswith('unix:'):
+        return listen[5:]
+    host, sep, port = listen.rpartition(':')
+    if not port.isdigit():
+        return None
+    return (host or '127.0.0.1', int(port))
+
+def start_metrics_server(cov_paths, cov, cargs):
+
+    addr = parse_metrics_listen(cargs.metrics_listen)
+    if isinstance(addr, tuple):
+        server = ThreadingHTTPServer(addr, MetricsHandler)
+    else:
+        if os.path.exists(addr):
+            os.unlink(addr)
+        server = UnixHTTPServer(addr, MetricsHandler)
+    server.cov_paths = cov_paths
+    server.cov       = cov
+    server.cargs     = cargs
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    cov_paths['metrics_server'] = server
+
+    logr("[+] Serving metrics on %s" % cargs.metrics_listen,
+            cov_paths['log_file'], cargs)
+    return
+
+def stop_metrics_server(cov_paths):
+    server = cov_paths.pop('metrics_server')
+    server.shutdown()
+    server.server_close()
+    if isinstance(server.server_address, str) \
+            and os.path.exists(server.server_address):
+        os.unlink(server.server_address)
     return
 
 def is_afl_fuzz_running(cargs):
@@ -709,7 +3407,24 @@ def get_running_pid(stats_file, pid_re):
                 break
     return pid
 
-def run_cmd(cmd, log_file, cargs, collect):
+def record_exec_status(es, cov_paths):
+    if es == EXEC_TIMEOUT:
+        cov_paths['stats']['timeouts'] += 1
+    elif es != 0:
+        cov_paths['stats']['exec_failures'] += 1
+    return
+
+def exec_rlimits_prefix(cargs):
+    ### the shell applies the rlimits before --coverage-cmd starts, a
+    ### preexec_fn is not safe with the pipeline and target threads
+    prefix = ''
+    if cargs.exec_mem_limit:
+        prefix += "ulimit -v %d && " % (cargs.exec_mem_limit * 1024)
+    if cargs.exec_cpu_limit:
+        prefix += "ulimit -t %d && " % cargs.exec_cpu_limit
+    return prefix
+
+def run_cmd(cmd, log_file, cargs, collect, env=None, exec_limits=False):
 
     out = []
 
@@ -726,8 +3441,30 @@ def run_cmd(cmd, log_file, cargs, collect):
     else:
         fh = open(os.devnull, 'w')
 
-    es = subprocess.call(cmd, stdin=None,
-            stdout=fh, stderr=subprocess.STDOUT, shell=True)
+    ### --exec-timeout and the rlimits only apply to --coverage-cmd. With a
+    ### timeout it gets its own process group so that everything started by
+    ### the shell can be killed, otherwise it stays in ours and gets Ctrl-C
+    timeout = None
+    prefix  = ''
+    if exec_limits:
+        if cargs.exec_timeout:
+            timeout = cargs.exec_timeout
+        prefix = exec_rlimits_prefix(cargs)
+
+    proc = subprocess.Popen(prefix + cmd, stdin=None,
+            stdout=fh, stderr=subprocess.STDOUT, shell=True, env=env,
+            start_new_session=timeout is not None)
+    try:
+        es = proc.wait(timeout=timeout)
+    except (subprocess.TimeoutExpired, KeyboardInterrupt) as e:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        proc.wait()
+        if isinstance(e, KeyboardInterrupt):
+            raise
+        es = EXEC_TIMEOUT
 
     fh.close()
 
@@ -743,7 +3480,14 @@ def run_cmd(cmd, log_file, cargs, collect):
                 out.append(decoded_line.rstrip('\n'))
         os.unlink(fh.name)
 
-    if (es != 0) and (collect == LOG_ERRORS or collect == WANT_OUTPUT):
+    if es == EXEC_TIMEOUT:
+        if log_file:
+            logr("    Timeout of %d seconds reached, killed CMD: %s" \
+                    % (timeout, cmd), log_file, cargs)
+        else:
+            print("    Timeout of %d seconds reached, killed CMD: %s" \
+                    % (timeout, cmd))
+    elif (es != 0) and (collect == LOG_ERRORS or collect == WANT_OUTPUT):
         if log_file:
             logr("    Non-zero exit status '%d' for CMD: %s" % (es, cmd),
                     log_file, cargs)
@@ -781,14 +3525,96 @@ def import_fuzzing_dirs(cov_paths, cargs):
 
     return True
 
+def test_case_dirs(fuzz_dir, cargs):
+    qdirs = [fuzz_dir + '/queue']
+    if cargs.replay_crashes:
+        qdirs.append(fuzz_dir + '/crashes')
+    if cargs.replay_hangs:
+        qdirs.append(fuzz_dir + '/hangs')
+    return qdirs
+
 def import_test_cases(qdir):
     return sorted(glob.glob(qdir + "/id:*"))
 
+def afl_file_meta(afl_file):
+
+    ### id:000123,src:000045+000067,time:1234,op:havoc,rep:4,+cov
+    meta = {'id': id_num(afl_file), 'src': [], 'op': '', 'cov': False}
+    for field in os.path.basename(afl_file).split(','):
+        if field == '+cov':
+            meta['cov'] = True
+            continue
+        key, sep, val = field.partition(':')
+        if key == 'src':
+            meta['src'] = [int(v) for v in val.split('+') if v.isdigit()]
+        elif key == 'op':
+            meta['op'] = val
+        elif key == 'orig':
+            meta['op'] = 'orig'
+    return meta
+
+def queue_depths(qdir):
+    ### number of mutation steps from an initial seed through the src: chain
+    depths = {}
+    metas  = [afl_file_meta(f) for f in import_test_cases(qdir)]
+    for meta in sorted(metas, key=lambda m: m['id']):
+        srcs = [depths[i] for i in meta['src'] if i in depths]
+        depths[meta['id']] = min(srcs) + 1 if srcs else 0
+    return depths
+
+def op_rank(op):
+    if op == 'orig' or not op:
+        return 0
+    if op.startswith('havoc'):
+        return 2
+    if op.startswith('splice'):
+        return 3
+    ### deterministic stages (flip, arith, interest, extras, ...)
+    return 1
+
+def schedule_by_id(afl_files, cargs):
+    return afl_files
+
+def schedule_by_priority(afl_files, cargs):
+
+    ### test cases AFL flagged with new edge coverage ('+cov') first, then
+    ### seeds and deterministic stages before havoc/splice, then shallow
+    ### src: chains before deep ones
+    depths = {}
+    for fuzz_dir in set(os.path.dirname(os.path.dirname(f))
+            for f in afl_files):
+        ### crashes/hangs src: ids refer to the queue as well
+        depths[fuzz_dir] = queue_depths(fuzz_dir + '/queue')
+
+    def priority(afl_file):
+        meta  = afl_file_meta(afl_file)
+        qdir  = os.path.dirname(afl_file)
+        depth = depths[os.path.dirname(qdir)]
+        if os.path.basename(qdir) == 'queue':
+            depth = depth.get(meta['id'], 0)
+        else:
+            ### crash/hang ids are their own id space, the depth is one
+            ### step past the queue entry they were mutated from
+            srcs  = [depth[i] for i in meta['src'] if i in depth]
+            depth = min(srcs) + 1 if srcs else 0
+        return (not meta['cov'], op_rank(meta['op']), depth, meta['id'])
+
+    return sorted(afl_files, key=priority)
+
+### order in which newly imported test cases are processed (--schedule)
+TEST_CASE_SCHEDULERS = {
+    'id':       schedule_by_id,
+    'priority': schedule_by_priority,
+}
+
 def init_tracking(cov_paths, cargs):
 
     cov_paths['dirs'] = {}
 
     cov_paths['top_dir']  = "%s/cov"  % cargs.afl_fuzzing_dir
+    if cargs.target_name:
+        ### --coverage-cmd/--code-dir NAME=VALUE targets
+        cov_paths['top_dir'] += '/' + cargs.target_name
     cov_paths['web_dir']  = "%s/web"  % cov_paths['top_dir']
     cov_paths['lcov_dir'] = "%s/lcov" % cov_paths['top_dir']
     cov_paths['diff_dir'] = "%s/diff" % cov_paths['top_dir']
@@ -796,17 +3622,47 @@ def init_tracking(cov_paths, cargs):
 
     ### global coverage results
     cov_paths['id_delta_cov'] = "%s/id-delta-cov" % cov_paths['top_dir']
+    cov_paths['id_delta_bin'] = "%s/id-delta-cov.bin" % cov_paths['top_dir']
     cov_paths['zero_cov']     = "%s/zero-cov" % cov_paths['top_dir']
     cov_paths['pos_cov']      = "%s/pos-cov"  % cov_paths['top_dir']
+    cov_paths['plot_data']    = "%s/plot_data" % cov_paths['top_dir']
+    cov_paths['exact_dir']    = "%s/exact" % cov_paths['top_dir']
+    cov_paths['min_dir']      = "%s/min-corpus" % cov_paths['top_dir']
+    cov_paths['min_manifest'] = "%s/min-corpus-manifest" % cov_paths['top_dir']
+    if cargs.minimize_dir:
+        cov_paths['min_dir'] = cargs.minimize_dir
     cov_paths['diff']         = ''
     cov_paths['id_file']      = ''
     cov_paths['id_min']       = -1  ### used in --cover-corpus mode
     cov_paths['id_max']       = -1  ### used in --cover-corpus mode
+    cov_paths['interval_files'] = 0   ### used in --coverage-every mode
+    cov_paths['interval_start'] = time.time()
+    cov_paths['hashes']       = {}  ### content hash -> first test case
+    cov_paths['stats']        = {'duplicates': 0, 'cache_hits': 0,
+                                 'timeouts': 0, 'exec_failures': 0,
+                                 'prefilter_skips': 0, 'prefilter_misses': 0,
+                                 'novelty_skips': 0, 'novelty_misses': 0}
+    cov_paths['run_once']     = False  ### first exec output gets logged
+
+    ### content hashes only persist across runs in a --dedup-index file,
+    ### cov/ itself is wiped by --overwrite
+    cov_paths['dedup_index'] = cargs.dedup_index
 
     ### raw lcov files
     cov_paths['lcov_base']       = "%s/trace.lcov_base" % cov_paths['lcov_dir']
     cov_paths['lcov_info']       = "%s/trace.lcov_info" % cov_paths['lcov_dir']
     cov_paths['lcov_info_final'] = "%s/trace.lcov_info_final" % cov_paths['lcov_dir']
+    cov_paths['lcov_info_saved'] = cov_paths['lcov_info_final']
+
+    ### gcda counters are written to the build tree unless --staging-dir
+    ### redirects them through GCOV_PREFIX
+    cov_paths['staging_dir'] = ''
+    cov_paths['gcda_prefix'] = ''
+    cov_paths['gcda_dir']    = cargs.code_dir
+    cov_paths['exec_env']    = None
+    cov_paths['capture_scope'] = False
+    cov_paths['gcno_index']    = None
+    cov_paths['gcno_files']    = None
 
     if cargs.overwrite:
         mkdirs(cov_paths, cargs)
@@ -821,52 +3677,630 @@ def init_tracking(cov_paths, cargs):
 
     write_status("%s/afl-cov-status" % cov_paths['top_dir'])
 
-    if not cargs.disable_coverage_init and cargs.coverage_cmd:
+    cov_paths['metrics'] = None
+    if cargs.metrics_listen:
+        metrics_init(cov_paths)
+
+    ### --showmap-cmd edge prefilter state
+    cov_paths['showmap_edges']     = set()
+    cov_paths['prefilter_skipped'] = []
+
+    ### rows for the binary id-delta-cov, written when the run finishes
+    cov_paths['id_delta_cols'] = None
+    if cargs.id_delta_bin:
+        id_delta_bin_init(cov_paths)
+
+    if cargs.staging_dir:
+        init_staging(cov_paths, cargs)
+    cov_paths['showmap_out'] = "%s/showmap" \
+            % (cov_paths['staging_dir'] or cov_paths['lcov_dir'])
+
+    ### --gcda-novelty nonzero byte masks, gcda file -> (size, mask)
+    cov_paths['gcda_nonzero']    = {}
+    cov_paths['novelty_skipped'] = []
+
+    if per_test_coverage(cargs) or cargs.gcda_novelty:
+        cov_paths['gcda_files'] = [cov_paths['gcda_prefix'] + g[:-5] + '.gcda'
+                for g in find_gcno_files(cov_paths, cargs)]
+    if cargs.gcda_novelty:
+        ### gcda counters as of the last skipped test case, captured when
+        ### the next test case sets new counters
+        cov_paths['gcda_snapshot'] = {}
+        cov_paths['novelty_dir'] = "%s/novelty" \
+                % (cov_paths['staging_dir'] or cov_paths['lcov_dir'])
+        init_gcda_dir(cov_paths['novelty_dir'],
+                find_gcno_files(cov_paths, cargs))
+    if cargs.exact_coverage:
+        exact_store_init(cov_paths)
+
+    ### --sample-fraction progressive refinement state
+    cov_paths['sample_pass']     = 0
+    cov_paths['sample_deferred'] = 0
+    cov_paths['sample_done']     = {}  ### fuzzing dir -> sampled test cases
+    cov_paths['sample_counts']   = {}  ### (src_file, type, val) -> test cases
+    cov_paths['sample_size']     = 0
+    cov_paths['sample_rng']      = random.Random(0)
+    cov_paths['coverage_estimate'] = "%s/coverage-estimate" \
+            % cov_paths['top_dir']
+    if cargs.sample_fraction:
+        with open(cov_paths['coverage_estimate'], 'w') as f:
+            f.write("# unix_time, sampled, test_cases, coverage_type, " \
+                    "observed, estimate, ci95_low, ci95_high, instrumented\n")
+
+    ### trace snapshot rendered by the background web report scheduler
+    cov_paths['lcov_web'] = "%s/trace.lcov_web" \
+            % (cov_paths['staging_dir'] or cov_paths['lcov_dir'])
+    cov_paths['web_reports'] = None
+
+    if cargs.pipeline:
+        ### per-slot gcda directories and per test case trace files
+        cov_paths['pipeline_dir'] = "%s/pipeline" \
+                % (cov_paths['staging_dir'] or cov_paths['lcov_dir'])
+        cov_paths['slots'] = []
+        gcno_files = find_gcno_files(cov_paths, cargs)
+        for i in range(cargs.pipeline_slots):
+            slot = "%s/slot%d" % (cov_paths['pipeline_dir'], i)
+            init_gcda_dir(slot, gcno_files)
+            cov_paths['slots'].append(slot)
+
+    if cargs.cov_cache_dir:
+        cov_paths['cache_dir'] = "%s/%s" % (cargs.cov_cache_dir,
+                cov_fingerprint(cov_paths, cargs))
+        if not is_dir(cov_paths['cache_dir']):
+            os.makedirs(cov_paths['cache_dir'])
+        logr("[+] Coverage result cache: %s" % cov_paths['cache_dir'],
+                cov_paths['log_file'], cargs)
 
-        lcov_opts = ''
-        if cargs.enable_branch_coverage:
-            lcov_opts += ' --rc lcov_branch_coverage=1 '
+    if not cargs.disable_test_case_dedup and cargs.dedup_index:
+        ### earlier executions only count when their gcda counters were
+        ### not reset at startup (--dedup-index requires
+        ### --disable-coverage-init)
+        load_dedup_index(cov_paths)
+
+    if cargs.coverage_backend == 'llvm':
+        ### one uniquely named profraw file per process, merged into
+        ### the profdata at each capture
+        cov_paths['profraw_dir'] = "%s/profraw" \
+                % (cov_paths['staging_dir'] or cov_paths['lcov_dir'])
+        cov_paths['profraw_list'] = "%s/profraw-inputs" \
+                % cov_paths['profraw_dir']
+        cov_paths['profdata'] = "%s/trace.profdata" % cov_paths['lcov_dir']
+        if is_dir(cov_paths['profraw_dir']):
+            rmtree(cov_paths['profraw_dir'])
+        os.makedirs(cov_paths['profraw_dir'])
+        if os.path.exists(cov_paths['profdata']):
+            os.unlink(cov_paths['profdata'])
+
+    elif not cargs.disable_coverage_init and cargs.coverage_cmd:
+        ### the .gcno index has no branch records, so branch coverage still
+        ### needs lcov --initial
+        if cargs.disable_gcno_index or cargs.enable_branch_coverage \
+                or not gcno_index_base(cov_paths, cargs):
+            lcov_init_base(cov_paths, cargs)
+
+    if cargs.include_src and cargs.coverage_backend == 'gcov' \
+            and cargs.coverage_cmd:
+        init_capture_scope(cov_paths, cargs)
 
-        ### reset code coverage counters - this is done only once as
-        ### afl-cov is spinning up even if AFL is running in parallel mode
-        run_cmd(cargs.lcov_path \
-                + lcov_opts \
-                + " --no-checksum --zerocounters --directory " \
-                + cargs.code_dir, cov_paths['log_file'], cargs, LOG_ERRORS)
+    return True
+
+def lcov_init_base(cov_paths, cargs):
+
+    lcov_opts = ''
+    if cargs.enable_branch_coverage:
+        lcov_opts += ' --rc lcov_branch_coverage=1 '
+
+    ### reset code coverage counters - this is done only once as
+    ### afl-cov is spinning up even if AFL is running in parallel mode
+    run_cmd(cargs.lcov_path \
+            + lcov_opts \
+            + " --no-checksum --zerocounters --directory " \
+            + cargs.code_dir, cov_paths['log_file'], cargs, LOG_ERRORS)
+
+    run_cmd(cargs.lcov_path \
+            + lcov_opts
+            + " --no-checksum --capture --initial" \
+            + " --directory " + cargs.code_dir \
+            + " --output-file " \
+            + cov_paths['lcov_base'], \
+            cov_paths['log_file'], cargs, LOG_ERRORS)
 
+    if cargs.include_src:
         run_cmd(cargs.lcov_path \
                 + lcov_opts
-                + " --no-checksum --capture --initial" \
-                + " --directory " + cargs.code_dir \
-                + " --output-file " \
-                + cov_paths['lcov_base'], \
+                + " --no-checksum --extract " + cov_paths['lcov_base'] \
+                + " " + ' '.join("'%s'" % p for p in cargs.include_src) \
+                + " --output-file " + cov_paths['lcov_base'], \
                 cov_paths['log_file'], cargs, LOG_ERRORS)
 
+    return
+
+def init_staging(cov_paths, cargs):
+
+    ### per test case lcov traces and gcda counters only live until the
+    ### next test case, so keep them on --staging-dir (e.g. /dev/shm)
+    ### instead of under cov/ and the build tree
+    cov_paths['staging_dir'] = mkdtemp(prefix='afl-cov-',
+            dir=cargs.staging_dir)
+    cov_paths['lcov_info'] = "%s/trace.lcov_info" % cov_paths['staging_dir']
+    cov_paths['lcov_info_final'] = "%s/trace.lcov_info_final" \
+            % cov_paths['staging_dir']
+
+    cov_paths['gcda_prefix'] = "%s/gcda" % cov_paths['staging_dir']
+    init_gcda_dir(cov_paths['gcda_prefix'], find_gcno_files(cov_paths, cargs))
+    cov_paths['gcda_dir'] = gcda_dir(cov_paths['gcda_prefix'], cargs)
+    cov_paths['exec_env'] = gcda_env(cov_paths['gcda_prefix'])
+
+    logr("[+] Staging trace files and gcda counters in %s" \
+            % cov_paths['staging_dir'], cov_paths['log_file'], cargs)
+    return
+
+def persist_staged_trace(cov_paths):
+    ### keep the final lcov trace under cov/lcov/ once staging goes away
+    if cov_paths['lcov_info_final'] != cov_paths['lcov_info_saved'] \
+            and os.path.exists(cov_paths['lcov_info_final']):
+        copyfile(cov_paths['lcov_info_final'], cov_paths['lcov_info_saved'])
+    return
+
+def find_gcno_files(cov_paths, cargs):
+
+    ### --code-dir is only walked once, the gcda dirs, the .gcno index and
+    ### the cache fingerprint all share the list
+    if cov_paths['gcno_files'] is not None:
+        return cov_paths['gcno_files']
+    gcno_files = []
+    for root, dirs, files in os.walk(os.path.abspath(cargs.code_dir),
+            followlinks=cargs.follow):
+        for filename in files:
+            if filename[-5:] == '.gcno':
+                gcno_files.append(os.path.join(root, filename))
+    cov_paths['gcno_files'] = gcno_files
+    return gcno_files
+
+GCNO_MAGIC        = 0x67636e6f
+GCNO_TAG_FUNCTION = 0x01000000
+GCNO_TAG_BLOCKS   = 0x01410000
+GCNO_TAG_LINES    = 0x01450000
+
+def parse_gcno(gcno):
+
+    ### source files, executable lines and functions from a gcc (>= 12)
+    ### .gcno file, the universe 'lcov --capture --initial' gets from gcov:
+    ###   {src_file: {'lines': [line, ...], 'functions': {name: line}}}
+    ### None for anything we cannot parse, including the word counted
+    ### records of older gcc versions (lcov handles those)
+    with open(gcno, 'rb') as f:
+        data = f.read()
+
+    for end in ['<', '>']:
+        if len(data) >= 12 \
+                and struct.unpack_from(end + 'I', data, 0)[0] == GCNO_MAGIC:
+            break
+    else:
+        return None
+
+    ### GCOV_VERSION is 'B22*' for gcc 12.2 and '408*' for gcc 4.8
+    v = struct.pack('>I', struct.unpack_from(end + 'I', data, 4)[0])
+    if v[0] < ord('A') or (v[0] - ord('A')) * 10 + v[1] - ord('0') < 12:
+        return None
+    pos = 12
+
+    def u32():
+        nonlocal pos
+        pos += 4
+        return struct.unpack_from(end + 'I', data, pos - 4)[0]
+
+    def read_str():
+        nonlocal pos
+        length = u32()
+        pos += length
+        return data[pos - length:pos].split(b'\0', 1)[0].decode('utf-8',
+                'replace')
+
+    src_files = {}
+    try:
+        u32()  ### checksum
+        base_dir = read_str() or os.path.dirname(os.path.abspath(gcno))
+        u32()  ### has_unexecuted_blocks
+
+        fcn = None
+        while pos + 8 <= len(data):
+            tag     = u32()
+            length  = u32()
+            rec_end = pos + length
+
+            if tag == GCNO_TAG_FUNCTION:
+                u32(); u32(); u32()  ### ident, line/cfg checksums
+                name = read_str()
+                artificial = u32()
+                src_file = os.path.normpath(os.path.join(base_dir, read_str()))
+                fcn = None
+                if not artificial:
+                    fcn = src_file
+                    src_files.setdefault(src_file, {'lines': set(),
+                            'functions': {}})['functions'][name] = u32()
+
+            elif tag == GCNO_TAG_LINES and fcn:
+                u32()  ### block number
+                src_file = fcn
+                while pos < rec_end:
+                    line = u32()
+                    if line:
+                        src_files.setdefault(src_file, {'lines': set(),
+                                'functions': {}})['lines'].add(line)
+                        continue
+                    name = read_str()
+                    if not name:
+                        break
+                    src_file = os.path.normpath(os.path.join(base_dir, name))
+
+            pos = rec_end
+    except (struct.error, ValueError):
+        return None
+
+    for src_file in src_files:
+        src_files[src_file]['lines'] = sorted(src_files[src_file]['lines'])
+    return src_files
+
+def load_gcno_index(cov_paths, cargs):
+
+    ### (gcno files, per-.gcno parse_gcno() results) for --code-dir, cached
+    ### by path, size and mtime so only changed objects are parsed again;
+    ### None if any .gcno file could not be parsed
+    if cov_paths['gcno_index']:
+        return cov_paths['gcno_index']
+
+    ### one index per code dir, so it only ever holds that build
+    index_file = afl_cov_cache_file('gcno-index/%s' % hashlib.sha1(
+            os.path.abspath(cargs.code_dir).encode('utf-8')).hexdigest())
+    index = {}
+    if os.path.exists(index_file):
+        try:
+            with open(index_file, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+
+    gcno_files = find_gcno_files(cov_paths, cargs)
+    parsed = 0
+    for gcno in gcno_files:
+        st = os.stat(gcno)
+        key = "%d:%d" % (st.st_size, st.st_mtime_ns)
+        if gcno in index and index[gcno]['key'] == key:
+            continue
+        src_files = parse_gcno(gcno)
+        if src_files is None:
+            logr("[*] Could not parse %s" % gcno, cov_paths['log_file'], cargs)
+            return None
+        index[gcno] = {'key': key, 'files': src_files}
+        parsed += 1
+
+    ### remove deleted objects
+    current = set(gcno_files)
+    for gcno in [g for g in index if g not in current]:
+        del index[gcno]
+        parsed += 1
+
+    if parsed:
+        try:
+            os.makedirs(os.path.dirname(index_file), exist_ok=True)
+            tmp_file = "%s.%d" % (index_file, os.getpid())
+            with open(tmp_file, 'w') as f:
+                json.dump(index, f)
+            os.rename(tmp_file, index_file)
+        except OSError:
+            pass
+
+    logr("[+] Indexed %d .gcno files (%d re-indexed)" \
+            % (len(gcno_files), parsed), cov_paths['log_file'], cargs)
+    cov_paths['gcno_index'] = (gcno_files, index)
+    return cov_paths['gcno_index']
+
+def gcno_index_base(cov_paths, cargs):
+
+    ### write trace.lcov_base from the .gcno index instead of running
+    ### 'lcov --capture --initial' over the whole --code-dir
+    gcno_index = load_gcno_index(cov_paths, cargs)
+    if not gcno_index:
+        logr("[*] Falling back to lcov --initial", cov_paths['log_file'],
+                cargs)
+        return False
+    gcno_files, index = gcno_index
+
+    ### headers are shared by many objects, so take the union
+    universe = {}
+    for gcno in gcno_files:
+        for src_file, info in index[gcno]['files'].items():
+            if not is_included(src_file, cargs):
+                continue
+            u = universe.setdefault(src_file, {'lines': set(),
+                    'functions': {}})
+            u['lines'].update(info['lines'])
+            for name, line in info['functions'].items():
+                u['functions'].setdefault(name, line)
+
+    ### lcov drops source lines marked LCOV_EXCL_* from the baseline and
+    ### from every trace, so the baseline has to drop them as well
+    excluded = 0
+    for src_file, u in universe.items():
+        excl_lines = lcov_excl_lines(src_file)
+        if not excl_lines:
+            continue
+        u['lines'].difference_update(excl_lines)
+        for name in [n for n, l in u['functions'].items() if l in excl_lines]:
+            del u['functions'][name]
+        excluded += 1
+
+    with open(cov_paths['lcov_base'], 'w') as f:
+        for src_file in sorted(universe):
+            u = universe[src_file]
+            f.write("TN:\nSF:%s\n" % src_file)
+            fcns = sorted(u['functions'].items(), key=lambda x: (x[1], x[0]))
+            for name, line in fcns:
+                f.write("FN:%d,%s\n" % (line, name))
+            for name, line in fcns:
+                f.write("FNDA:0,%s\n" % name)
+            f.write("FNF:%d\nFNH:0\n" % len(fcns))
+            if cargs.granularity != 'function':
+                for line in sorted(u['lines']):
+                    f.write("DA:%d,0\n" % line)
+                f.write("LF:%d\nLH:0\n" % len(u['lines']))
+            f.write("end_of_record\n")
+
+    ### same as 'lcov --zerocounters'
+    reset_gcda([g[:-5] + '.gcda' for g in gcno_files])
+
+    logr("[+] Built the lcov baseline from %d source files" \
+            % len(universe), cov_paths['log_file'], cargs)
+    if excluded:
+        logr("[+] Applied LCOV_EXCL markers in %d source files" % excluded,
+                cov_paths['log_file'], cargs)
     return True
 
+def lcov_excl_lines(src_file):
+
+    ### source lines excluded by LCOV_EXCL_LINE and LCOV_EXCL_START/STOP
+    ### markers, the way geninfo applies them (branch only LCOV_EXCL_BR_*
+    ### markers do not exclude lines)
+    excl_lines = set()
+    try:
+        with open(src_file, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return excl_lines
+    if b'LCOV_EXCL_' not in data:
+        return excl_lines
+
+    in_excl = False
+    for num, line in enumerate(data.split(b'\n'), 1):
+        if b'LCOV_EXCL_START' in line:
+            in_excl = True
+        if in_excl or b'LCOV_EXCL_LINE' in line:
+            excl_lines.add(num)
+        if b'LCOV_EXCL_STOP' in line:
+            in_excl = False
+    return excl_lines
+
+def init_capture_scope(cov_paths, cargs):
+
+    ### --include-src: capture from a directory of links to only the
+    ### objects that contain an included source file (headers included),
+    ### so lcov and gcov never process the rest of the build
+    gcno_index = load_gcno_index(cov_paths, cargs)
+    if not gcno_index:
+        logr("[*] Capturing all of --code-dir, --include-src only limits " \
+                "the tracked files", cov_paths['log_file'], cargs)
+        return
+    gcno_files, index = gcno_index
+
+    prefix_dir = "%s/capture" \
+            % (cov_paths['staging_dir'] or cov_paths['lcov_dir'])
+    if is_dir(prefix_dir):
+        rmtree(prefix_dir)
+
+    selected = 0
+    for gcno in gcno_files:
+        if not [f for f in index[gcno]['files'] if is_included(f, cargs)]:
+            continue
+        gcda = gcno[:-5] + '.gcda'
+        ### the gcda link dangles until the target first writes counters
+        for target, link in [(gcno, prefix_dir + gcno),
+                (cov_paths['gcda_prefix'] + gcda, prefix_dir + gcda)]:
+            if not is_dir(os.path.dirname(link)):
+                os.makedirs(os.path.dirname(link))
+            os.symlink(target, link)
+        selected += 1
+
+    if not is_dir(gcda_dir(prefix_dir, cargs)):
+        os.makedirs(gcda_dir(prefix_dir, cargs))
+    cov_paths['gcda_dir'] = gcda_dir(prefix_dir, cargs)
+    cov_paths['capture_scope'] = True
+
+    logr("[+] Capturing coverage from %d of %d objects matching --include-src" \
+            % (selected, len(gcno_files)), cov_paths['log_file'], cargs)
+    return
+
+def init_gcda_dir(prefix_dir, gcno_files):
+
+    ### gcda files are written under GCOV_PREFIX followed by the absolute
+    ### object directory, and lcov expects each .gcno next to its .gcda
+    for gcno in gcno_files:
+        link = prefix_dir + gcno
+        if not is_dir(os.path.dirname(link)):
+            os.makedirs(os.path.dirname(link))
+        if not os.path.lexists(link):
+            os.symlink(gcno, link)
+    return
+
+def test_case_env(afl_file, cov_paths, cargs):
+    if cargs.coverage_backend != 'llvm':
+        return cov_paths['exec_env']
+    env = (cov_paths['exec_env'] or os.environ).copy()
+    env['LLVM_PROFILE_FILE'] = "%s/%s-%%p.profraw" \
+            % (cov_paths['profraw_dir'], id_num(afl_file))
+    return env
+
+def gcda_dir(prefix_dir, cargs):
+    return prefix_dir + os.path.abspath(cargs.code_dir)
+
+def gcda_env(prefix_dir):
+    env = os.environ.copy()
+    env['GCOV_PREFIX'] = prefix_dir
+    env['GCOV_PREFIX_STRIP'] = '0'
+    return env
+
 ### credit:
 ### http://stackoverflow.com/questions/377017/test-if-executable-exists-in-python
 def is_exe(fpath):
     return os.path.isfile(fpath) and os.access(fpath, os.X_OK)
 
+ELF_SHT_SYMTAB  = 2
+ELF_SHT_DYNSYM  = 11
+ELF_SHDR        = {1: 'IIIIIIIIII', 2: 'IIQQQQIIQQ'}
+GCOV_SYMBOLS    = [('gcov', b'\0__gcov'), ('llvm_gcov', b'__llvm_gcov'),
+                    ('llvm_profile', b'__llvm_profile')]
+
+def elf_coverage_symbols(binary):
+
+    ### search only the string tables linked from .symtab/.dynsym for the
+    ### gcov/llvm coverage runtime symbols instead of dumping the whole
+    ### binary with readelf -a; None means this is not an ELF file we can
+    ### parse so the caller falls back to readelf
+    with open(binary, 'rb') as f:
+        ident = f.read(16)
+        if len(ident) < 16 or ident[:4] != b'\x7fELF' \
+                or ident[4] not in ELF_SHDR or ident[5] not in (1, 2):
+            return None
+        try:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            return None
+
+    found = []
+    with m:
+        try:
+            end = '<' if ident[5] == 1 else '>'
+            if ident[4] == 2:
+                shoff, = struct.unpack_from(end + 'Q', m, 0x28)
+                shentsize, shnum = struct.unpack_from(end + 'HH', m, 0x3a)
+            else:
+                shoff, = struct.unpack_from(end + 'I', m, 0x20)
+                shentsize, shnum = struct.unpack_from(end + 'HH', m, 0x2e)
+            shdr = end + ELF_SHDR[ident[4]]
+
+            def section(idx):
+                ### (type, offset, size, link)
+                vals = struct.unpack_from(shdr, m, shoff + idx * shentsize)
+                return vals[1], vals[4], vals[5], vals[6]
+
+            if shoff and not shnum:
+                ### more than SHN_LORESERVE sections, the count is in the
+                ### size field of section 0
+                shnum = section(0)[2]
+
+            for idx in range(shnum):
+                sh_type, _, _, link = section(idx)
+                if sh_type not in (ELF_SHT_SYMTAB, ELF_SHT_DYNSYM):
+                    continue
+                _, str_off, str_size, _ = section(link)
+                for name, pattern in GCOV_SYMBOLS:
+                    if name not in found \
+                            and m.find(pattern, str_off, str_off + str_size) != -1:
+                        found.append(name)
+        except (struct.error, ValueError):
+            return None
+
+    return found
+
+def afl_cov_cache_file(name):
+    cache_dir = os.environ.get('XDG_CACHE_HOME') \
+            or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'afl-cov', name)
+
+def bin_coverage_symbols(binary, cargs):
+
+    ### which coverage runtime symbols the binary contains, cached by
+    ### device/inode/size/mtime so large binaries are only scanned once
+    binary = which(binary) or binary
+    try:
+        st = os.stat(binary)
+        key = "%d:%d:%d:%d" % (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+    except OSError:
+        key = None
+
+    cache_file = afl_cov_cache_file('gcov-check')
+    cache      = []
+    if key and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r') as f:
+                for line in f:
+                    ### dev:ino:size:mtime, symbol[,symbol...], /path/to/bin
+                    vals = line.rstrip('\n').split(', ', 2)
+                    if len(vals) != 3:
+                        continue
+                    if vals[0] == key and vals[2] == binary:
+                        return [v for v in vals[1].split(',') if v]
+                    ### drop rebuilt and deleted binaries
+                    if vals[2] != binary and os.path.exists(vals[2]):
+                        cache.append(line)
+        except OSError:
+            pass
+
+    found = None
+    if key:
+        try:
+            found = elf_coverage_symbols(binary)
+        except OSError:
+            found = None
+
+    if found is None:
+        ### not an ELF file we understand, let readelf have a look
+        found = []
+        if not is_exe(cargs.readelf_path):
+            print("[*] Need a valid path to readelf to check '%s', use " \
+                    "--readelf-path" % binary)
+            return found
+        for line in run_cmd("%s -a %s" % (cargs.readelf_path, binary),
+                False, cargs, WANT_OUTPUT)[1]:
+            for name, pattern in GCOV_SYMBOLS:
+                if name not in found \
+                        and pattern.replace(b'\0', b' ').decode() in line:
+                    found.append(name)
+        return found
+
+    cache.append("%s, %s, %s\n" % (key, ','.join(found), binary))
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = NamedTemporaryFile('w', delete=False,
+                dir=os.path.dirname(cache_file))
+        with tmp_file:
+            tmp_file.write(''.join(cache))
+        os.replace(tmp_file.name, cache_file)
+    except OSError:
+        pass
+
+    return found
+
 def is_bin_gcov_enabled(binary, cargs):
 
     rv = False
 
-    ### run readelf against the binary to see if it contains gcov support
-    for line in run_cmd("%s -a %s" % (cargs.readelf_path, binary),
-            False, cargs, WANT_OUTPUT)[1]:
-        if ' __gcov' in line:
-            if cargs.validate_args or cargs.gcov_check or cargs.gcov_check_bin:
-                print("[+] Binary '%s' is compiled with code coverage support via gcc." % binary)
-            rv = True
-            break
+    symbols = bin_coverage_symbols(binary, cargs)
 
-        if '__llvm_gcov' in line:
-            if cargs.validate_args or cargs.gcov_check or cargs.gcov_check_bin:
-                print("[+] Binary '%s' is compiled with code coverage support via llvm." % binary)
-            rv = True
-            break
+    if 'gcov' in symbols:
+        if cargs.validate_args or cargs.gcov_check or cargs.gcov_check_bin:
+            print("[+] Binary '%s' is compiled with code coverage support via gcc." % binary)
+        rv = True
+
+    elif cargs.coverage_backend == 'llvm' and 'llvm_profile' in symbols:
+        if cargs.validate_args or cargs.gcov_check or cargs.gcov_check_bin:
+            print("[+] Binary '%s' is compiled with llvm source-based code coverage support." % binary)
+        rv = True
+
+    elif 'llvm_gcov' in symbols:
+        if cargs.validate_args or cargs.gcov_check or cargs.gcov_check_bin:
+            print("[+] Binary '%s' is compiled with code coverage support via llvm." % binary)
+        rv = True
 
     if not rv and cargs.gcov_check_bin:
         print("[*] Binary '%s' is not compiled with code coverage support." % binary)
@@ -895,6 +4329,9 @@ def check_requirements(cargs):
         lcov = which( cargs.lcov_path )
     if ( genhtml == None ):
         genhtml = which ( cargs.genhtml_path )
+    if ( cargs.coverage_backend == 'llvm' ):
+        ### llvm-profdata/llvm-cov replace lcov and gcov
+        return check_llvm_requirements(genhtml, cargs)
 
     if ( lcov == None or gcov == None):
         print("Required command not found :")
@@ -913,11 +4350,27 @@ def check_requirements(cargs):
 
     return False
 
-def is_gcov_enabled(cargs):
+def check_llvm_requirements(genhtml, cargs):
+    llvm_cov = which( cargs.llvm_cov_path )
+    llvm_profdata = which( cargs.llvm_profdata_path )
 
-    if not is_exe(cargs.readelf_path):
-        print("[*] Need a valid path to readelf, use --readelf-path")
-        return False
+    if ( llvm_cov != None and llvm_profdata != None ):
+        if (genhtml != None or cargs.disable_lcov_web):
+            return True
+
+    print("Required command not found :")
+    if ( llvm_cov == None ):
+        print("[*] llvm-cov command does not exist : %s" \
+                % (cargs.llvm_cov_path))
+    if ( llvm_profdata == None ):
+        print("[*] llvm-profdata command does not exist : %s" \
+                % (cargs.llvm_profdata_path))
+    if ( genhtml == None and not cargs.disable_lcov_web):
+        print("[*] genhtml command does not exist : %s" % (cargs.genhtml_path))
+
+    return False
+
+def is_gcov_enabled(cargs):
 
     if cargs.coverage_cmd:
         if 'AFL_FILE' not in cargs.coverage_cmd:
@@ -944,9 +4397,12 @@ def is_gcov_enabled(cargs):
             return False
 
         if not cargs.disable_gcov_check and not found_code_cov_binary:
+            flags = '-fprofile-arcs -ftest-coverage'
+            if cargs.coverage_backend == 'llvm':
+                flags = '-fprofile-instr-generate -fcoverage-mapping'
             print("[*] Could not find an executable binary with code " \
-                    "coverage support ('-fprofile-arcs -ftest-coverage') " \
-                    "in --coverage-cmd '%s'" % cargs.coverage_cmd)
+                    "coverage support ('%s') " \
+                    "in --coverage-cmd '%s'" % (flags, cargs.coverage_cmd))
             return False
 
     elif cargs.gcov_check_bin:
@@ -974,9 +4430,12 @@ def validate_cargs(cargs):
             return False
 
         ### make sure code coverage support is compiled in
-        if not gcno_files_exist(cargs):
+        if cargs.coverage_backend == 'gcov' and not gcno_files_exist(cargs):
             return False
 
+    elif cargs.coverage_backend == 'llvm':
+        ### llvm-cov reads the coverage mapping from the binary
+        pass
     else:
         if not cargs.func_search and not cargs.line_search:
             print("[*] Must set --code-dir unless using --func-search " \
@@ -1002,10 +4461,174 @@ def validate_cargs(cargs):
             % (cargs.afl_fuzzing_dir))
         return False
 
+    if is_interval_mode(cargs):
+        if cargs.cover_corpus or cargs.coverage_at_exit:
+            print("[*] --coverage-every/--coverage-every-seconds are " \
+                    "incompatible with --cover-corpus and --coverage-at-exit")
+            return False
+        if (cargs.coverage_every and cargs.coverage_every < 0) \
+                or (cargs.coverage_every_seconds \
+                    and cargs.coverage_every_seconds < 0):
+            print("[*] --coverage-every/--coverage-every-seconds must be positive")
+            return False
+
+    if cargs.pipeline:
+        if use_id_ranges(cargs):
+            print("[*] --pipeline requires coverage to be measured per " \
+                    "queue file")
+            return False
+        if cargs.pipeline_slots < 1:
+            print("[*] --pipeline-slots must be at least 1")
+            return False
+
+    if cargs.exec_timeout < 0 or cargs.exec_mem_limit < 0 \
+            or cargs.exec_cpu_limit < 0:
+        print("[*] --exec-timeout, --exec-mem-limit and --exec-cpu-limit " \
+                "must not be negative")
+        return False
+
+    if cargs.staging_dir and not is_dir(cargs.staging_dir):
+        print("[*] --staging-dir path does not exist")
+        return False
+
+    if cargs.minimize:
+        ### minimization works from the per test case coverage
+        cargs.exact_coverage = True
+
+    if cargs.minimize_dir and is_dir(cargs.minimize_dir) \
+            and os.listdir(cargs.minimize_dir):
+        ### leftovers from an earlier run would mix into the new corpus
+        print("[*] --minimize-dir %s is not empty" % cargs.minimize_dir)
+        return False
+
+    if cargs.coverage_backend == 'llvm':
+        if cargs.pipeline or cargs.cov_cache_dir or per_test_coverage(cargs) \
+                or cargs.minimize or cargs.showmap_cmd or cargs.targets:
+            print("[*] --coverage-backend llvm does not support --pipeline, " \
+                    "--cov-cache-dir, --exact-coverage, --sample-fraction, " \
+                    "--showmap-cmd or multiple targets")
+            return False
+        if not llvm_cov_binary(cargs):
+            print("[*] Could not find the binary for llvm-cov in " \
+                    "--coverage-cmd, use --llvm-cov-binary")
+            return False
+
+    if cargs.targets:
+        for tcargs in target_cargs(cargs)[1:]:
+            ### the first target is checked above
+            if not is_gcov_enabled(tcargs):
+                return False
+            if not is_dir(tcargs.code_dir):
+                print("[*] --code-dir path for target '%s' does not exist" \
+                        % tcargs.target_name)
+                return False
+            if not gcno_files_exist(tcargs):
+                return False
+        code_dirs = [os.path.abspath(d) for n, c, d in cargs.targets]
+        if len(set(code_dirs)) != len(code_dirs) and not cargs.staging_dir:
+            print("[*] Targets sharing a --code-dir need --staging-dir for " \
+                    "separate gcda counters")
+            return False
+        if use_id_ranges(cargs) or cargs.pipeline or cargs.cov_cache_dir \
+                or cargs.exact_coverage or cargs.minimize \
+                or cargs.sample_fraction or cargs.showmap_cmd:
+            print("[*] Multiple targets only support per queue file " \
+                    "coverage (no --pipeline, --cov-cache-dir, " \
+                    "--exact-coverage, --sample-fraction or --showmap-cmd)")
+            return False
+        if cargs.metrics_listen or cargs.gcda_novelty:
+            print("[*] --metrics-listen and --gcda-novelty are not " \
+                    "supported with multiple targets")
+            return False
+
+    if cargs.sample_fraction:
+        if cargs.sample_fraction < 0 or cargs.sample_fraction > 1:
+            print("[*] --sample-fraction must be between 0 and 1")
+            return False
+        if use_id_ranges(cargs) or cargs.cov_cache_dir or cargs.pipeline \
+                or cargs.showmap_cmd:
+            print("[*] --sample-fraction requires serial per queue file " \
+                    "coverage (no --cov-cache-dir, --pipeline or --showmap-cmd)")
+            return False
+
+    if cargs.exact_coverage and use_id_ranges(cargs):
+        print("[*] --exact-coverage requires coverage to be measured per " \
+                "queue file")
+        return False
+
+    if cargs.cov_cache_dir and use_id_ranges(cargs):
+        print("[*] --cov-cache-dir requires coverage to be measured per " \
+                "queue file")
+        return False
+
+    if cargs.dedup_index and not cargs.disable_coverage_init:
+        ### a test case seen in an earlier run is only covered by the gcda
+        ### counters that run left behind
+        print("[*] --dedup-index requires --disable-coverage-init")
+        return False
+
+    if cargs.schedule != 'id' and use_id_ranges(cargs):
+        ### an id range only describes the test cases in it when they are
+        ### processed in id order
+        print("[*] --schedule %s requires coverage to be measured per " \
+                "queue file" % cargs.schedule)
+        return False
+
     if cargs.disable_lcov_web and cargs.lcov_web_all:
         print("[*] --disable-lcov-web and --lcov-web-all are incompatible")
         return False
 
+    if cargs.showmap_cmd:
+        if use_id_ranges(cargs) or cargs.pipeline or cargs.exact_coverage:
+            print("[*] --showmap-cmd requires serial per queue file coverage " \
+                    "(no --pipeline or --exact-coverage)")
+            return False
+        if 'AFL_FILE' not in cargs.showmap_cmd:
+            print("[*] --showmap-cmd must contain the 'AFL_FILE' string")
+            return False
+        if cargs.showmap_verify < 1:
+            print("[*] --showmap-verify must be at least 1")
+            return False
+
+    if cargs.granularity == 'function' and cargs.coverage_include_lines:
+        print("[*] --coverage-include-lines requires --granularity line")
+        return False
+
+    if cargs.include_src and cargs.pipeline:
+        print("[*] --include-src cannot be used with --pipeline")
+        return False
+
+    if cargs.state_db:
+        if cargs.pipeline or cargs.cov_cache_dir or per_test_coverage(cargs) \
+                or cargs.coverage_backend != 'gcov' or cargs.targets:
+            print("[*] --state-db requires cumulative gcov coverage (no " \
+                    "--pipeline, --cov-cache-dir, --exact-coverage, " \
+                    "--sample-fraction or multiple targets)")
+            return False
+        if cargs.state_cache_files < 1:
+            print("[*] --state-cache-files must be at least 1")
+            return False
+
+    if cargs.gcda_novelty:
+        if use_id_ranges(cargs) or cargs.pipeline or per_test_coverage(cargs) \
+                or cargs.coverage_backend != 'gcov':
+            print("[*] --gcda-novelty requires serial per queue file gcov " \
+                    "coverage (no --pipeline, --cov-cache-dir, " \
+                    "--exact-coverage or --sample-fraction)")
+            return False
+        if cargs.gcda_novelty_verify < 1:
+            print("[*] --gcda-novelty-verify must be at least 1")
+            return False
+
+    if cargs.metrics_listen and not parse_metrics_listen(cargs.metrics_listen):
+        print("[*] --metrics-listen must be 'host:port', 'port' or " \
+                "'unix:/path'")
+        return False
+
+    if cargs.lcov_web_interval < 0:
+        print("[*] --lcov-web-interval must not be negative")
+        return False
+
     return True
 
 
@@ -1018,6 +4641,9 @@ def gcno_files_exist(cargs):
         for filename in files:
             if filename[-5:] == '.gcno':
                 found_code_coverage_support = True
+                break
+        if found_code_coverage_support:
+            break
     if not found_code_coverage_support:
         print("[*] Could not find any *.gcno files in --code-dir " \
                 "'%s', is code coverage ('-fprofile-arcs -ftest-coverage') " \
@@ -1058,16 +4684,23 @@ def mkdirs(cov_paths, cargs):
     if create_cov_dirs:
         for k in ['top_dir', 'web_dir', 'lcov_dir', 'diff_dir']:
             if not is_dir(cov_paths[k]):
-                os.mkdir(cov_paths[k])
+                os.makedirs(cov_paths[k])
 
         ### write coverage results in the following format
         cfile = open(cov_paths['id_delta_cov'], 'w')
-        if cargs.cover_corpus or cargs.coverage_at_exit:
+        if use_id_ranges(cargs):
             cfile.write("# id:[range]..., cycle, src_file, coverage_type, fcn/line\n")
         else:
             cfile.write("# id:NNNNNN*_file, cycle, src_file, coverage_type, fcn/line\n")
         cfile.close()
 
+        ### coverage growth over time, similar to the AFL plot_data file
+        cfile = open(cov_paths['plot_data'], 'w')
+        cfile.write("# unix_time, id, cycle, lines_covered, lines_total, " \
+                "functions_covered, functions_total, branches_covered, " \
+                "branches_total\n")
+        cfile.close()
+
     return
 
 def is_dir(dpath):
@@ -1139,15 +4772,17 @@ def check_core_pattern():
                 rv = False
     return rv
 
-def parse_cmdline():
+def parse_cmdline(args=None):
 
     p = argparse.ArgumentParser()
 
-    p.add_argument("-e", "--coverage-cmd", type=str,
-            help="Set command to exec (including args, and assumes code coverage support)")
+    p.add_argument("-e", "--coverage-cmd", type=str, action='append',
+            help="Set command to exec (including args, and assumes code coverage support). "
+                "Give NAME=CMD more than once together with NAME=DIR --code-dir args to "
+                "replay each test case against several coverage builds (results in cov/NAME/)")
     p.add_argument("-d", "--afl-fuzzing-dir", type=str,
             help="top level AFL fuzzing directory")
-    p.add_argument("-c", "--code-dir", type=str,
+    p.add_argument("-c", "--code-dir", type=str, action='append',
             help="Directory where the code lives (compiled with code coverage support)")
     p.add_argument("-f", "--follow", action='store_true',
             help="Follow links when searching .da files", default=False)
@@ -1159,12 +4794,24 @@ def parse_cmdline():
     p.add_argument("--disable-lcov-web", action='store_true',
             help="Disable generation of all lcov web code coverage reports",
             default=False)
+    p.add_argument("--include-src", type=str, action='append',
+            help="Only track source files matching this shell pattern (may be given "
+                "more than once), and only capture the objects that contain them",
+            default=None)
+    p.add_argument("--disable-gcno-index", action='store_true',
+            help="Build the initial zero coverage baseline with 'lcov --capture "
+                "--initial' instead of the cached .gcno index",
+            default=False)
     p.add_argument("--disable-coverage-init", action='store_true',
             help="Disable initialization of code coverage counters at afl-cov startup",
             default=False)
     p.add_argument("--coverage-include-lines", action='store_true',
             help="Include lines in zero-coverage status files",
             default=False)
+    p.add_argument("--granularity", type=str, choices=['line', 'function'],
+            help="Track coverage per line (default) or only per function, skipping "
+                "all lcov line (DA:) data",
+            default='line')
     p.add_argument("--enable-branch-coverage", action='store_true',
             help="Include branch coverage in code coverage reports (may be slow)",
             default=False)
@@ -1177,6 +4824,105 @@ def parse_cmdline():
     p.add_argument("--coverage-at-exit", action='store_true',
             help="Only calculate coverage just before afl-cov exit.",
             default=False)
+    p.add_argument("--coverage-every", type=int,
+            help="Measure coverage once every N test cases, attributing new coverage to the id range",
+            default=0)
+    p.add_argument("--coverage-every-seconds", type=int,
+            help="Measure coverage at most once every N seconds, attributing new coverage to the id range",
+            default=0)
+    p.add_argument("--pipeline", action='store_true',
+            help="Overlap test case execution, lcov capture, coverage extraction and "
+                "web reports in an asyncio pipeline (diffs are still applied in queue order)",
+            default=False)
+    p.add_argument("--pipeline-slots", type=int,
+            help="Number of test cases executed and captured concurrently in --pipeline "
+                "mode, each with its own GCOV_PREFIX gcda directory",
+            default=2)
+    p.add_argument("--coverage-backend", type=str, choices=['gcov', 'llvm'],
+            help="Coverage engine: 'gcov' (lcov over .gcda files) or 'llvm' (clang "
+                "-fprofile-instr-generate -fcoverage-mapping builds through llvm-profdata "
+                "and llvm-cov)",
+            default='gcov')
+    p.add_argument("--llvm-profdata-path", type=str,
+            help="Path to llvm-profdata command", default="llvm-profdata")
+    p.add_argument("--llvm-cov-path", type=str,
+            help="Path to llvm-cov command", default="llvm-cov")
+    p.add_argument("--llvm-cov-binary", type=str,
+            help="Instrumented binary passed to llvm-cov export (default: the first "
+                "executable in --coverage-cmd)",
+            default=None)
+    p.add_argument("--staging-dir", type=str,
+            help="Keep per test case lcov trace files and gcda counters (via GCOV_PREFIX) "
+                "in a temporary directory under this path, e.g. /dev/shm",
+            default=None)
+    p.add_argument("--sample-fraction", type=float,
+            help="Process a stratified sample of this fraction of each fuzzing dir first and "
+                "publish estimated coverage with 95%% confidence intervals, then refine "
+                "with samples twice as large until the whole queue is processed",
+            default=0)
+    p.add_argument("--schedule", type=str, choices=sorted(TEST_CASE_SCHEDULERS),
+            help="Order for processing new test cases: 'id' (queue order) or 'priority' "
+                "('+cov' test cases, seeds and deterministic stages, and shallow src: "
+                "chains first)",
+            default='id')
+    p.add_argument("--showmap-cmd", type=str,
+            help="Run each test case through this AFL instrumented command (with AFL_FILE) "
+                "under afl-showmap first, and only do the gcov exec and capture for test "
+                "cases with new edges",
+            default=None)
+    p.add_argument("--showmap-verify", type=int,
+            help="Replay and capture deferred --showmap-cmd test cases after N of them "
+                "(and at the end of each queue) to catch missed coverage",
+            default=100)
+    p.add_argument("--afl-showmap-path", type=str,
+            help="Path to afl-showmap command", default="afl-showmap")
+    p.add_argument("--state-db", type=str,
+            help="Keep the positive and zero coverage state in this sqlite database "
+                "(recreated at startup) instead of in memory, for very large code bases",
+            default=None)
+    p.add_argument("--state-cache-files", type=int,
+            help="Number of source files from --state-db to keep in memory",
+            default=256)
+    p.add_argument("--gcda-novelty", action='store_true',
+            help="Skip the lcov capture and coverage diff for test cases that did "
+                "not turn any gcda counter from zero to nonzero",
+            default=False)
+    p.add_argument("--gcda-novelty-verify", type=int,
+            help="Capture anyway after N test cases skipped by --gcda-novelty (and "
+                "at the end of each queue) to catch missed coverage",
+            default=100)
+    p.add_argument("--exec-timeout", type=int,
+            help="Kill --coverage-cmd after N seconds and continue with the next test case",
+            default=0)
+    p.add_argument("--exec-mem-limit", type=int,
+            help="Address space limit in MB for --coverage-cmd",
+            default=0)
+    p.add_argument("--exec-cpu-limit", type=int,
+            help="CPU time limit in seconds for --coverage-cmd",
+            default=0)
+    p.add_argument("--replay-crashes", action='store_true',
+            help="Also process the AFL crashes/ directory next to queue/",
+            default=False)
+    p.add_argument("--replay-hangs", action='store_true',
+            help="Also process the AFL hangs/ directory next to queue/",
+            default=False)
+    p.add_argument("--exact-coverage", action='store_true',
+            help="Reset gcda counters before each test case and store the full coverage of "
+                "every test case as a compressed bitset in cov/exact/",
+            default=False)
+    p.add_argument("--exact-search", action='store_true',
+            help="Make --func-search/--line-search report all test cases from cov/exact/",
+            default=False)
+    p.add_argument("--test-case-cov", type=str,
+            help="Print everything executed by a test case from cov/exact/",
+            default=None)
+    p.add_argument("--minimize", action='store_true',
+            help="Write a minimal set of test cases with the same function/line/branch coverage "
+                "to cov/min-corpus/ (implies --exact-coverage)",
+            default=False)
+    p.add_argument("--minimize-dir", type=str,
+            help="Empty directory for the --minimize corpus (default: cov/min-corpus)",
+            default=None)
     p.add_argument("--sleep", type=int,
             help="In --live mode, # of seconds to sleep between checking for new queue files",
             default=60)
@@ -1195,12 +4941,38 @@ def parse_cmdline():
     p.add_argument("--lcov-web-all", action='store_true',
             help="Generate lcov web reports for all id:NNNNNN* files instead of just the last one",
             default=False)
+    p.add_argument("--lcov-web-interval", type=int,
+            help="Regenerate the web report at most once every N seconds with --lcov-web-all, "
+                "or in --live mode when set",
+            default=0)
+    p.add_argument("--metrics-listen", type=str,
+            help="Serve Prometheus metrics on 'host:port', 'port' (localhost) or "
+                "'unix:/path/to/socket'",
+            default=None)
+    p.add_argument("--id-delta-bin", action='store_true',
+            help="Also write id-delta-cov as a binary columnar file (cov/id-delta-cov.bin) "
+                "that can be loaded with id_delta_bin_load()",
+            default=False)
     p.add_argument("--disable-lcov-exclude-pattern", action='store_true',
             help="Allow default /usr/include/* pattern to be included in lcov results",
             default=False)
     p.add_argument("--lcov-exclude-pattern", type=str,
             help="Set exclude pattern for lcov results",
             default="/usr/include/*")
+    p.add_argument("--disable-test-case-dedup", action='store_true',
+            help="Execute byte-identical test cases (e.g. AFL sync copies) every time they are seen",
+            default=False)
+    p.add_argument("--dedup-index", type=str,
+            help="Keep the test case content hash index in this file (outside of cov/) so "
+                "that later runs skip test cases that were already executed, requires "
+                "--disable-coverage-init",
+            default=None)
+    p.add_argument("--cov-cache-dir", type=str,
+            help="Cache the full coverage of each test case in this directory, keyed by "
+                "test case content and the instrumented build, so that reruns skip "
+                "test cases that were already measured (gcda counters are reset "
+                "before each test case)",
+            default=None)
     p.add_argument("--func-search", type=str,
             help="Search for coverage of a specific function")
     p.add_argument("--line-search", type=str,
@@ -1218,7 +4990,8 @@ def parse_cmdline():
     p.add_argument("--genhtml-path", type=str,
             help="Path to genhtml command", default="/usr/bin/genhtml")
     p.add_argument("--readelf-path", type=str,
-            help="Path to readelf command", default="/usr/bin/readelf")
+            help="Path to readelf command, only used for binaries that are not ELF files "
+                "afl-cov can read itself", default="/usr/bin/readelf")
     p.add_argument("--stop-afl", action='store_true',
             help="Stop all running afl-fuzz instances associated with --afl-fuzzing-dir <dir>",
             default=False)
@@ -1231,7 +5004,45 @@ def parse_cmdline():
     p.add_argument("-q", "--quiet", action='store_true',
             help="Quiet mode", default=False)
 
-    return p.parse_args()
+    cargs = p.parse_args(args)
+    parse_targets(p, cargs)
+
+    return cargs
+
+def parse_targets(p, cargs):
+
+    ### a single -e/-c is used as is, several are NAME=VALUE targets
+    cmds = cargs.coverage_cmd or []
+    dirs = cargs.code_dir or []
+
+    cargs.targets     = []
+    cargs.target_name = None
+
+    if len(cmds) <= 1 and len(dirs) <= 1:
+        cargs.coverage_cmd = cmds[0] if cmds else None
+        cargs.code_dir     = dirs[0] if dirs else None
+        return
+
+    named = {}
+    for opt, vals in [('-e/--coverage-cmd', cmds), ('-c/--code-dir', dirs)]:
+        for val in vals:
+            m = re.match(r'^([\w.-]+)=(.+)$', val, re.S)
+            if not m:
+                p.error("multiple targets need NAME=VALUE %s args: '%s'" \
+                        % (opt, val))
+            named.setdefault(m.group(1), {})[opt] = m.group(2)
+
+    for name in named:
+        if len(named[name]) != 2:
+            p.error("target '%s' needs both -e/--coverage-cmd and " \
+                    "-c/--code-dir" % name)
+        cargs.targets.append((name, named[name]['-e/--coverage-cmd'],
+                named[name]['-c/--code-dir']))
+
+    ### the first target stands in wherever a single target is expected
+    cargs.coverage_cmd = cargs.targets[0][1]
+    cargs.code_dir     = cargs.targets[0][2]
+    return
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,49 @@
+# afl-cov3 importable module
+
+#
+#  File: aflcov3.py
+#
+#  Purpose: Load afl-cov3.py as a Python module so that coverage tracking can
+#           be driven in-process through the CoverageTracker class instead of
+#           spawning afl-cov3.py and parsing its output files:
+#
+#               from aflcov3 import CoverageTracker
+#
+#  Copyright (C) 2024-2025 XtremeBlaze777
+#
+#  License (GNU General Public License version 2 or any later version):
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02111-1301,
+#  USA
+#
+
+import importlib.util
+import os
+import sys
+
+### afl-cov3.py is not importable by name because of the '-'
+_spec = importlib.util.spec_from_file_location('afl_cov3',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'afl-cov3.py'))
+_afl_cov3 = importlib.util.module_from_spec(_spec)
+sys.modules['afl_cov3'] = _afl_cov3
+_spec.loader.exec_module(_afl_cov3)
+
+CoverageTracker   = _afl_cov3.CoverageTracker
+TRACKER_OPTIONS   = _afl_cov3.TRACKER_OPTIONS
+id_delta_bin_load = _afl_cov3.id_delta_bin_load
+id_delta_bin_rows = _afl_cov3.id_delta_bin_rows
+__version__       = _afl_cov3.__version__
+
+__all__ = ['CoverageTracker', 'TRACKER_OPTIONS', 'id_delta_bin_load', 'id_delta_bin_rows']
@@ -0,0 +1,1120 @@
+#!/usr/bin/env python3
+#
+#  File: test-afl-cov3.py
+#
+#  Purpose: Unit tests for the afl-cov3.py helpers that do not need an AFL
+#           fuzzing run or the fwknop test cases.
+#
+#  License (GNU General Public License):
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02111-1301,
+#  USA
+#
+
+import json
+import mmap
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        '..'))
+import aflcov3
+from afl_cov3 import *
+
+def gcc_major():
+    if not which('gcc'):
+        return 0
+    return int(subprocess.check_output(['gcc', '-dumpversion'],
+            universal_newlines=True).split('.')[0])
+
+SAMPLE_C = """static int add(int a, int b)
+{
+    return a + b;
+}
+
+int main(int argc, char **argv)
+{
+    if (argc > 1)
+        return add(argc, 2);
+    return 0;
+}
+"""
+
+### (trace, afl test case) pairs for the coverage diff tests, each trace is
+### cumulative like the gcda counters
+TRACES = [
+    ("SF:/src/a.c\nFN:1,main\nFNDA:1,main\nFN:9,unused\nFNDA:0,unused\n"
+     "DA:1,1\nDA:2,1\nDA:3,0\nDA:9,0\nBRDA:2,0,0,1\nBRDA:2,0,1,-\n"
+     "end_of_record\nSF:/src/b.c\nFN:4,helper\nFNDA:0,helper\nDA:4,0\n"
+     "DA:5,0\nBRDA:4,0,0,-\nBRDA:4,0,1,-\nend_of_record\n",
+     'id:000000,orig:a'),
+    ("SF:/src/a.c\nFN:1,main\nFNDA:2,main\nFN:9,unused\nFNDA:0,unused\n"
+     "DA:1,2\nDA:2,2\nDA:3,1\nDA:9,0\nBRDA:2,0,0,1\nBRDA:2,0,1,1\n"
+     "end_of_record\nSF:/src/b.c\nFN:4,helper\nFNDA:0,helper\nDA:4,0\n"
+     "DA:5,0\nBRDA:4,0,0,-\nBRDA:4,0,1,-\nend_of_record\n",
+     'id:000001,src:000000'),
+    ("SF:/src/a.c\nFN:1,main\nFNDA:3,main\nFN:9,unused\nFNDA:0,unused\n"
+     "DA:1,3\nDA:2,3\nDA:3,1\nDA:9,0\nBRDA:2,0,0,2\nBRDA:2,0,1,1\n"
+     "end_of_record\nSF:/src/b.c\nFN:4,helper\nFNDA:1,helper\nDA:4,1\n"
+     "DA:5,1\nBRDA:4,0,0,-\nBRDA:4,0,1,1\nend_of_record\nSF:/src/c.h\n"
+     "DA:7,1\nend_of_record\n",
+     'id:000002,src:000001'),
+]
+
+def make_elf(elf_class, data_enc, strtab, other=b''):
+
+    ### ELF header, a linked string table with the symbol names, another
+    ### section and the section headers: null, .symtab, .strtab, other
+    end     = '<' if data_enc == 1 else '>'
+    ehsize  = 64 if elf_class == 2 else 52
+    shsize  = 64 if elf_class == 2 else 40
+    str_off = ehsize
+    oth_off = str_off + len(strtab)
+    shoff   = oth_off + len(other)
+
+    ident = b'\x7fELF' + bytes([elf_class, data_enc, 1]) + b'\0' * 9
+    if elf_class == 2:
+        hdr = struct.pack(end + 'HHIQQQIHHHHHH', 2, 62, 1, 0, 0, shoff, 0,
+                ehsize, 0, 0, shsize, 4, 0)
+    else:
+        hdr = struct.pack(end + 'HHIIIIIHHHHHH', 2, 3, 1, 0, 0, shoff, 0,
+                ehsize, 0, 0, shsize, 4, 0)
+
+    shdr = end + ELF_SHDR[elf_class]
+    sections = [struct.pack(shdr, *([0] * 10)),
+            struct.pack(shdr, 0, ELF_SHT_SYMTAB, 0, 0, 0, 0, 2, 0, 0, 0),
+            struct.pack(shdr, 0, 3, 0, 0, str_off, len(strtab), 0, 0, 0, 0),
+            struct.pack(shdr, 0, 1, 0, 0, oth_off, len(other), 0, 0, 0, 0)]
+
+    return ident + hdr + strtab + other + b''.join(sections)
+
+### stand-ins for lcov, genhtml and an instrumented target so that whole
+### afl-cov runs can be tested without a gcc build. The target counts every
+### input byte b as a hit on /src/f<b % 3>.c line b % 20, function fn<b % 5>
+### and branch <b % 20>,0,<b % 2>, and logs each input path to exec.log.
+### Like real gcda files, its .gcda file has a fixed size: one 64-bit counter
+### for each 'src_file kind val' line of the universe file
+FAKE_LCOV = r"""#!/usr/bin/env python3
+import os, sys
+from array import array
+args = sys.argv[1:]
+with open(os.path.join(os.path.dirname(__file__), 'universe')) as f:
+    keys = [tuple(l.split()) for l in f]
+def opt(name):
+    return [args[i + 1] for i, a in enumerate(args) if a == name]
+def read(path, cov):
+    counters = array('Q')
+    with open(path, 'rb') as f:
+        counters.frombytes(f.read())
+    for k, count in zip(keys, counters):
+        cov[k] += count
+    return cov
+def write(cov, path):
+    with open(path, 'w') as f:
+        for src in sorted(set(k[0] for k in cov)):
+            f.write('SF:%s\n' % src)
+            for (s, kind, val), count in sorted(cov.items()):
+                if s != src:
+                    continue
+                if kind == 'fn':
+                    f.write('FN:1,%s\nFNDA:%d,%s\n' % (val, count, val))
+                elif kind == 'da':
+                    f.write('DA:%s,%d\n' % (val, count))
+                else:
+                    f.write('BRDA:%s,%s\n' % (val, count or '-'))
+            f.write('end_of_record\n')
+def trace(path):
+    cov = {}
+    for l in open(path):
+        l = l.strip()
+        if l.startswith('SF:'):
+            src = l[3:]
+        elif l.startswith('FNDA:'):
+            count, val = l[5:].split(',')
+            cov[(src, 'fn', val)] = int(count)
+        elif l.startswith('DA:'):
+            val, count = l[3:].split(',')
+            cov[(src, 'da', val)] = int(count)
+        elif l.startswith('BRDA:'):
+            p = l[5:].split(',')
+            cov[(src, 'br', ','.join(p[:3]))] = 0 if p[3] == '-' else int(p[3])
+    return cov
+gcda_dir = (opt('--directory') or [''])[0]
+if '--zerocounters' in args:
+    for root, dirs, files in os.walk(gcda_dir):
+        for name in files:
+            if name.endswith('.gcda'):
+                os.unlink(os.path.join(root, name))
+elif '--capture' in args:
+    cov = dict((k, 0) for k in keys)
+    gcda_files = [os.path.join(root, name)
+            for root, dirs, files in os.walk(gcda_dir)
+            for name in files if name.endswith('.gcda')]
+    if '--initial' not in args:
+        if not gcda_files:
+            sys.exit('lcov: ERROR: no .gcda files found in %s!' % gcda_dir)
+        for path in gcda_files:
+            read(path, cov)
+    write(cov, opt('--output-file')[0])
+elif '-a' in args:
+    cov = {}
+    for path in opt('-a'):
+        if not os.path.exists(path):
+            sys.exit('lcov: ERROR: cannot read file %s!' % path)
+        for k, count in trace(path).items():
+            cov[k] = cov.get(k, 0) + count
+    write(cov, opt('--output-file')[0])
+elif '-r' in args:
+    write(trace(opt('-r')[0]), opt('--output-file')[0])
+print('Summary coverage rate:')
+"""
+
+FAKE_GENHTML = """#!/bin/sh
+while [ $# -gt 0 ]; do
+    [ "$1" = "--output-directory" ] && mkdir -p "$2" && touch "$2/index.html"
+    shift
+done
+"""
+
+FAKE_TARGET = r"""#!/usr/bin/env python3
+import os, signal, sys, time
+from array import array
+data = open(sys.argv[1], 'rb').read()
+with open(os.path.join(os.path.dirname(__file__), 'exec.log'), 'a') as f:
+    f.write(sys.argv[1] + '\n')
+if data.startswith(b'sleep'):
+    time.sleep(30)
+if data.startswith(b'crash'):
+    ### killed before the gcda file is written
+    os.kill(os.getpid(), signal.SIGSEGV)
+with open(os.path.join(os.path.dirname(__file__), 'universe')) as f:
+    keys = dict((tuple(l.split()), i) for i, l in enumerate(f))
+gcda = os.environ.get('GCOV_PREFIX', '') + sys.argv[2] + '/target.gcda'
+os.makedirs(os.path.dirname(gcda), exist_ok=True)
+counters = array('Q', [0] * len(keys))
+if os.path.exists(gcda):
+    with open(gcda, 'rb') as f:
+        counters = array('Q', f.read())
+for b in data:
+    src = '/src/f%d.c' % (b % 3)
+    for k in [(src, 'da', str(b % 20)), (src, 'fn', 'fn%d' % (b % 5)),
+            (src, 'br', '%d,0,%d' % (b % 20, b % 2))]:
+        counters[keys[k]] += 1
+with open(gcda, 'wb') as f:
+    f.write(counters.tobytes())
+"""
+
+### afl-showmap with coarser edges than the gcov lines of FAKE_TARGET (every
+### input byte b is edge b % 7), which logs the -o paths it writes
+FAKE_SHOWMAP = r"""#!/usr/bin/env python3
+import os, sys
+out = sys.argv[sys.argv.index('-o') + 1]
+with open(os.path.join(os.path.dirname(__file__), 'showmap.log'), 'a') as f:
+    f.write(out + '\n')
+with open(out, 'w') as f:
+    for b in sorted(set(open(sys.argv[-1], 'rb').read())):
+        f.write('%06d:1\n' % (b % 7))
+"""
+
+def fake_tools(tools_dir):
+
+    ### write the fake lcov, genhtml, target and afl-showmap to tools_dir
+    ### along with the zero coverage universe of the target
+    os.makedirs(tools_dir)
+    tools = {}
+    for name, script in [('lcov', FAKE_LCOV), ('genhtml', FAKE_GENHTML),
+            ('target', FAKE_TARGET), ('afl-showmap', FAKE_SHOWMAP)]:
+        tools[name] = os.path.join(tools_dir, name)
+        with open(tools[name], 'w') as f:
+            f.write(script)
+        os.chmod(tools[name], 0o755)
+
+    with open(os.path.join(tools_dir, 'universe'), 'w') as f:
+        for i in range(3):
+            for l in range(20):
+                f.write('/src/f%d.c da %d\n' % (i, l))
+                f.write('/src/f%d.c br %d,0,0\n' % (i, l))
+                f.write('/src/f%d.c br %d,0,1\n' % (i, l))
+            for fn in range(5):
+                f.write('/src/f%d.c fn fn%d\n' % (i, fn))
+    return tools
+
+class TestAflCov3(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cargs   = parse_cmdline(['--afl-fuzzing-dir', self.tmp_dir.name,
+                '--enable-branch-coverage', '--quiet'])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    ### segments are [line, col, count, has_count, is_region_entry,
+    ### is_gap_region] as written by llvm-cov export
+
+    def test_llvm_line_counts(self):
+        ### a function with an if body that is never executed
+        segments = [[3, 12, 1, True, True, False],
+                [5, 7, 0, True, True, False],
+                [6, 4, 1, True, False, False],
+                [8, 2, 0, False, False, False]]
+        self.assertEqual(llvm_line_counts(segments),
+                [(3, 1), (4, 1), (5, 1), (6, 0), (7, 1), (8, 1)])
+
+    def test_llvm_line_counts_skipped(self):
+        ### code removed by the preprocessor is not mapped
+        segments = [[10, 1, 0, False, True, False],
+                [12, 1, 0, False, False, False]]
+        self.assertEqual(llvm_line_counts(segments), [])
+
+    def test_llvm_line_counts_gap(self):
+        ### gap regions do not start a new count on their line
+        segments = [[20, 5, 2, True, True, False],
+                [21, 3, 0, True, True, True],
+                [22, 1, 2, True, True, False],
+                [23, 1, 0, False, False, False]]
+        self.assertEqual(llvm_line_counts(segments),
+                [(20, 2), (21, 2), (22, 2), (23, 2)])
+
+    def test_llvm_extract_coverage(self):
+        export = {'type': 'llvm.coverage.json.export', 'version': '2.0.1',
+                'data': [{
+                    'files': [{'filename': '/src/main.c',
+                        'segments': [[3, 12, 1, True, True, False],
+                            [5, 7, 0, True, True, False],
+                            [6, 4, 1, True, False, False],
+                            [8, 2, 0, False, False, False]],
+                        'branches': [[4, 9, 4, 10, 0, 1, 0, 0, 4]]}],
+                    'functions': [{'name': 'main', 'count': 1,
+                            'filenames': ['/src/main.c']},
+                        {'name': 'unused', 'count': 0,
+                            'filenames': ['/src/main.c']}]}]}
+        json_file = os.path.join(self.tmp_dir.name, 'export.json')
+        with open(json_file, 'w') as f:
+            json.dump(export, f)
+
+        branch_map = {}
+        new_cov = llvm_extract_coverage(json_file, self.cargs, branch_map)
+        pos  = new_cov['pos']['/src/main.c']
+        zero = new_cov['zero']['/src/main.c']
+
+        self.assertEqual(sorted(pos['line'], key=int),
+                ['3', '4', '5', '7', '8'])
+        self.assertEqual(sorted(zero['line']), ['6'])
+        self.assertEqual(sorted(pos['function']), ['main()'])
+        self.assertEqual(sorted(zero['function']), ['unused()'])
+        self.assertEqual(branch_keys(branch_map, '/src/main.c',
+                pos['branch']), ['4,9,1'])
+        self.assertEqual(branch_keys(branch_map, '/src/main.c',
+                zero['branch']), ['4,9,0'])
+
+    def test_exact_inputs_hitting(self):
+        cov_paths = {'exact_dir': os.path.join(self.tmp_dir.name, 'exact'),
+                'log_file': os.path.join(self.tmp_dir.name, 'afl-cov.log')}
+        cov = {'branch_map': {}}
+        exact_store_init(cov_paths)
+        for i, lines in enumerate([['1', '2'], ['2'], [], ['2', '3']]):
+            exact_store_add('id:%06d' % i, {'pos': {'/src/a.c':
+                    {'function': {}, 'branch': 0,
+                    'line': dict((l, '') for l in lines)}}},
+                    cov_paths, cov)
+
+        expected = {'/src/a.c, line, 1': ['id:000000'],
+                '/src/a.c, line, 2': ['id:000000', 'id:000001', 'id:000003'],
+                '/src/a.c, line, 3': ['id:000003'],
+                '/src/a.c, line, 4': []}
+
+        ### row scan, then the columns written at the end of the run
+        store = exact_store_load(cov_paths['exact_dir'])
+        self.assertIsNone(store['columns'])
+        for key in expected:
+            self.assertEqual(exact_inputs_hitting(store, key), expected[key])
+
+        exact_store_columns(cov_paths, self.cargs)
+        store = exact_store_load(cov_paths['exact_dir'])
+        self.assertIsInstance(store['columns'], mmap.mmap)
+        for key in expected:
+            self.assertEqual(exact_inputs_hitting(store, key), expected[key])
+
+    @unittest.skipUnless(gcc_major() >= 12, "needs gcc 12 or later")
+    def test_parse_gcno(self):
+        src = os.path.join(self.tmp_dir.name, 'sample.c')
+        with open(src, 'w') as f:
+            f.write(SAMPLE_C)
+        subprocess.check_call(['gcc', '--coverage', '-O0', '-c', 'sample.c',
+                '-o', 'sample.o'], cwd=self.tmp_dir.name)
+
+        ### what gcov reports for the same object without any counters
+        out = subprocess.check_output(['gcov', '--json-format', '--stdout',
+                'sample.c'], cwd=self.tmp_dir.name, stderr=subprocess.DEVNULL)
+        expected = {}
+        for finfo in json.loads(out)['files']:
+            expected[os.path.join(self.tmp_dir.name, finfo['file'])] = {
+                    'lines': sorted(set(l['line_number']
+                        for l in finfo['lines'])),
+                    'functions': dict((fn['name'], fn['start_line'])
+                        for fn in finfo['functions'])}
+
+        gcno = os.path.join(self.tmp_dir.name, 'sample.gcno')
+        self.assertEqual(parse_gcno(gcno), expected)
+        self.assertEqual(expected[src]['functions'], {'add': 1, 'main': 6})
+
+        ### the word counted records of gcc 11 and older are left to lcov
+        with open(gcno, 'rb') as f:
+            data = bytearray(f.read())
+        data[4:8] = struct.pack('<I', struct.unpack('>I', b'B11*')[0])
+        with open(gcno, 'wb') as f:
+            f.write(data)
+        self.assertIsNone(parse_gcno(gcno))
+
+    @unittest.skipUnless(gcc_major() >= 12, "needs gcc 12 or later")
+    def test_gcno_index_excl(self):
+        src = os.path.join(self.tmp_dir.name, 'sample.c')
+        lines = SAMPLE_C.split('\n')
+        lines[0] += ' /* LCOV_EXCL_START */'
+        lines[3] += ' /* LCOV_EXCL_STOP */'
+        lines[9] += ' /* LCOV_EXCL_LINE */'
+        with open(src, 'w') as f:
+            f.write('\n'.join(lines))
+        subprocess.check_call(['gcc', '--coverage', '-O0', '-c', 'sample.c',
+                '-o', 'sample.o'], cwd=self.tmp_dir.name)
+        all_lines = parse_gcno(os.path.join(self.tmp_dir.name,
+                'sample.gcno'))[src]['lines']
+        self.assertEqual(lcov_excl_lines(src), set([1, 2, 3, 4, 10]))
+
+        self.cargs.code_dir = self.tmp_dir.name
+        cov_paths = {'gcno_index': None, 'gcno_files': None,
+                'lcov_base': os.path.join(self.tmp_dir.name, 'base'),
+                'log_file': os.path.join(self.tmp_dir.name, 'log')}
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.tmp_dir.name, 'cache')
+        self.addCleanup(os.environ.pop, 'XDG_CACHE_HOME')
+        self.assertTrue(gcno_index_base(cov_paths, self.cargs))
+
+        ### the same records lcov --initial writes for the marked source
+        with open(cov_paths['lcov_base']) as f:
+            base = f.read().split('\n')
+        self.assertEqual([l for l in base if l.startswith('FN:')],
+                ['FN:6,main'])
+        self.assertEqual([int(l[3:-2]) for l in base if l.startswith('DA:')],
+                [l for l in all_lines if l not in (1, 2, 3, 4, 10)])
+
+    @unittest.skipUnless(gcc_major() >= 12, "needs gcc 12 or later")
+    def test_include_src_capture_scope(self):
+        code_dir = os.path.join(self.tmp_dir.name, 'code')
+        os.makedirs(code_dir)
+        for name, src in [('a', SAMPLE_C), ('b', 'int helper(void)\n' \
+                '{\n    return 1;\n}\n')]:
+            with open(os.path.join(code_dir, name + '.c'), 'w') as f:
+                f.write(src)
+            subprocess.check_call(['gcc', '--coverage', '-O0', '-c',
+                    name + '.c', '-o', name + '.o'], cwd=code_dir)
+
+        ### lcov only sees links to the objects with an included source
+        self.cargs.code_dir    = code_dir
+        self.cargs.include_src = ['*/a.c']
+        cov_paths = {'gcno_index': None, 'gcno_files': None,
+                'staging_dir': '', 'gcda_prefix': '',
+                'lcov_dir': os.path.join(self.tmp_dir.name, 'lcov'),
+                'log_file': os.path.join(self.tmp_dir.name, 'log')}
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.tmp_dir.name, 'cache')
+        self.addCleanup(os.environ.pop, 'XDG_CACHE_HOME')
+        init_capture_scope(cov_paths, self.cargs)
+
+        self.assertTrue(cov_paths['capture_scope'])
+        links = {}
+        for root, dirs, files in os.walk(os.path.join(cov_paths['lcov_dir'],
+                'capture')):
+            for name in files:
+                links[name] = os.readlink(os.path.join(root, name))
+        self.assertEqual(links, {'a.gcno': os.path.join(code_dir, 'a.gcno'),
+                'a.gcda': os.path.join(code_dir, 'a.gcda')})
+        self.assertEqual(cov_paths['gcda_dir'], os.path.join(
+                cov_paths['lcov_dir'], 'capture') + code_dir)
+
+    def test_elf_coverage_symbols(self):
+        strtabs = [(b'\0main\0__gcov_init\0__gcov_exit\0', ['gcov']),
+                (b'\0main\0__llvm_profile_runtime\0', ['llvm_profile']),
+                (b'\0main\0__llvm_gcov_init\0__llvm_profile_write\0',
+                    ['llvm_gcov', 'llvm_profile']),
+                (b'\0main\0', [])]
+        binary = os.path.join(self.tmp_dir.name, 'prog')
+        for elf_class in [1, 2]:
+            for data_enc in [1, 2]:
+                for strtab, expected in strtabs:
+                    ### symbol names outside of the linked string table
+                    ### do not count
+                    with open(binary, 'wb') as f:
+                        f.write(make_elf(elf_class, data_enc, strtab,
+                                b'\0__gcov_merge_add\0'))
+                    self.assertEqual(elf_coverage_symbols(binary), expected,
+                            "class %d, encoding %d" % (elf_class, data_enc))
+
+        with open(binary, 'wb') as f:
+            f.write(b'#!/bin/sh\nexit 0\n')
+        self.assertIsNone(elf_coverage_symbols(binary))
+
+    def test_bin_coverage_symbols_cache(self):
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.tmp_dir.name, 'cache')
+        self.addCleanup(os.environ.pop, 'XDG_CACHE_HOME')
+        cache_file = afl_cov_cache_file('gcov-check')
+        self.cargs.readelf_path = os.path.join(self.tmp_dir.name, 'readelf')
+
+        binaries = [os.path.join(self.tmp_dir.name, b) for b in ['a', 'b']]
+        for binary in binaries:
+            with open(binary, 'wb') as f:
+                f.write(make_elf(2, 1, b'\0main\0__gcov_init\0'))
+            os.chmod(binary, 0o755)
+            self.assertEqual(bin_coverage_symbols(binary, self.cargs),
+                    ['gcov'])
+
+        ### a rebuilt binary replaces its entry, a deleted one is dropped
+        with open(binaries[0], 'wb') as f:
+            f.write(make_elf(2, 1, b'\0main\0'))
+        self.assertEqual(bin_coverage_symbols(binaries[0], self.cargs), [])
+        self.assertEqual(bin_coverage_symbols(binaries[0], self.cargs), [])
+        with open(cache_file) as f:
+            self.assertEqual([l.rstrip('\n').split(', ')[1:] for l in f],
+                    [['gcov', binaries[1]], ['', binaries[0]]])
+        os.unlink(binaries[1])
+        with open(binaries[0], 'wb') as f:
+            f.write(make_elf(1, 1, b'\0main\0__gcov_init\0'))
+        self.assertEqual(bin_coverage_symbols(binaries[0], self.cargs),
+                ['gcov'])
+        with open(cache_file) as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+        ### readelf is only needed for binaries we cannot read ourselves
+        self.cargs.coverage_cmd = binaries[0] + ' AFL_FILE'
+        self.assertTrue(is_gcov_enabled(self.cargs))
+
+    @unittest.skipUnless(which('gcc'), "needs gcc")
+    def test_elf_coverage_symbols_gcc(self):
+        with open(os.path.join(self.tmp_dir.name, 'sample.c'), 'w') as f:
+            f.write(SAMPLE_C)
+        for opts, expected in [(['--coverage'], ['gcov']), ([], [])]:
+            subprocess.check_call(['gcc'] + opts + ['sample.c', '-o',
+                    'sample'], cwd=self.tmp_dir.name)
+            self.assertEqual(elf_coverage_symbols(os.path.join(
+                    self.tmp_dir.name, 'sample')), expected)
+
+    def test_id_delta_bin_round_trip(self):
+        cov_paths = {'id_delta_bin': os.path.join(self.tmp_dir.name,
+                'id-delta-cov.bin')}
+        id_delta_bin_init(cov_paths)
+        rows = [('id:000000,orig:a', 0, '/src/a.c', 'function', 'main()'),
+                ('id:000000,orig:a', 0, '/src/a.c', 'line', '12'),
+                ('id:000001,src:000000', 1, '/src/b.c', 'branch', '7,0,1'),
+                ('id:000001,src:000000', 1, '/src/b.c', 'line', '7'),
+                ('id:000002,sync:f2,src:000001', 1, '', 'duplicate',
+                    '/out/f2/queue/id:000001,src:000000'),
+                ('id:000003,src:000001', 2, '/src/\u00e9t\u00e9.c',
+                    'function', 'f()')]
+        for row in rows:
+            id_delta_bin_add(*row, cov_paths)
+        id_delta_bin_write(cov_paths)
+
+        data = id_delta_bin_load(cov_paths['id_delta_bin'])
+        self.assertEqual(data['rows'], len(rows))
+        self.assertEqual(list(id_delta_bin_rows(data)), rows)
+        self.assertEqual(list(aflcov3.id_delta_bin_rows(
+                aflcov3.id_delta_bin_load(cov_paths['id_delta_bin']))), rows)
+
+        with open(cov_paths['id_delta_bin'], 'r+b') as f:
+            f.write(b'NOTAFILE')
+        with self.assertRaises(ValueError):
+            id_delta_bin_load(cov_paths['id_delta_bin'])
+
+    def test_schedule_by_priority(self):
+        fuzz_dir = os.path.join(self.tmp_dir.name, 'fuzz')
+        afl_files = []
+        for qdir, name in [('queue', 'id:000000,orig:a'),
+                ('queue', 'id:000001,src:000000,op:havoc'),
+                ('queue', 'id:000002,src:000001,op:havoc'),
+                ('queue', 'id:000003,src:000000,op:flip1,+cov'),
+                ('crashes', 'id:000000,src:000002,op:havoc'),
+                ('crashes', 'id:000003,src:000000,op:havoc')]:
+            os.makedirs(os.path.join(fuzz_dir, qdir), exist_ok=True)
+            afl_files.append(os.path.join(fuzz_dir, qdir, name))
+            open(afl_files[-1], 'w').close()
+
+        ### crash src: ids point into the queue, so the crash from queue
+        ### id 2 (depth 2) is three steps deep and the one from id 0 is one
+        self.assertEqual([os.path.relpath(f, fuzz_dir) for f in
+                schedule_by_priority(afl_files, self.cargs)],
+                ['queue/id:000003,src:000000,op:flip1,+cov',
+                'queue/id:000000,orig:a',
+                'queue/id:000001,src:000000,op:havoc',
+                'crashes/id:000003,src:000000,op:havoc',
+                'queue/id:000002,src:000001,op:havoc',
+                'crashes/id:000000,src:000002,op:havoc'])
+
+    def test_run_cmd_session(self):
+        ### only a --coverage-cmd with a timeout leaves our process group
+        cmd = "%s -c 'import os; print(os.getsid(0))'" % sys.executable
+        for timeout, same_session in [(0, True), (5, False)]:
+            self.cargs.exec_timeout = timeout
+            es, out = run_cmd(cmd, None, self.cargs, WANT_OUTPUT,
+                    exec_limits=True)
+            self.assertEqual(es, 0)
+            self.assertEqual(int(out[0]) == os.getsid(0), same_session)
+
+        self.cargs.exec_timeout = 1
+        es, out = run_cmd('sleep 10', os.path.join(self.tmp_dir.name,
+                'afl-cov.log'), self.cargs, NO_OUTPUT, exec_limits=True)
+        self.assertEqual(es, EXEC_TIMEOUT)
+
+    def run_traces(self, cov):
+
+        ### coverage_diff() over TRACES, returns the deltas and the final
+        ### positive and zero coverage as plain dictionaries
+        cov_paths = {'id_file': '', 'id_delta_cols': None,
+                'lcov_info_final': os.path.join(self.tmp_dir.name, 'trace'),
+                'log_file': os.path.join(self.tmp_dir.name, 'afl-cov.log'),
+                'diff': os.path.join(self.tmp_dir.name, 'diff'),
+                'id_delta_cov': os.path.join(self.tmp_dir.name, 'id-delta'),
+                'plot_data': os.path.join(self.tmp_dir.name, 'plot_data')}
+        deltas = []
+        for trace, afl_file in TRACES:
+            with open(cov_paths['lcov_info_final'], 'w') as f:
+                f.write(trace)
+            deltas.append(coverage_diff(0, self.tmp_dir.name, cov_paths,
+                    afl_file, cov, self.cargs))
+            cov_paths['id_file'] = afl_file
+
+        state = {}
+        for k in ['pos', 'zero']:
+            state[k] = dict((f, dict(cov[k][f])) for f in cov[k])
+        return deltas, state, dict(cov['totals']), dict(cov['universe'])
+
+    def test_state_store_parity(self):
+        expected = self.run_traces(new_cov_state())
+        self.assertEqual(expected[0][1], {'/src/a.c': {'line': ['3'],
+                'branch': ['2,0,1']}})
+
+        ### a working set of one entry evicts on every access
+        for cache_files in [1, 256]:
+            self.cargs.state_db = os.path.join(self.tmp_dir.name, 'state.db')
+            self.cargs.state_cache_files = cache_files
+            cov = new_cov_state()
+            open_state_db(cov, self.cargs)
+            self.assertEqual(self.run_traces(cov), expected)
+
+            ### the branch index is kept in the database as well
+            self.assertIsInstance(cov['branch_map'], BranchMapStore)
+            self.assertLessEqual(len(cov['branch_map'].cache), cache_files)
+            cov['branch_map'].evict(0)
+            self.assertEqual(cov['pos'].db.execute("SELECT file, keys " \
+                    "FROM branch_map ORDER BY file").fetchall(),
+                    [('/src/a.c', '2,0,0\n2,0,1'),
+                    ('/src/b.c', '4,0,0\n4,0,1')])
+            close_state_db(cov)
+
+class TestAflCov3Runs(unittest.TestCase):
+
+    ### whole afl-cov runs against the fake lcov, genhtml and target
+
+    def setUp(self):
+        self.tmp_dir  = tempfile.TemporaryDirectory()
+        self.tools    = fake_tools(os.path.join(self.tmp_dir.name, 'tools'))
+        self.code_dir = os.path.join(self.tmp_dir.name, 'code')
+        self.fuzz_dir = os.path.join(self.tmp_dir.name, 'fuzz')
+        os.makedirs(self.code_dir)
+        open(os.path.join(self.code_dir, 'target.gcno'), 'w').close()
+        self.coverage_cmd = "%s AFL_FILE %s" % (self.tools['target'],
+                self.code_dir)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def add_queue(self, test_cases, qdir='queue'):
+        ### test_cases are (AFL file name, content) pairs
+        path = os.path.join(self.fuzz_dir, qdir)
+        os.makedirs(path, exist_ok=True)
+        for name, data in test_cases:
+            with open(os.path.join(path, name), 'wb') as f:
+                f.write(data)
+        return path
+
+    def afl_cov(self, *args):
+        afl_cov3 = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                '..', 'afl-cov3.py')
+        subprocess.check_call([sys.executable, afl_cov3,
+                '--afl-fuzzing-dir', self.fuzz_dir,
+                '--coverage-cmd', self.coverage_cmd,
+                '--code-dir', self.code_dir,
+                '--lcov-path', self.tools['lcov'],
+                '--genhtml-path', self.tools['genhtml'],
+                '--disable-gcov-check', '1', '--quiet'] + list(args),
+                stdout=subprocess.DEVNULL)
+        return
+
+    def execs(self):
+        ### test cases the fake target ran so far, and reset the log
+        log = os.path.join(self.tmp_dir.name, 'tools', 'exec.log')
+        if not os.path.exists(log):
+            return []
+        with open(log) as f:
+            execs = [os.path.relpath(l.rstrip('\n'), self.fuzz_dir)
+                    for l in f]
+        os.unlink(log)
+        return execs
+
+    def cov_file(self, name):
+        ### lines of a cov/ file without the comment header
+        with open(os.path.join(self.fuzz_dir, 'cov', name)) as f:
+            return [l.rstrip('\n') for l in f if l[0] != '#']
+
+    def tracker(self, **opts):
+        return aflcov3.CoverageTracker(self.fuzz_dir, self.coverage_cmd,
+                self.code_dir, overwrite=True, lcov_path=self.tools['lcov'],
+                genhtml_path=self.tools['genhtml'], disable_lcov_web=True,
+                **opts)
+
+    def test_tracker_non_afl_names(self):
+        inputs = []
+        for name, data in [('a.bin', b'\x01'), ('b.bin', b'\x02'),
+                ('id:000007,orig:c', b'\x05')]:
+            inputs.append(os.path.join(self.tmp_dir.name, name))
+            with open(inputs[-1], 'wb') as f:
+                f.write(data)
+
+        with self.tracker() as tracker:
+            self.assertEqual(tracker.add_test_case(inputs[0])['exit_status'],
+                    0)
+            self.assertEqual(sorted(tracker.diff()['new']), ['/src/f1.c'])
+
+            ### a batch that cannot be named by an id range
+            tracker.add_test_case(inputs[1])
+            tracker.add_test_case(inputs[2])
+            self.assertEqual(sorted(tracker.diff()['new']), ['/src/f2.c'])
+            self.assertEqual(set(r['test_case'] for r in
+                    tracker.query(src_file='/src/f2.c')),
+                    set(['[b.bin id:000007,orig:c]']))
+
+        self.assertEqual(self.cov_file('id-delta-cov')[0],
+                'a.bin, 0, /src/f1.c, function, fn1()')
+        self.assertEqual([l.split(', ')[1] for l in
+                self.cov_file('plot_data')], ['-1', '7'])
+
+    def test_code_dir_walked_once(self):
+        walk   = os.walk
+        walked = []
+        def count_walk(top, *args, **kwargs):
+            walked.append(top)
+            return walk(top, *args, **kwargs)
+
+        ### the gcda dirs, the .gcno index and the cache fingerprint
+        cargs = parse_cmdline(['-d', self.fuzz_dir, '-e', self.coverage_cmd,
+                '-c', self.code_dir, '--lcov-path', self.tools['lcov'],
+                '--overwrite', '--quiet', '--staging-dir', self.tmp_dir.name,
+                '--pipeline', '--gcda-novelty', '--cov-cache-dir',
+                os.path.join(self.tmp_dir.name, 'cache')])
+        os.makedirs(self.fuzz_dir)
+        cov_paths = {}
+        with unittest.mock.patch('os.walk', count_walk):
+            self.assertTrue(init_tracking(cov_paths, cargs))
+        self.assertEqual(walked, [self.code_dir])
+        self.assertEqual(cov_paths['gcno_files'],
+                [os.path.join(self.code_dir, 'target.gcno')])
+
+    def test_coverage_every(self):
+        self.add_queue([('id:%06d,src:000000,op:havoc' % i, data)
+                for i, data in enumerate([b'\x01', b'\x02', b'\x01\x04',
+                    b'\x05', b'\x08'])])
+
+        ### one capture per two test cases, and the rest at the end
+        self.afl_cov('--overwrite', '--coverage-every', '2')
+        self.assertEqual(len(self.execs()), 5)
+        self.assertEqual(self.cov_file('id-delta-cov'),
+                ['id:[0-1]..., 0, /src/f1.c, function, fn1()',
+                'id:[0-1]..., 0, /src/f2.c, function, fn2()',
+                'id:[2-3]..., 0, /src/f1.c, function, fn4()',
+                'id:[2-3]..., 0, /src/f2.c, function, fn0()',
+                'id:[4-4]..., 0, /src/f2.c, function, fn3()'])
+
+    def test_plot_data(self):
+        self.add_queue([('id:%06d,src:000000,op:havoc' % i, data)
+                for i, data in enumerate([b'\x01', b'\x02', b'\x01\x04',
+                    b'\x02\x02'])])
+
+        ### id, cycle and covered/total lines, functions and branches
+        self.afl_cov('--overwrite', '--coverage-include-lines',
+                '--enable-branch-coverage')
+        self.assertEqual([l.split(', ')[1:] for l in
+                self.cov_file('plot_data')],
+                [['0', '0', '1', '60', '1', '15', '1', '120'],
+                ['1', '0', '2', '60', '2', '15', '2', '120'],
+                ['2', '0', '3', '60', '3', '15', '3', '120'],
+                ['3', '0', '3', '60', '3', '15', '3', '120']])
+
+    def test_cov_cache(self):
+        self.add_queue([('id:%06d,src:000000,op:havoc' % i, data)
+                for i, data in enumerate([b'\x01', b'\x02\x03', b'crash',
+                    b'\x01\x04'])])
+        cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+        self.afl_cov('--overwrite', '--coverage-include-lines',
+                '--cov-cache-dir', cache_dir)
+        expected = self.cov_file('id-delta-cov')
+        self.assertEqual(len(self.execs()), 4)
+
+        ### every test case is served from the cache on a rerun
+        self.afl_cov('--overwrite', '--coverage-include-lines',
+                '--cov-cache-dir', cache_dir)
+        self.assertEqual(self.cov_file('id-delta-cov'), expected)
+        self.assertEqual(self.execs(), [])
+        with open(os.path.join(self.fuzz_dir, 'cov', 'afl-cov.log')) as f:
+            self.assertIn("[+] Used cached coverage results for 4 test " \
+                    "cases.", f.read())
+
+        ### a rebuild changes the fingerprint
+        os.utime(os.path.join(self.code_dir, 'target.gcno'), (0, 0))
+        self.afl_cov('--overwrite', '--coverage-include-lines',
+                '--cov-cache-dir', cache_dir)
+        self.assertEqual(self.cov_file('id-delta-cov'), expected)
+        self.assertEqual(len(self.execs()), 4)
+
+    def test_staging_dir(self):
+        self.add_queue([('id:%06d,src:000000,op:havoc' % i, data)
+                for i, data in enumerate([b'\x01', b'\x02\x03',
+                    b'\x01\x04'])])
+        self.afl_cov('--overwrite', '--coverage-include-lines')
+        expected = self.cov_file('id-delta-cov')
+        os.unlink(os.path.join(self.code_dir, 'target.gcda'))
+
+        ### counters and traces only live under --staging-dir, which is
+        ### removed at exit once the final trace is saved under cov/lcov/
+        staging_dir = os.path.join(self.tmp_dir.name, 'shm')
+        os.makedirs(staging_dir)
+        self.afl_cov('--overwrite', '--coverage-include-lines',
+                '--staging-dir', staging_dir)
+        self.assertEqual(self.cov_file('id-delta-cov'), expected)
+        self.assertFalse(os.path.exists(os.path.join(self.code_dir,
+                'target.gcda')))
+        self.assertEqual(os.listdir(staging_dir), [])
+        lcov_dir = os.path.join(self.fuzz_dir, 'cov', 'lcov')
+        self.assertEqual(sorted(os.listdir(lcov_dir)),
+                ['trace.lcov_base', 'trace.lcov_info_final'])
+
+    def test_web_report_debounce(self):
+        cargs = parse_cmdline(['-d', self.fuzz_dir, '-e', self.coverage_cmd,
+                '-c', self.code_dir, '--genhtml-path', self.tools['genhtml'],
+                '--lcov-web-all', '--lcov-web-interval', '60', '--quiet'])
+        cov_paths = {'lcov_web': os.path.join(self.tmp_dir.name, 'web.info'),
+                'web_dir': os.path.join(self.tmp_dir.name, 'web'),
+                'log_file': os.path.join(self.tmp_dir.name, 'log')}
+        trace = os.path.join(self.tmp_dir.name, 'trace')
+        web_reports = WebReportScheduler(self.fuzz_dir, cov_paths, cargs)
+
+        ### the first report is generated right away
+        with open(trace, 'w') as f:
+            f.write('SF:/src/f0.c\nend_of_record\n')
+        web_reports.request(trace)
+        for i in range(100):
+            if web_reports.runs:
+                break
+            time.sleep(0.05)
+        self.assertTrue(os.path.exists(os.path.join(cov_paths['web_dir'],
+                'index.html')))
+
+        ### later requests within --lcov-web-interval are coalesced into
+        ### the latest snapshot
+        for i in range(1, 4):
+            with open(trace, 'w') as f:
+                f.write('SF:/src/f%d.c\nend_of_record\n' % i)
+            web_reports.request(trace)
+        with open(web_reports.pending_file) as f:
+            self.assertEqual(f.read(), 'SF:/src/f3.c\nend_of_record\n')
+
+        web_reports.stop()
+        self.assertEqual((web_reports.runs, web_reports.requests), (1, 4))
+        self.assertFalse(os.path.exists(web_reports.pending_file))
+
+    def test_metrics(self):
+        queue = self.add_queue([('id:000000,orig:a', b'\x01'),
+                ('id:000001,src:000000,op:havoc', b'\x01\x02'),
+                ('id:000002,src:000000,op:havoc', b'\x01')])
+        sock_path = os.path.join(self.tmp_dir.name, 'metrics.sock')
+
+        with self.tracker(metrics_listen='unix:' + sock_path) as tracker:
+            for name in sorted(os.listdir(queue)):
+                tracker.add_test_case(os.path.join(queue, name))
+                tracker.diff()
+
+            sock = socket.socket(socket.AF_UNIX)
+            sock.connect(sock_path)
+            sock.sendall(b'GET /metrics HTTP/1.0\r\n\r\n')
+            resp = b''
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                resp += data
+            sock.close()
+
+        header, body = resp.decode('utf-8').split('\r\n\r\n', 1)
+        self.assertTrue(header.startswith('HTTP/1.0 200'))
+        for sample in ['afl_cov_duplicates_total 1',
+                'afl_cov_covered{type="function"} 2',
+                'afl_cov_covered{type="line"} 2',
+                'afl_cov_instrumented{type="line"} 60',
+                'afl_cov_stage_seconds_count{stage="exec"} 2']:
+            self.assertIn(sample, body.split('\n'))
+        self.assertFalse(os.path.exists(sock_path))
+
+    def test_sample_fraction(self):
+        self.add_queue([('id:%06d,src:000000,op:havoc' % i,
+                bytes([i, 3 * i + 1])) for i in range(8)])
+        self.afl_cov('--overwrite', '--coverage-include-lines')
+        expected = (self.cov_file('pos-cov'), self.cov_file('zero-cov'))
+        self.execs()
+
+        ### 2, 2 more and then the remaining 4 test cases, each only once
+        self.afl_cov('--overwrite', '--coverage-include-lines',
+                '--sample-fraction', '0.25')
+        self.assertEqual(len(self.execs()), 8)
+        self.assertEqual((self.cov_file('pos-cov'),
+                self.cov_file('zero-cov')), expected)
+
+        rows = [l.split(', ') for l in self.cov_file('coverage-estimate')]
+        self.assertEqual([(r[1], r[2], r[3]) for r in rows],
+                [('2', '8', 'function'), ('2', '8', 'line'),
+                ('4', '8', 'function'), ('4', '8', 'line'),
+                ('8', '8', 'function'), ('8', '8', 'line')])
+        for r in rows[:4]:
+            self.assertLessEqual(int(r[6]), int(r[5]))
+            self.assertLessEqual(int(r[5]), int(r[7]))
+            self.assertLessEqual(int(r[7]), int(r[8]))
+
+        ### the last pass covers the whole queue, so it is exact
+        self.assertEqual([r[4:8] for r in rows[4:]],
+                [['10', '10', '10', '10'], ['13', '13', '13', '13']])
+
+    def test_multi_target(self):
+        self.add_queue([('id:%06d,src:000000,op:havoc' % i, data)
+                for i, data in enumerate([b'\x01', b'\x02\x03', b'\x01',
+                    b'\x01\x04'])])
+        self.afl_cov('--overwrite', '--coverage-include-lines')
+        expected = self.cov_file('id-delta-cov')
+        self.assertEqual(len(self.execs()), 3)
+
+        ### a second build of the same target, each test case is replayed
+        ### against both with results under cov/<name>/
+        code_dir = os.path.join(self.tmp_dir.name, 'code2')
+        os.makedirs(code_dir)
+        open(os.path.join(code_dir, 'target.gcno'), 'w').close()
+        gcda_files = [os.path.join(d, 'target.gcda')
+                for d in [self.code_dir, code_dir]]
+        os.unlink(gcda_files[0])
+
+        self.coverage_cmd = 'gcc=' + self.coverage_cmd
+        self.code_dir     = 'gcc=' + self.code_dir
+        self.afl_cov('--overwrite', '--coverage-include-lines',
+                '-e', 'clang=%s AFL_FILE %s' % (self.tools['target'],
+                code_dir), '-c', 'clang=' + code_dir)
+        self.assertEqual(self.cov_file('gcc/id-delta-cov'), expected)
+        self.assertEqual(self.cov_file('clang/id-delta-cov'), expected)
+        self.assertEqual(len(self.execs()), 6)
+        for gcda in gcda_files:
+            self.assertTrue(os.path.exists(gcda))
+
+    def test_include_src(self):
+        self.add_queue([('id:%06d,src:000000,op:havoc' % i, data)
+                for i, data in enumerate([b'\x01', b'\x02\x03',
+                    b'\x01\x04'])])
+
+        ### nothing outside of the matching source files is tracked
+        self.afl_cov('--overwrite', '--coverage-include-lines',
+                '--include-src', '*/f1.c')
+        self.assertEqual([l.split(', ', 2)[2] for l in
+                self.cov_file('id-delta-cov')],
+                ['/src/f1.c, function, fn1()', '/src/f1.c, line, 1',
+                '/src/f1.c, function, fn4()', '/src/f1.c, line, 4'])
+        for name in ['pos-cov', 'zero-cov']:
+            self.assertEqual([l for l in self.cov_file(name)
+                    if l.startswith('File:')], ['File: /src/f1.c'])
+
+    def test_function_granularity(self):
+        self.add_queue([('id:%06d,src:000000,op:havoc' % i, data)
+                for i, data in enumerate([b'\x01', b'\x02\x03', b'\x06',
+                    b'\x01\x04'])])
+        self.afl_cov('--overwrite', '--coverage-include-lines')
+        expected = [[l for l in self.cov_file(name) if 'line' not in l]
+                for name in ['id-delta-cov', 'pos-cov', 'zero-cov']]
+
+        ### the same functions without any line data
+        self.afl_cov('--overwrite', '--granularity', 'function')
+        self.assertEqual([self.cov_file(name) for name in ['id-delta-cov',
+                'pos-cov', 'zero-cov']], expected)
+        self.assertEqual([l.split(', ')[3:7] for l in
+                self.cov_file('plot_data')][-1], ['0', '0', '5', '15'])
+
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.afl_cov('--overwrite', '--granularity', 'function',
+                    '--coverage-include-lines')
+
+    def test_showmap_prefilter(self):
+        ### byte 7 is the same edge as byte 0 but a new line
+        self.add_queue([('id:000000,orig:a', b'\x00'),
+                ('id:000001,src:000000,op:havoc', b'\x07'),
+                ('id:000002,src:000000,op:havoc', b'\x01')])
+        staging_dir = os.path.join(self.tmp_dir.name, 'staging')
+        os.makedirs(staging_dir)
+
+        self.afl_cov('--overwrite', '--coverage-include-lines',
+                '--showmap-cmd', self.tools['target'] + ' AFL_FILE',
+                '--afl-showmap-path',
+                self.tools['afl-showmap'], '--staging-dir', staging_dir)
+
+        ### the missed line is found by the verification sweep
+        delta = self.cov_file('id-delta-cov')
+        self.assertIn('id:[1-1]..., 0, /src/f1.c, line, 7', delta)
+        self.assertIn('id:000002,src:000000,op:havoc, 0, /src/f1.c, line, 1',
+                delta)
+
+        ### the afl-showmap output is staged along with the traces
+        with open(os.path.join(self.tmp_dir.name, 'tools',
+                'showmap.log')) as f:
+            outs = set(l.rstrip('\n') for l in f)
+        self.assertEqual(len(outs), 1)
+        self.assertTrue(outs.pop().startswith(staging_dir + '/'))
+        self.assertFalse(os.path.exists(os.path.join(self.fuzz_dir, 'cov',
+                'lcov', 'showmap')))
+
+    def test_pipeline_parity(self):
+        ### the crashing test case has no coverage at all
+        self.add_queue([('id:%06d,src:000000,op:havoc' % i, data)
+                for i, data in enumerate([b'\x00\x01', b'crash', b'\x05',
+                    b'\x01\x00', b'\x07\x08\x09', b'\x05'])])
+        results = []
+        for mode in [[], ['--pipeline', '--pipeline-slots', '3']]:
+            self.afl_cov('--overwrite', '--coverage-include-lines',
+                    '--enable-branch-coverage', '--exact-coverage', *mode)
+            store = exact_store_load(os.path.join(self.fuzz_dir, 'cov',
+                    'exact'))
+            results.append((self.cov_file('id-delta-cov'),
+                    self.cov_file('zero-cov'), self.cov_file('pos-cov'),
+                    sorted(os.path.basename(f) for f in store['ids'])))
+
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(len(results[0][3]), 6)
+
+    def test_dedup(self):
+        f1 = self.add_queue([('id:000000,orig:a', b'\x01'),
+                ('id:000001,src:000000,op:havoc', b'\x02')], 'f1/queue')
+        self.add_queue([('id:000000,sync:f1,src:000000', b'\x01'),
+                ('id:000001,src:000000,op:havoc', b'\x04')], 'f2/queue')
+        dup = 'id:000000,sync:f1,src:000000, 0, , duplicate, %s' \
+                % os.path.join(f1, 'id:000000,orig:a')
+
+        self.afl_cov('--overwrite')
+        self.assertIn(dup, self.cov_file('id-delta-cov'))
+        self.assertNotIn('f2/queue/id:000000,sync:f1,src:000000',
+                self.execs())
+        self.assertFalse(os.path.exists(os.path.join(self.fuzz_dir, 'cov',
+                'dedup-index')))
+
+        ### a --dedup-index outside of cov/ survives --overwrite, and only
+        ### the sync copy is skipped again
+        index = os.path.join(self.tmp_dir.name, 'dedup-index')
+        for i in range(2):
+            self.afl_cov('--overwrite', '--dedup-index', index,
+                    '--disable-coverage-init')
+            self.assertIn(dup, self.cov_file('id-delta-cov'))
+            self.assertEqual(sorted(self.execs()),
+                    ['f1/queue/id:000000,orig:a',
+                    'f1/queue/id:000001,src:000000,op:havoc',
+                    'f2/queue/id:000001,src:000000,op:havoc'])
+        with open(index) as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+        ### with the dedup disabled every copy is executed
+        self.afl_cov('--overwrite', '--disable-test-case-dedup')
+        self.assertEqual(len(self.execs()), 4)
+        self.assertEqual([l for l in self.cov_file('id-delta-cov')
+                if 'duplicate' in l], [])
+
+    def test_minimize(self):
+        self.add_queue([('id:000000,orig:a', b'\x00\x01\x02'),
+                ('id:000001,src:000000,op:havoc', b'\x01'),
+                ('id:000002,src:000000,op:havoc', b'\x03'),
+                ('id:000003,src:000002,op:havoc', b'\x00\x03')])
+        min_dir = os.path.join(self.tmp_dir.name, 'min')
+
+        self.afl_cov('--overwrite', '--enable-branch-coverage', '--minimize',
+                '--minimize-dir', min_dir)
+        self.assertEqual(sorted(os.listdir(min_dir)),
+                ['id:000000,orig:a', 'id:000002,src:000000,op:havoc'])
+        self.assertEqual([l.split(', ')[:3] for l in
+                self.cov_file('min-corpus-manifest')],
+                [['id:000000,orig:a', '9', '3'],
+                ['id:000002,src:000000,op:havoc', '3', '1']])
+
+        ### an earlier corpus is not mixed into the new one
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.afl_cov('--overwrite', '--minimize', '--minimize-dir',
+                    min_dir)
+
+    def test_exec_timeout(self):
+        self.add_queue([('id:000000,orig:a', b'\x01'),
+                ('id:000001,src:000000,op:havoc', b'sleep'),
+                ('id:000002,src:000000,op:havoc', b'\x02')])
+        self.add_queue([('id:000000,src:000002,op:havoc', b'\x09')],
+                'crashes')
+
+        self.afl_cov('--overwrite', '--coverage-include-lines',
+                '--exec-timeout', '1', '--replay-crashes')
+        with open(os.path.join(self.fuzz_dir, 'cov', 'afl-cov.log')) as f:
+            self.assertIn("[+] Killed 1 test case executions after the 1 " \
+                    "second --exec-timeout.", f.read())
+
+        ### the test cases after the hang and the crash are still covered
+        delta = self.cov_file('id-delta-cov')
+        self.assertIn('id:000002,src:000000,op:havoc, 0, /src/f2.c, line, 2',
+                delta)
+        self.assertIn('id:000000,src:000002,op:havoc, 0, /src/f0.c, line, 9',
+                delta)
+
+    def test_gcda_novelty(self):
+        ### id:1 and id:2 only grow counters that id:0 already set
+        self.add_queue([('id:000000,orig:a', b'\x01\x02'),
+                ('id:000001,src:000000,op:havoc', b'\x01'),
+                ('id:000002,src:000000,op:havoc', b'\x02\x01'),
+                ('id:000003,src:000000,op:havoc', b'\x03'),
+                ('id:000004,src:000000,op:havoc', b'\x03\x03')])
+        self.afl_cov('--overwrite', '--coverage-include-lines')
+        expected = self.cov_file('id-delta-cov')
+        self.execs()
+
+        self.afl_cov('--overwrite', '--coverage-include-lines',
+                '--gcda-novelty')
+        self.assertEqual(self.cov_file('id-delta-cov'), expected)
+        self.assertEqual(len(self.execs()), 5)
+        with open(os.path.join(self.fuzz_dir, 'cov', 'afl-cov.log')) as f:
+            log = f.read()
+        self.assertEqual(log.count('No new gcda counters'), 3)
+        self.assertEqual(log.count('Verification capture over 2 test cases'),
+                1)
+        self.assertEqual(log.count('Verification capture over 1 test cases'),
+                1)
+
+if __name__ == "__main__":
+    unittest.main()